@@ -2,6 +2,10 @@
 
 import streamlit as st
 
+from src.profiling import FirstRenderTimer, profiling_enabled
+
+timer = FirstRenderTimer() if profiling_enabled() else None
+
 st.set_page_config(
     page_title="Spotify Diffusion Predictor",
     page_icon="🎵",
@@ -32,3 +36,8 @@ if mode == "Demo":
 else:
     from views.production import render
     render()
+
+if timer is not None:
+    message = timer.report(mode)
+    if message:
+        st.sidebar.caption(message)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Mergeable distinct counters used by the v1 ingestion profile.
+
+Two backends share the same interface (``add`` / ``merge`` / ``count`` /
+``save`` / ``load``) so per-worker counters can be combined:
+
+- ``exact``: sorted uint64 hash sets, spilled to ``.npy`` runs once the
+  in-memory buffer grows past ``max_items``, and counted, saved and merged
+  by a streaming k-way merge over the sorted runs.
+- ``hll``: HyperLogLog registers sized from a target relative error.
+"""
+from __future__ import annotations
+
+import math
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+DISTINCT_BACKENDS = ["exact", "hll"]
+
+
+def hash_values(series: pd.Series) -> np.ndarray:
+    cleaned = series.astype("string").str.strip()
+    cleaned = cleaned[cleaned.notna() & (cleaned != "")]
+    if cleaned.empty:
+        return np.empty(0, dtype=np.uint64)
+    # hash_array uses a fixed key, so hashes agree across processes and runs.
+    return pd.util.hash_array(cleaned.to_numpy(dtype=object), categorize=False)
+
+
+class ExactDistinctCounter:
+    backend = "exact"
+
+    def __init__(self, spill_dir: Path | None = None, max_items: int = 5_000_000) -> None:
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self.max_items = max_items
+        self._buffer: list[np.ndarray] = []
+        self._buffered = 0
+        self._runs: list[Path] = []
+
+    @property
+    def error(self) -> float:
+        return 0.0
+
+    def add(self, series: pd.Series) -> None:
+        self.add_hashes(hash_values(series))
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        if hashes.size == 0:
+            return
+        self._buffer.append(np.unique(hashes))
+        self._buffered += self._buffer[-1].size
+        if self._buffered > self.max_items:
+            self._compact()
+
+    def _compact(self) -> None:
+        merged = self._consolidated_buffer()
+        if merged.size <= self.max_items // 2 or self.spill_dir is None:
+            self._buffer = [merged]
+            self._buffered = merged.size
+            return
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        # mkstemp names are unique across counters and processes sharing spill_dir
+        fd, run_path = tempfile.mkstemp(prefix="run-", suffix=".npy", dir=self.spill_dir)
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, merged)
+        self._runs.append(Path(run_path))
+        self._buffer = []
+        self._buffered = 0
+
+    def _consolidated_buffer(self) -> np.ndarray:
+        if not self._buffer:
+            return np.empty(0, dtype=np.uint64)
+        return np.unique(np.concatenate(self._buffer))
+
+    def iter_hashes(self, block_items: int = 1_000_000):
+        """Yield the distinct hashes in ascending, disjoint sorted chunks.
+
+        A k-way merge over the buffer and the spilled runs: each round reads
+        up to block_items from every source and emits everything up to the
+        smallest last value among blocks that do not end their source, so
+        memory stays at about k * block_items however many hashes there are.
+        """
+        sources = [self._consolidated_buffer()]
+        sources += [np.load(run_path, mmap_mode="r") for run_path in self._runs]
+        sources = [source for source in sources if source.size]
+        positions = [0] * len(sources)
+        while True:
+            active = [i for i, source in enumerate(sources) if positions[i] < source.size]
+            if not active:
+                return
+            blocks = {i: sources[i][positions[i]:positions[i] + block_items] for i in active}
+            bounds = [
+                blocks[i][-1] for i in active if positions[i] + blocks[i].size < sources[i].size
+            ]
+            parts = []
+            for i in active:
+                block = blocks[i]
+                take = int(np.searchsorted(block, min(bounds), side="right")) if bounds else block.size
+                parts.append(block[:take])
+                positions[i] += take
+            yield np.unique(np.concatenate(parts))
+
+    def merge(self, other: "ExactDistinctCounter") -> None:
+        for chunk in other.iter_hashes(self.max_items // 4 or 1):
+            self.add_hashes(chunk)
+
+    def count(self) -> int:
+        return sum(int(chunk.size) for chunk in self.iter_hashes())
+
+    def save(self, path: Path) -> None:
+        out = np.lib.format.open_memmap(Path(path), mode="w+", dtype=np.uint64, shape=(self.count(),))
+        offset = 0
+        for chunk in self.iter_hashes():
+            out[offset:offset + chunk.size] = chunk
+            offset += chunk.size
+        out.flush()
+        del out
+
+    @classmethod
+    def load(cls, path: Path, spill_dir: Path | None = None) -> "ExactDistinctCounter":
+        counter = cls(spill_dir=spill_dir)
+        saved = np.load(Path(path), mmap_mode="r")
+        step = counter.max_items // 4 or 1
+        for start in range(0, saved.size, step):
+            counter.add_hashes(np.asarray(saved[start:start + step]))
+        return counter
+
+    def cleanup(self) -> None:
+        for run_path in self._runs:
+            run_path.unlink(missing_ok=True)
+        self._runs = []
+
+
+class HyperLogLogCounter:
+    backend = "hll"
+
+    def __init__(self, error: float = 0.01) -> None:
+        # Standard error of HLL is ~1.04 / sqrt(m); pick the smallest m = 2**p meeting it.
+        p = math.ceil(math.log2((1.04 / error) ** 2))
+        self.p = min(max(p, 4), 18)
+        self.m = 1 << self.p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    @property
+    def error(self) -> float:
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, series: pd.Series) -> None:
+        self.add_hashes(hash_values(series))
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        if hashes.size == 0:
+            return
+        hashes = hashes.astype(np.uint64, copy=False)
+        width = 64 - self.p
+        idx = (hashes >> np.uint64(width)).astype(np.intp)
+        rest = hashes & np.uint64((1 << width) - 1)
+        rho = (width - _bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rho)
+
+    def merge(self, other: "HyperLogLogCounter") -> None:
+        if other.p != self.p:
+            raise ValueError(f"Cannot merge HLL sketches with p={self.p} and p={other.p}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        m = float(self.m)
+        alpha = 0.7213 / (1.0 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int32))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def save(self, path: Path) -> None:
+        np.save(Path(path), self.registers)
+
+    @classmethod
+    def load(cls, path: Path) -> "HyperLogLogCounter":
+        registers = np.load(Path(path))
+        counter = cls()
+        counter.p = int(registers.size).bit_length() - 1
+        counter.m = int(registers.size)
+        counter.registers = registers.astype(np.uint8)
+        return counter
+
+    def cleanup(self) -> None:
+        pass
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    # frexp is exact for 32-bit halves, unlike log2 on the full uint64.
+    hi = (values >> np.uint64(32)).astype(np.float64)
+    lo = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    hi_bits = np.frexp(hi)[1]
+    lo_bits = np.frexp(lo)[1]
+    return np.where(hi > 0, hi_bits + 32, lo_bits)
+
+
+def make_distinct_counter(
+    backend: str, spill_dir: Path | None = None, error: float = 0.01,
+) -> ExactDistinctCounter | HyperLogLogCounter:
+    if backend == "exact":
+        return ExactDistinctCounter(spill_dir=spill_dir)
+    if backend == "hll":
+        return HyperLogLogCounter(error=error)
+    raise ValueError(f"Unknown distinct backend: {backend!r}. Expected one of {DISTINCT_BACKENDS}.")
@@ -3,30 +3,119 @@ import argparse
 import csv
 import hashlib
 import json
+import mmap
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 
+# Files at least this large are hashed through mmap instead of buffered reads.
+MMAP_THRESHOLD_BYTES = 64 * 1024 * 1024
+READ_CHUNK_BYTES = 8 * 1024 * 1024
+HASH_CACHE_VERSION = 1
+
 
 def sha256_file(path: Path) -> str:
     h = hashlib.sha256()
+    size = path.stat().st_size
     with path.open('rb') as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b''):
-            h.update(chunk)
+        if size >= MMAP_THRESHOLD_BYTES:
+            # hashlib releases the GIL for large buffers, so mmap'd files hash in parallel threads.
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+        else:
+            for chunk in iter(lambda: f.read(READ_CHUNK_BYTES), b''):
+                h.update(chunk)
     return h.hexdigest()
 
 
-def list_files_with_hashes(root: Path):
-    items = []
-    for p in sorted(root.rglob('*')):
-        if p.is_file():
-            items.append(
-                {
-                    'path': str(p),
-                    'size_bytes': p.stat().st_size,
-                    'sha256': sha256_file(p),
-                }
-            )
-    return items
+class HashCache:
+    """(path, size, mtime_ns) -> sha256 cache persisted as JSON."""
+
+    def __init__(self, path: Path | None):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path is not None and path.exists():
+            try:
+                with path.open(encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == HASH_CACHE_VERSION:
+                    self.entries = data.get('entries', {})
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def digest(self, path: Path) -> tuple[int, str]:
+        st = path.stat()
+        key = str(path.resolve())
+        entry = self.entries.get(key)
+        if entry and entry['size_bytes'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            with self._lock:
+                self.hits += 1
+            return st.st_size, entry['sha256']
+        digest = sha256_file(path)
+        with self._lock:
+            self.misses += 1
+            self.entries[key] = {'size_bytes': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': digest}
+        return st.st_size, digest
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump({'version': HASH_CACHE_VERSION, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+
+def hash_files(paths, cache: HashCache, workers: int):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(cache.digest, paths))
+
+
+def list_files_with_hashes(root: Path, cache: HashCache, workers: int):
+    paths = [p for p in sorted(root.rglob('*')) if p.is_file()]
+    return [
+        {
+            'path': str(p),
+            'size_bytes': size,
+            'sha256': digest,
+        }
+        for p, (size, digest) in zip(paths, hash_files(paths, cache, workers))
+    ]
+
+
+# Sync and hashing scratch files that never belong to a version tree.
+TREE_EXCLUDE_SUFFIXES = ('.partial', '.sync-tmp', '.tmp')
+
+
+def tree_file_entries(root: Path, cache: HashCache, workers: int, exclude=()):
+    """Generic per-file list for any version tree: POSIX paths relative to root.
+
+    Hidden files and directories (hash caches, the .cas store), sync scratch
+    files and the paths in exclude (e.g. the manifest itself) are skipped.
+    """
+    excluded = {Path(p).resolve() for p in exclude}
+    paths = [
+        p for p in sorted(root.rglob('*'))
+        if p.is_file()
+        and not any(part.startswith('.') for part in p.relative_to(root).parts)
+        and not p.name.endswith(TREE_EXCLUDE_SUFFIXES)
+        and p.resolve() not in excluded
+    ]
+    return [
+        {
+            'path': p.relative_to(root).as_posix(),
+            'size_bytes': size,
+            'sha256': digest,
+        }
+        for p, (size, digest) in zip(paths, hash_files(paths, cache, workers))
+    ]
 
 
 def read_row_accounting(path: Path):
@@ -49,15 +138,114 @@ def read_profile_overview(path: Path):
         return row or {}
 
 
+def manifest_file_entries(manifest: dict, output_root: Path | None = None):
+    """Yield (path, size_bytes, sha256) for every hashed file in a manifest.
+
+    Reads the generic ``files`` list (paths relative to ``root``), falling
+    back to the v1 ``artifacts`` layout for manifests written before it.
+    When output_root is given, paths are rebased from the recorded root onto
+    it, so a manifest can be checked against another copy.
+    """
+    if 'files' in manifest:
+        root = Path(manifest['root']) if output_root is None else output_root
+        for item in manifest['files']:
+            yield root / item['path'], item['size_bytes'], item['sha256']
+        return
+    for name in ('full', 'slim'):
+        artifact = manifest['artifacts'][name]
+        recorded_root = Path(artifact['root'])
+        for item in artifact['files']:
+            path = Path(item['path'])
+            if output_root is not None:
+                path = output_root / name / path.relative_to(recorded_root)
+            yield path, item['size_bytes'], item['sha256']
+    quarantine = manifest['artifacts']['quarantine']
+    if quarantine['exists']:
+        path = Path(quarantine['path'])
+        if output_root is not None:
+            path = output_root / path.name
+        yield path, quarantine['size_bytes'], quarantine['sha256']
+
+
+def verify_manifest(manifest_path: Path, output_root: Path | None, cache: HashCache, workers: int):
+    with manifest_path.open(encoding='utf-8') as f:
+        manifest = json.load(f)
+    entries = list(manifest_file_entries(manifest, output_root))
+
+    def check(entry):
+        path, size, sha256 = entry
+        if not path.is_file():
+            return path, 'missing'
+        if path.stat().st_size != size:
+            return path, 'size_mismatch'
+        if cache.digest(path)[1] != sha256:
+            return path, 'sha256_mismatch'
+        return path, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(check, entries))
+    return [(path, problem) for path, problem in results if problem is not None], len(entries)
+
+
+def write_manifest(manifest_path: Path, manifest: dict):
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with manifest_path.open('w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
 def main():
     parser = argparse.ArgumentParser(description='Generate dataset manifest for processed artifacts.')
-    parser.add_argument('--source-csv', required=True)
-    parser.add_argument('--output-root', required=True)
+    parser.add_argument('--source-csv')
+    parser.add_argument('--output-root')
+    parser.add_argument(
+        '--tree',
+        help='Write a generic per-file manifest for any version tree (e.g. datasets/v2) instead of the v1 layout',
+    )
     parser.add_argument('--manifest-path', required=True)
-    parser.add_argument('--schema-version', required=True)
+    parser.add_argument('--schema-version')
     parser.add_argument('--dataset-version', default='v1')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--hash-cache', default=None, help='Digest cache file (default: .sha256_cache.json next to the manifest)')
+    parser.add_argument('--no-hash-cache', action='store_true')
+    parser.add_argument(
+        '--verify', action='store_true',
+        help='Check files against an existing --manifest-path instead of writing one',
+    )
     args = parser.parse_args()
 
+    if args.no_hash_cache:
+        cache = HashCache(None)
+    else:
+        cache = HashCache(Path(args.hash_cache) if args.hash_cache else Path(args.manifest_path).parent / '.sha256_cache.json')
+
+    if args.verify:
+        output_root = Path(args.output_root) if args.output_root else None
+        problems, checked = verify_manifest(Path(args.manifest_path), output_root, cache, args.workers)
+        cache.save()
+        for path, problem in problems:
+            print(f'{problem}\t{path}')
+        print(f'Verified {checked} files: {len(problems)} mismatches.')
+        sys.exit(1 if problems else 0)
+
+    if args.tree:
+        tree_root = Path(args.tree)
+        manifest_path = Path(args.manifest_path)
+        files = tree_file_entries(tree_root, cache, args.workers, exclude=[manifest_path])
+        cache.save()
+        write_manifest(manifest_path, {
+            'dataset_version': args.dataset_version,
+            'schema_version': args.schema_version,
+            'created_at_utc': datetime.now(timezone.utc).isoformat(),
+            'root': str(tree_root),
+            'files': files,
+        })
+        return
+
+    missing = [f'--{a.replace("_", "-")}' for a in ('source_csv', 'output_root', 'schema_version') if not getattr(args, a)]
+    if missing:
+        parser.error(f'the following arguments are required: {", ".join(missing)}')
+
     source_csv = Path(args.source_csv)
     output_root = Path(args.output_root)
     manifest_path = Path(args.manifest_path)
@@ -66,6 +254,27 @@ def main():
     slim_root = output_root / 'slim'
     quarantine_file = output_root / 'quarantine.parquet'
 
+    # Hash the large source CSV alongside the artifact trees rather than before them.
+    with ThreadPoolExecutor(max_workers=1) as source_pool:
+        source_future = source_pool.submit(cache.digest, source_csv)
+        full_files = list_files_with_hashes(full_root, cache, args.workers) if full_root.exists() else []
+        slim_files = list_files_with_hashes(slim_root, cache, args.workers) if slim_root.exists() else []
+        quarantine_digest = cache.digest(quarantine_file)[1] if quarantine_file.exists() else None
+        source_size, source_digest = source_future.result()
+    cache.save()
+
+    # The same files as one generic list relative to output_root, which is what sync reads
+    files = [
+        {**item, 'path': Path(item['path']).relative_to(output_root).as_posix()}
+        for item in full_files + slim_files
+    ]
+    if quarantine_file.exists():
+        files.append({
+            'path': quarantine_file.name,
+            'size_bytes': quarantine_file.stat().st_size,
+            'sha256': quarantine_digest,
+        })
+
     row_accounting = read_row_accounting(output_root / 'row_accounting.csv')
     profile_overview = read_profile_overview(output_root / 'profile_overview.csv')
 
@@ -75,25 +284,27 @@ def main():
         'created_at_utc': datetime.now(timezone.utc).isoformat(),
         'source': {
             'path': str(source_csv),
-            'size_bytes': source_csv.stat().st_size,
-            'sha256': sha256_file(source_csv),
+            'size_bytes': source_size,
+            'sha256': source_digest,
         },
         'profile_overview': profile_overview,
         'row_accounting': row_accounting,
+        'root': str(output_root),
+        'files': files,
         'artifacts': {
             'full': {
                 'root': str(full_root),
-                'files': list_files_with_hashes(full_root) if full_root.exists() else [],
+                'files': full_files,
             },
             'slim': {
                 'root': str(slim_root),
-                'files': list_files_with_hashes(slim_root) if slim_root.exists() else [],
+                'files': slim_files,
             },
             'quarantine': {
                 'path': str(quarantine_file),
                 'exists': quarantine_file.exists(),
                 'size_bytes': quarantine_file.stat().st_size if quarantine_file.exists() else 0,
-                'sha256': sha256_file(quarantine_file) if quarantine_file.exists() else None,
+                'sha256': quarantine_digest,
             },
             'reports': {
                 'source_schema_csv': str(output_root / 'source_schema.csv'),
@@ -104,10 +315,7 @@ def main():
         },
     }
 
-    manifest_path.parent.mkdir(parents=True, exist_ok=True)
-    with manifest_path.open('w', encoding='utf-8') as f:
-        json.dump(manifest, f, indent=2, sort_keys=True)
-        f.write('\n')
+    write_manifest(manifest_path, manifest)
 
 
 if __name__ == '__main__':
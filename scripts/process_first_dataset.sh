@@ -5,11 +5,13 @@ ROOT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
 DATASET_VERSION="${DATASET_VERSION:-v1}"
 INPUT_CSV="${1:-${ROOT_DIR}/datasets/merged_data.csv}"
 OUTPUT_ROOT="${2:-${ROOT_DIR}/datasets/${DATASET_VERSION}}"
-DB_FILE="${3:-${OUTPUT_ROOT}/processing.sqlite}"
+SPILL_DIR="${3:-${OUTPUT_ROOT}/.distinct_spill}"
 MANIFEST_PATH="${MANIFEST_PATH:-${ROOT_DIR}/datasets/manifest.${DATASET_VERSION}.json}"
 SCHEMA_VERSION="${SCHEMA_VERSION:-${DATASET_VERSION}}"
 CHUNKSIZE="${CHUNKSIZE:-150000}"
 JOIN_AUX="${JOIN_AUX:-0}"
+DISTINCT_BACKEND="${DISTINCT_BACKEND:-exact}"
+HLL_ERROR="${HLL_ERROR:-0.01}"
 AUX_ROOT="${AUX_ROOT:-${ROOT_DIR}/datasets/${DATASET_VERSION}_aux}"
 
 if ! command -v python3 >/dev/null 2>&1; then
@@ -28,8 +30,10 @@ PROCESS_CMD=(
   python3 "${ROOT_DIR}/scripts/process_first_dataset_pandas.py"
   --input-csv "${INPUT_CSV}"
   --output-root "${OUTPUT_ROOT}"
-  --db-file "${DB_FILE}"
+  --spill-dir "${SPILL_DIR}"
   --chunksize "${CHUNKSIZE}"
+  --distinct-backend "${DISTINCT_BACKEND}"
+  --hll-error "${HLL_ERROR}"
 )
 
 if [[ "${JOIN_AUX}" == "1" ]]; then
@@ -2,12 +2,20 @@
 import argparse
 import csv
 import shutil
-import sqlite3
 import re
+import time
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
+from distinct_counters import DISTINCT_BACKENDS, make_distinct_counter
+from raw_validation import describe_reasons, normalize_country_name, validate_chunk
+
+
+DISTINCT_PROFILE_COLUMNS = ["track_id", "artist", "region", "chart"]
 
 RAW_NULL_PROFILE_COLUMNS = [
     "title",
@@ -81,14 +89,8 @@ def snake_case(name: str) -> str:
     return n or "unnamed"
 
 
-def normalize_country_name(series: pd.Series) -> pd.Series:
-    s = series.astype("string").str.strip()
-    s = s.str.replace(r"\s+", " ", regex=True)
-    return s
-
-
 def is_missing(series: pd.Series) -> pd.Series:
-    s = series.astype("string")
+    s = series if isinstance(series.dtype, pd.StringDtype) else series.astype("string")
     return s.isna() | (s.str.strip() == "")
 
 
@@ -100,25 +102,6 @@ def normalize_raw_chunk(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def init_distinct_db(conn: sqlite3.Connection) -> None:
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.execute("CREATE TABLE IF NOT EXISTS distinct_track_id (value TEXT PRIMARY KEY)")
-    conn.execute("CREATE TABLE IF NOT EXISTS distinct_artist (value TEXT PRIMARY KEY)")
-    conn.execute("CREATE TABLE IF NOT EXISTS distinct_region (value TEXT PRIMARY KEY)")
-    conn.execute("CREATE TABLE IF NOT EXISTS distinct_chart (value TEXT PRIMARY KEY)")
-
-
-def insert_distinct(conn: sqlite3.Connection, table: str, series: pd.Series) -> None:
-    cleaned = series.astype("string").str.strip()
-    vals = sorted(set(v for v in cleaned.dropna().tolist() if v != ""))
-    if vals:
-        conn.executemany(
-            f"INSERT OR IGNORE INTO {table}(value) VALUES (?)",
-            [(v,) for v in vals],
-        )
-
-
 def load_aux_lookup(aux_root: Path) -> pd.DataFrame:
     countries_path = aux_root / "countries_reference_clean.parquet"
     cultural_long_path = aux_root / "cultural_distance_long.parquet"
@@ -197,13 +180,20 @@ def load_aux_lookup(aux_root: Path) -> pd.DataFrame:
     return aux
 
 
-def add_merge_columns(df: pd.DataFrame) -> pd.DataFrame:
+def parse_observation_date(df: pd.DataFrame) -> pd.Series:
+    if "date" not in df.columns:
+        return pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    return pd.to_datetime(df["date"], errors="coerce", format="%Y-%m-%d")
+
+
+def add_merge_columns(df: pd.DataFrame, observation_dt: pd.Series | None = None) -> pd.DataFrame:
     out = df.copy()
 
     if "date" not in out.columns:
         out["date"] = pd.NA
 
-    observation_dt = pd.to_datetime(out["date"], errors="coerce", format="%Y-%m-%d")
+    if observation_dt is None:
+        observation_dt = parse_observation_date(out)
     out["observation_date"] = observation_dt.dt.strftime("%Y-%m-%d")
     out.loc[observation_dt.isna(), "observation_date"] = pd.NA
 
@@ -264,6 +254,25 @@ def write_partitioned_chunk(df: pd.DataFrame, root: Path, counters: dict[str, in
         counters[year_str] = idx + 1
 
 
+def write_quarantine_chunk(
+    df: pd.DataFrame, reasons: np.ndarray, first_row: int, path: Path, writer: pq.ParquetWriter | None,
+) -> pq.ParquetWriter | None:
+    failed = reasons != 0
+    if not failed.any():
+        return writer
+
+    quarantined = df.loc[failed].copy()
+    quarantined.insert(0, "source_row", np.flatnonzero(failed) + first_row)
+    quarantined["quarantine_reason_mask"] = reasons[failed]
+    quarantined["quarantine_reasons"] = describe_reasons(reasons[failed])
+    table = pa.Table.from_pandas(quarantined, preserve_index=False)
+
+    if writer is None:
+        writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+    writer.write_table(table.select(writer.schema.names).cast(writer.schema))
+    return writer
+
+
 def write_csv(path: Path, header: list[str], rows: list[list]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     with path.open("w", newline="", encoding="utf-8") as f:
@@ -276,15 +285,18 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Stage 1: merge-only dataset processing using pandas chunks.")
     parser.add_argument("--input-csv", required=True)
     parser.add_argument("--output-root", required=True)
-    parser.add_argument("--db-file", required=True)
+    parser.add_argument("--spill-dir", default=None, help="Spill directory for exact distinct counters (default: <output-root>/.distinct_spill)")
+    parser.add_argument("--distinct-backend", choices=DISTINCT_BACKENDS, default="exact")
+    parser.add_argument("--hll-error", type=float, default=0.01, help="Target relative error for the hll backend")
     parser.add_argument("--chunksize", type=int, default=150_000)
     parser.add_argument("--join-aux", action="store_true", help="Join prepared auxiliary country/cultural features")
     parser.add_argument("--aux-root", default="datasets/v1_aux", help="Path containing prepared aux parquet tables")
+    parser.add_argument("--skip-validation", action="store_true", help="Write every row to full/slim without quarantining")
     args = parser.parse_args()
 
     input_csv = Path(args.input_csv)
     output_root = Path(args.output_root)
-    db_file = Path(args.db_file)
+    spill_dir = Path(args.spill_dir) if args.spill_dir else output_root / ".distinct_spill"
 
     aux_lookup = None
     if args.join_aux:
@@ -293,11 +305,18 @@ def main() -> None:
     output_root.mkdir(parents=True, exist_ok=True)
     clean_output_root(output_root)
 
-    conn = sqlite3.connect(db_file)
-    init_distinct_db(conn)
+    distinct_counters = {
+        c: make_distinct_counter(args.distinct_backend, spill_dir=spill_dir / c, error=args.hll_error)
+        for c in DISTINCT_PROFILE_COLUMNS
+    }
 
     raw_rows = 0
     merged_rows = 0
+    filtered_rows = 0
+    validation_seconds = 0.0
+    ingest_start = time.perf_counter()
+    quarantine_path = output_root / "quarantine.parquet"
+    quarantine_writer: pq.ParquetWriter | None = None
     min_date = None
     max_date = None
     source_schema_rows = []
@@ -317,33 +336,41 @@ def main() -> None:
             source_schema_rows = [[i, c, "STRING", 0, "", 0] for i, c in enumerate(raw_chunk.columns.tolist())]
 
         chunk_rows = len(raw_chunk)
+        first_row = raw_rows
         raw_rows += chunk_rows
 
-        if "date" in raw_chunk.columns:
-            dt = pd.to_datetime(raw_chunk["date"], errors="coerce", format="%Y-%m-%d")
-            chunk_min = dt.min()
-            chunk_max = dt.max()
-            if pd.notna(chunk_min):
-                min_date = chunk_min if min_date is None else min(min_date, chunk_min)
-            if pd.notna(chunk_max):
-                max_date = chunk_max if max_date is None else max(max_date, chunk_max)
+        dt = parse_observation_date(raw_chunk)
+        chunk_min = dt.min()
+        chunk_max = dt.max()
+        if pd.notna(chunk_min):
+            min_date = chunk_min if min_date is None else min(min_date, chunk_min)
+        if pd.notna(chunk_max):
+            max_date = chunk_max if max_date is None else max(max_date, chunk_max)
 
+        # One missing mask per column, shared by the null profile and validation.
+        missing_masks = {c: is_missing(raw_chunk[c]) for c in RAW_NULL_PROFILE_COLUMNS if c in raw_chunk.columns}
         for col in RAW_NULL_PROFILE_COLUMNS:
-            if col in raw_chunk.columns:
-                null_counts[col] += int(is_missing(raw_chunk[col]).sum())
+            if col in missing_masks:
+                null_counts[col] += int(missing_masks[col].sum())
             else:
                 null_counts[col] += chunk_rows
 
-        if "track_id" in raw_chunk.columns:
-            insert_distinct(conn, "distinct_track_id", raw_chunk["track_id"])
-        if "artist" in raw_chunk.columns:
-            insert_distinct(conn, "distinct_artist", raw_chunk["artist"])
-        if "region" in raw_chunk.columns:
-            insert_distinct(conn, "distinct_region", raw_chunk["region"])
-        if "chart" in raw_chunk.columns:
-            insert_distinct(conn, "distinct_chart", raw_chunk["chart"])
-
-        merged = add_merge_columns(raw_chunk)
+        for col, counter in distinct_counters.items():
+            if col in raw_chunk.columns:
+                counter.add(raw_chunk[col])
+
+        if not args.skip_validation:
+            t0 = time.perf_counter()
+            reasons = validate_chunk(raw_chunk, missing_masks, dt)
+            quarantine_writer = write_quarantine_chunk(raw_chunk, reasons, first_row, quarantine_path, quarantine_writer)
+            valid = reasons == 0
+            if not valid.all():
+                filtered_rows += int((~valid).sum())
+                raw_chunk = raw_chunk.loc[valid]
+                dt = dt.loc[valid]
+            validation_seconds += time.perf_counter() - t0
+
+        merged = add_merge_columns(raw_chunk, dt)
         merged = apply_aux_features(merged, aux_lookup)
 
         if full_columns is None:
@@ -367,18 +394,18 @@ def main() -> None:
         slim_dir = output_root / "slim"
         write_partitioned_chunk(slim, slim_dir, slim_counters)
 
-    conn.commit()
+    if quarantine_writer is not None:
+        quarantine_writer.close()
 
     profile_overview_rows = [[
         raw_rows,
         merged_rows,
         min_date.strftime("%Y-%m-%d") if min_date is not None else "",
         max_date.strftime("%Y-%m-%d") if max_date is not None else "",
-        conn.execute("SELECT COUNT(*) FROM distinct_track_id").fetchone()[0],
-        conn.execute("SELECT COUNT(*) FROM distinct_artist").fetchone()[0],
-        conn.execute("SELECT COUNT(*) FROM distinct_region").fetchone()[0],
-        conn.execute("SELECT COUNT(*) FROM distinct_chart").fetchone()[0],
+        *[distinct_counters[c].count() for c in DISTINCT_PROFILE_COLUMNS],
         int(args.join_aux),
+        args.distinct_backend,
+        distinct_counters["track_id"].error,
     ]]
 
     null_rate_rows = [[c, (null_counts[c] / raw_rows if raw_rows else 0.0)] for c in RAW_NULL_PROFILE_COLUMNS]
@@ -386,7 +413,9 @@ def main() -> None:
     row_accounting_rows = [
         ["raw_rows", raw_rows],
         ["merged_rows", merged_rows],
-        ["rows_filtered", 0],
+        ["rows_filtered", filtered_rows],
+        ["validation_ms", int(validation_seconds * 1000)],
+        ["ingest_ms", int((time.perf_counter() - ingest_start) * 1000)],
     ]
 
     write_csv(output_root / "source_schema.csv", ["cid", "name", "type", "not_null", "dflt_value", "pk"], source_schema_rows)
@@ -402,13 +431,18 @@ def main() -> None:
             "distinct_region",
             "distinct_chart",
             "join_aux_enabled",
+            "distinct_backend",
+            "distinct_relative_error",
         ],
         profile_overview_rows,
     )
     write_csv(output_root / "profile_null_rates.csv", ["column_name", "null_rate"], null_rate_rows)
     write_csv(output_root / "row_accounting.csv", ["metric", "value"], row_accounting_rows)
 
-    conn.close()
+    for counter in distinct_counters.values():
+        counter.cleanup()
+    if spill_dir.exists():
+        shutil.rmtree(spill_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Declarative row validation for raw chart chunks.
+
+Each rule is evaluated as one vectorized boolean mask over the chunk and
+sets one bit in a per-row reason mask. Rows with any bit set are routed to
+``quarantine.parquet`` with a ``|``-joined ``quarantine_reasons`` string.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+REQUIRED_COLUMNS = ["track_id", "date", "region", "chart", "rank"]
+
+RANK_RANGE = (1, 200)
+
+# Inclusive ranges of the Spotify audio-feature API. Missing values pass;
+# only present values outside the range are rejected.
+AUDIO_FEATURE_RANGES = {
+    "af_danceability": (0.0, 1.0),
+    "af_energy": (0.0, 1.0),
+    "af_speechiness": (0.0, 1.0),
+    "af_acousticness": (0.0, 1.0),
+    "af_instrumentalness": (0.0, 1.0),
+    "af_liveness": (0.0, 1.0),
+    "af_valence": (0.0, 1.0),
+    "af_loudness": (-60.0, 5.0),
+    "af_tempo": (0.0, 300.0),
+    "af_key": (-1.0, 11.0),
+    "af_mode": (0.0, 1.0),
+    "af_time_signature": (0.0, 7.0),
+}
+
+# Every region of the raw Spotify charts: the 62 modelled markets
+# (src.config.COUNTRY_LIST), the 7 low-coverage markets dropped during feature
+# engineering and the Global chart. Compared after normalize_country_name.
+CHART_REGIONS = frozenset({
+    "Andorra", "Argentina", "Australia", "Austria", "Belgium", "Bolivia",
+    "Brazil", "Bulgaria", "Canada", "Chile", "Colombia", "Costa Rica",
+    "Czech Republic", "Denmark", "Dominican Republic", "Ecuador",
+    "El Salvador", "Estonia", "Finland", "France", "Germany", "Greece",
+    "Guatemala", "Honduras", "Hong Kong", "Hungary", "Iceland", "India",
+    "Indonesia", "Ireland", "Israel", "Italy", "Japan", "Latvia",
+    "Lithuania", "Malaysia", "Mexico", "Netherlands", "New Zealand",
+    "Nicaragua", "Norway", "Panama", "Paraguay", "Peru", "Philippines",
+    "Poland", "Portugal", "Romania", "Singapore", "Slovakia",
+    "South Africa", "Spain", "Sweden", "Switzerland", "Taiwan",
+    "Thailand", "Turkey", "United Arab Emirates", "United Kingdom",
+    "United States", "Uruguay", "Vietnam",
+    "Egypt", "Luxembourg", "Morocco", "Russia", "Saudi Arabia", "South Korea", "Ukraine",
+    "Global",
+})
+
+REASON_CODES = (
+    [f"missing_{c}" for c in REQUIRED_COLUMNS]
+    + ["bad_date", "rank_out_of_range", "unknown_region"]
+    + [f"{c}_out_of_range" for c in AUDIO_FEATURE_RANGES]
+)
+_REASON_BITS = {code: np.uint64(1 << i) for i, code in enumerate(REASON_CODES)}
+
+
+def normalize_country_name(series: pd.Series) -> pd.Series:
+    s = series.astype("string").str.strip()
+    s = s.str.replace(r"\s+", " ", regex=True)
+    return s
+
+
+def validate_chunk(
+    df: pd.DataFrame,
+    missing_masks: dict[str, pd.Series],
+    observation_dt: pd.Series,
+    known_regions: frozenset[str] = CHART_REGIONS,
+) -> np.ndarray:
+    """Return a uint64 reason bitmask per row (0 = valid).
+
+    ``missing_masks`` and ``observation_dt`` are shared with the null profile
+    and merge step so no column is parsed twice per chunk.
+    """
+    n = len(df)
+    reasons = np.zeros(n, dtype=np.uint64)
+
+    def flag(code: str, mask) -> None:
+        mask = np.asarray(mask, dtype=bool)
+        reasons[mask] |= _REASON_BITS[code]
+
+    for col in REQUIRED_COLUMNS:
+        flag(f"missing_{col}", missing_masks[col] if col in missing_masks else np.ones(n, dtype=bool))
+
+    if "date" in missing_masks:
+        flag("bad_date", observation_dt.isna().to_numpy() & ~missing_masks["date"].to_numpy())
+
+    if "rank" in df.columns:
+        rank = pd.to_numeric(df["rank"], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        lo, hi = RANK_RANGE
+        in_range = (rank >= lo) & (rank <= hi) & (rank == np.floor(rank))
+        flag("rank_out_of_range", ~in_range & ~missing_masks["rank"].to_numpy())
+
+    if "region" in df.columns:
+        region = normalize_country_name(df["region"])
+        known = region.isin(known_regions).to_numpy(dtype=bool, na_value=False)
+        flag("unknown_region", ~known & ~missing_masks["region"].to_numpy())
+
+    for col, (lo, hi) in AUDIO_FEATURE_RANGES.items():
+        if col not in df.columns:
+            continue
+        values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        with np.errstate(invalid="ignore"):
+            flag(f"{col}_out_of_range", ~np.isnan(values) & ((values < lo) | (values > hi)))
+
+    return reasons
+
+
+def describe_reasons(reason_mask: np.ndarray) -> np.ndarray:
+    """Map reason bitmasks to ``|``-joined reason codes (one lookup per distinct mask)."""
+    unique_masks, inverse = np.unique(reason_mask, return_inverse=True)
+    labels = np.array(
+        ["|".join(code for code, bit in _REASON_BITS.items() if int(m) & int(bit)) for m in unique_masks],
+        dtype=object,
+    )
+    return labels[inverse]
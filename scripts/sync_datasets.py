@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""Manifest-diff sync of dataset versions against an S3-compatible bucket.
+
+Only files whose sha256 differs from the other side's manifest are
+transferred. Downloaded objects are stored once under a content-addressed
+cache (``datasets/.cas/sha256/<ab>/<digest>``) and hard-linked into
+``datasets/<version>``, so versions that share files share disk space.
+Local files are copied into the cache, never linked, and cached objects are
+re-hashed (size + mtime cached) before they are linked out, so a dataset file
+rewritten in place cannot hand altered bytes to other versions.
+Large objects are fetched as parallel ranged GETs into a ``.partial`` file
+whose completed parts are tracked on disk, so an interrupted download
+resumes where it stopped.
+
+Works with any S3-compatible endpoint (Cloudflare R2, MinIO, moto_server)
+configured through ``scripts/r2.env`` or the environment.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from generate_manifest import HashCache, manifest_file_entries, sha256_file
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_PART_SIZE_MB = 64
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+
+def load_env_file(path: Path) -> dict:
+    values = {}
+    if not path.exists():
+        return values
+    for line in path.read_text(encoding='utf-8').splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        values[key.strip()] = value.strip().strip('"').strip("'")
+    return values
+
+
+def make_client(endpoint: str, region: str, max_connections: int, access_key: str | None, secret_key: str | None):
+    return boto3.client(
+        's3',
+        endpoint_url=endpoint,
+        region_name=region,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        config=Config(max_pool_connections=max_connections, retries={'max_attempts': 10, 'mode': 'adaptive'}),
+    )
+
+
+def manifest_index(manifest: dict) -> dict:
+    """Map version-relative POSIX paths to {'size_bytes', 'sha256'}."""
+    return {
+        path.as_posix(): {'size_bytes': size, 'sha256': sha256}
+        for path, size, sha256 in manifest_file_entries(manifest, Path('.'))
+    }
+
+
+def fetch_remote_manifest(client, bucket: str, key: str):
+    try:
+        body = client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(body)
+
+
+class ContentStore:
+    """Content-addressed file store keyed by sha256.
+
+    Objects are hard-linked out into version trees, so an in-place rewrite of
+    a tree file also changes the stored object; has() re-hashes (through a
+    size/mtime HashCache) and drops objects that no longer match their name.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.hashes = HashCache(root / '.sha256_cache.json')
+
+    def path(self, digest: str) -> Path:
+        return self.root / 'sha256' / digest[:2] / digest
+
+    def has(self, digest: str, size: int) -> bool:
+        p = self.path(digest)
+        if not p.is_file():
+            return False
+        if self.hashes.digest(p) == (size, digest):
+            return True
+        p.unlink(missing_ok=True)
+        return False
+
+    def adopt(self, src: Path, digest: str) -> None:
+        """Seed the store with a copy of an already-verified local file."""
+        target = self.path(digest)
+        if self.has(digest, src.stat().st_size):
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=target.name + '.', suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copy2(src, tmp)
+            if sha256_file(Path(tmp)) != digest:
+                raise IOError(f'{src} changed while it was copied into the content store')
+            os.replace(tmp, target)
+        finally:
+            Path(tmp).unlink(missing_ok=True)
+
+    def save(self) -> None:
+        self.hashes.save()
+
+    def link_into(self, digest: str, dest: Path) -> None:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(dest.name + '.sync-tmp')
+        tmp.unlink(missing_ok=True)
+        _link_or_copy(self.path(digest), tmp)
+        os.replace(tmp, dest)
+
+
+def _link_or_copy(src: Path, dest: Path) -> None:
+    try:
+        os.link(src, dest)
+    except OSError:
+        # Cross-device or no hard-link support: fall back to a real copy.
+        shutil.copy2(src, dest)
+
+
+def download_object(client, bucket: str, key: str, size: int, digest: str,
+                    store: ContentStore, part_pool: ThreadPoolExecutor, part_size: int) -> int:
+    """Fetch one object into the content store with resumable ranged GETs. Returns bytes fetched."""
+    final = store.path(digest)
+    final.parent.mkdir(parents=True, exist_ok=True)
+    partial = final.with_name(final.name + '.partial')
+    state_path = final.with_name(final.name + '.parts.json')
+
+    n_parts = max(1, math.ceil(size / part_size))
+    done = set()
+    if partial.exists() and state_path.exists():
+        with state_path.open(encoding='utf-8') as f:
+            done = set(json.load(f))
+    else:
+        with partial.open('wb') as f:
+            f.truncate(size)
+
+    lock = threading.Lock()
+    fetched = [0]
+
+    def fetch(i: int) -> None:
+        start = i * part_size
+        end = min(size, start + part_size) - 1
+        body = client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}')['Body']
+        with partial.open('r+b') as f:
+            f.seek(start)
+            for chunk in body.iter_chunks(STREAM_CHUNK_BYTES):
+                f.write(chunk)
+        with lock:
+            done.add(i)
+            fetched[0] += end - start + 1
+            with state_path.open('w', encoding='utf-8') as f:
+                json.dump(sorted(done), f)
+
+    if size > 0:
+        list(part_pool.map(fetch, [i for i in range(n_parts) if i not in done]))
+
+    if sha256_file(partial) != digest:
+        partial.unlink(missing_ok=True)
+        state_path.unlink(missing_ok=True)
+        raise IOError(f'sha256 mismatch after downloading s3://{bucket}/{key}')
+    os.replace(partial, final)
+    state_path.unlink(missing_ok=True)
+    return fetched[0]
+
+
+def run_download(args, client) -> None:
+    version_root = Path(args.dataset_root) / args.version
+    store = ContentStore(Path(args.cache_dir))
+    cache = HashCache(Path(args.dataset_root) / '.sha256_cache.json')
+    prefix = f'{args.prefix}/{args.version}'
+    manifest_name = args.manifest_name or f'manifest.{args.version}.json'
+
+    manifest = fetch_remote_manifest(client, args.bucket, f'{prefix}/{manifest_name}')
+    if manifest is None:
+        sys.exit(f'No manifest at s3://{args.bucket}/{prefix}/{manifest_name}; use download_from_r2.sh for this version.')
+    remote = manifest_index(manifest)
+
+    def plan(item):
+        rel, meta = item
+        dest = version_root / rel
+        if dest.is_file() and dest.stat().st_size == meta['size_bytes'] and cache.digest(dest)[1] == meta['sha256']:
+            store.adopt(dest, meta['sha256'])
+            return rel, 'keep'
+        if store.has(meta['sha256'], meta['size_bytes']):
+            return rel, 'link'
+        return rel, 'fetch'
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        actions = dict(pool.map(plan, remote.items()))
+
+    # Identical content listed under several paths is fetched once.
+    to_fetch = {}
+    for rel, action in actions.items():
+        if action == 'fetch':
+            to_fetch.setdefault(remote[rel]['sha256'], rel)
+
+    fetched_bytes = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as file_pool, \
+            ThreadPoolExecutor(max_workers=args.workers) as part_pool:
+        futures = [
+            file_pool.submit(
+                download_object, client, args.bucket, f'{prefix}/{rel}',
+                remote[rel]['size_bytes'], digest, store, part_pool, args.part_size_mb * 1024 * 1024,
+            )
+            for digest, rel in to_fetch.items()
+        ]
+        fetched_bytes = sum(f.result() for f in futures)
+
+    for rel, action in actions.items():
+        if action != 'keep':
+            store.link_into(remote[rel]['sha256'], version_root / rel)
+
+    if args.delete:
+        for p in sorted(version_root.rglob('*')):
+            if p.is_file() and p.relative_to(version_root).as_posix() not in remote:
+                p.unlink()
+
+    manifest_path = Path(args.dataset_root) / manifest_name
+    with manifest_path.open('w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    cache.save()
+    store.save()
+
+    counts = {a: sum(1 for v in actions.values() if v == a) for a in ('keep', 'link', 'fetch')}
+    print(
+        f'{args.version}: {counts["keep"]} unchanged, {counts["link"]} linked from cache, '
+        f'{counts["fetch"]} fetched ({fetched_bytes / 1e6:.1f} MB).'
+    )
+
+
+def run_upload(args, client) -> None:
+    version_root = Path(args.dataset_root) / args.version
+    prefix = f'{args.prefix}/{args.version}'
+    manifest_name = args.manifest_name or f'manifest.{args.version}.json'
+    manifest_path = Path(args.manifest_path) if args.manifest_path else Path(args.dataset_root) / manifest_name
+
+    with manifest_path.open(encoding='utf-8') as f:
+        manifest = json.load(f)
+    local = manifest_index(manifest)
+    remote_manifest = fetch_remote_manifest(client, args.bucket, f'{prefix}/{manifest_name}')
+    remote = manifest_index(remote_manifest) if remote_manifest else {}
+
+    changed = [rel for rel, meta in local.items() if remote.get(rel, {}).get('sha256') != meta['sha256']]
+
+    # Objects are published under the manifest's digest, so the files on disk must still match it.
+    cache = HashCache(Path(args.dataset_root) / '.sha256_cache.json')
+
+    def check(rel: str):
+        path = version_root / rel
+        if not path.is_file():
+            return rel, 'missing'
+        if cache.digest(path) != (local[rel]['size_bytes'], local[rel]['sha256']):
+            return rel, 'changed since the manifest was written'
+        return rel, None
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        problems = [(rel, problem) for rel, problem in pool.map(check, changed) if problem]
+    cache.save()
+    if problems:
+        for rel, problem in problems:
+            print(f'{problem}\t{rel}', file=sys.stderr)
+        sys.exit(f'{len(problems)} files do not match {manifest_path}; regenerate it before uploading.')
+
+    part_size = args.part_size_mb * 1024 * 1024
+    transfer_config = TransferConfig(
+        multipart_threshold=part_size, multipart_chunksize=part_size, max_concurrency=args.workers,
+    )
+
+    def upload(rel: str) -> int:
+        path = version_root / rel
+        client.upload_file(str(path), args.bucket, f'{prefix}/{rel}', Config=transfer_config)
+        return path.stat().st_size
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        uploaded_bytes = sum(pool.map(upload, changed))
+
+    # Manifest goes last so readers never see entries whose objects are missing.
+    client.upload_file(str(manifest_path), args.bucket, f'{prefix}/{manifest_name}')
+    print(f'{args.version}: {len(changed)} of {len(local)} files uploaded ({uploaded_bytes / 1e6:.1f} MB).')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync a dataset version with R2 using manifest sha256 diffs.')
+    parser.add_argument('command', choices=['download', 'upload'])
+    parser.add_argument('--version', default=None, help='Dataset version (default: DATASET_VERSION or v1)')
+    parser.add_argument('--dataset-root', default=str(ROOT_DIR / 'datasets'))
+    parser.add_argument('--cache-dir', default=None, help='Content-addressed cache (default: <dataset-root>/.cas)')
+    parser.add_argument('--manifest-name', default=None, help='Remote manifest file name (default: manifest.<version>.json)')
+    parser.add_argument('--manifest-path', default=None, help='Local manifest to upload (default: <dataset-root>/<manifest-name>)')
+    parser.add_argument('--prefix', default='dataset', help='Bucket key prefix holding the dataset versions')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--part-size-mb', type=int, default=DEFAULT_PART_SIZE_MB)
+    parser.add_argument('--delete', action='store_true', help='Remove local files not listed in the remote manifest')
+    parser.add_argument('--config-file', default=str(ROOT_DIR / 'scripts' / 'r2.env'))
+    parser.add_argument('--endpoint', default=None, help='S3-compatible endpoint URL (default: R2_ENDPOINT)')
+    parser.add_argument('--bucket', default=None, help='Bucket name (default: R2_BUCKET)')
+    args = parser.parse_args()
+
+    env = {**load_env_file(Path(args.config_file)), **os.environ}
+    args.endpoint = args.endpoint or env.get('R2_ENDPOINT')
+    args.bucket = args.bucket or env.get('R2_BUCKET')
+    args.version = args.version or env.get('DATASET_VERSION', 'v1')
+    args.cache_dir = args.cache_dir or str(Path(args.dataset_root) / '.cas')
+    if not args.endpoint or not args.bucket:
+        parser.error('Set R2_ENDPOINT and R2_BUCKET (or pass --endpoint/--bucket).')
+
+    client = make_client(
+        args.endpoint,
+        env.get('AWS_REGION', env.get('AWS_DEFAULT_REGION', 'auto')),
+        max_connections=args.workers * 2,
+        access_key=env.get('AWS_ACCESS_KEY_ID'),
+        secret_key=env.get('AWS_SECRET_ACCESS_KEY'),
+    )
+    if args.command == 'download':
+        run_download(args, client)
+    else:
+        run_upload(args, client)
+
+
+if __name__ == '__main__':
+    main()
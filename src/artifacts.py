@@ -0,0 +1,51 @@
+"""Parquet artifacts invalidated by a fingerprint of their source files."""
+
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.config import V2_DATA_DIR
+
+FINGERPRINT_KEY = b"source_fingerprint"
+
+
+def source_fingerprint(paths: list[Path]) -> str:
+    """Hash of (path, size, mtime_ns) for every existing source file."""
+    h = hashlib.sha256()
+    for path in sorted(Path(p) for p in paths):
+        if path.exists():
+            st = path.stat()
+            h.update(f"{path.as_posix()}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+        else:
+            h.update(f"{path.as_posix()}:missing\n".encode())
+    return h.hexdigest()
+
+
+def write_fingerprinted_parquet(df: pd.DataFrame, path: Path, fingerprint: str) -> None:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), FINGERPRINT_KEY: fingerprint.encode()}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path, compression="zstd")
+    tmp_path.replace(path)
+
+
+def read_fresh_parquet(path: Path, fingerprint: str | None) -> pd.DataFrame | None:
+    """Memory-map a parquet artifact if its stored fingerprint matches, else None.
+    A ``None`` fingerprint accepts any existing artifact.
+    """
+    if not path.exists():
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    if fingerprint is not None and metadata.get(FINGERPRINT_KEY) != fingerprint.encode():
+        return None
+    return pq.read_table(path, memory_map=True).to_pandas()
+
+
+def v2_files() -> list[Path]:
+    return sorted(V2_DATA_DIR.glob("*/*.parquet"))
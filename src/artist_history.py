@@ -0,0 +1,195 @@
+"""Point-in-time artist history: leak-free artist features as of any date.
+
+The artist features count an artist's top200 history strictly before the
+observation date. For every artist the index keeps one entry per charting
+date, sorted, with running totals through that date:
+
+- chart rows (prefix sum) and best rank (running minimum)
+- distinct tracks (prefix count of each track's first chart date)
+- charted countries as a 62-bit mask (each country's bit is added on the
+  artist's first chart date there, so the running sum is the running OR)
+
+plus, per (artist, country), the sorted first chart dates of the artist's
+tracks there. Entries of all artists live in flat arrays keyed by
+``(artist code << 32) | day``, so one ``searchsorted`` answers a whole batch
+of (artist, as_of) queries.
+
+``src.features`` builds the index per v2 ``artist`` string (as notebook 04
+does) for the v3 artist stages; the app builds it per credited artist key
+from the catalog, so ``lookup_artist`` serves the same features for a
+chosen chart date instead of over all of v2.
+"""
+
+from __future__ import annotations
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from src.config import CATALOG_PATH, N_COUNTRIES
+from src.data import encode_countries
+from src.disk_cache import disk_cache
+
+NO_HISTORY_BEST_RANK = 201
+_DAY_BITS = 32
+
+
+def history_queries(source: str, key_sql: str) -> dict[str, str]:
+    """Aggregates the index is built from, over top200 rows of ``source``.
+
+    ``daily``: chart rows and best rank per (artist_key, date);
+    ``firsts``: first chart date per (artist_key, track_id, region).
+    """
+    rows = f"(SELECT {key_sql} AS artist_key, * FROM {source} WHERE chart = 'top200') AS rows"
+    return {
+        "daily": f"""
+            SELECT artist_key, date, COUNT(*) AS chart_count, MIN(rank) AS best_rank
+            FROM {rows}
+            WHERE artist_key IS NOT NULL
+            GROUP BY artist_key, date
+        """,
+        "firsts": f"""
+            SELECT artist_key, track_id, region, MIN(date) AS first_date
+            FROM {rows}
+            WHERE artist_key IS NOT NULL
+            GROUP BY artist_key, track_id, region
+        """,
+    }
+
+
+def _days(values) -> np.ndarray:
+    return pd.to_datetime(pd.Series(values)).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+class ArtistHistoryIndex:
+    def __init__(self, daily: pd.DataFrame, firsts: pd.DataFrame):
+        """``daily`` and ``firsts`` as returned by the history_queries."""
+        firsts = firsts.assign(region_code=encode_countries(firsts["region"]))
+        firsts = firsts[firsts["region_code"] < N_COUNTRIES]
+        self.keys = np.unique(daily["artist_key"].to_numpy(dtype=object)).astype(str)
+        categories = pd.CategoricalDtype(self.keys)
+
+        track_first = firsts.groupby(["artist_key", "track_id"], sort=False)["first_date"].min()
+        new_tracks = track_first.groupby([track_first.index.get_level_values(0), track_first.to_numpy()]).size()
+        region_first = firsts.groupby(["artist_key", "region_code"], sort=False)["first_date"].min()
+        # One bit per country, each set once per artist: summing is OR-ing.
+        region_bits = pd.Series(
+            np.left_shift(1, region_first.index.get_level_values(1).to_numpy(dtype=np.int64)),
+            index=region_first.index,
+        )
+        new_regions = region_bits.groupby([region_first.index.get_level_values(0), region_first.to_numpy()]).sum()
+
+        df = daily.set_index(["artist_key", "date"])
+        df["new_tracks"] = new_tracks.reindex(df.index, fill_value=0).to_numpy()
+        df["new_regions"] = new_regions.reindex(df.index, fill_value=0).to_numpy()
+        df = df.reset_index()
+        df["code"] = df["artist_key"].astype(categories).cat.codes.astype(np.int64)
+        df["day"] = _days(df["date"])
+        df = df.sort_values(["code", "day"], kind="stable")
+        by_artist = df.groupby("code", sort=False)
+
+        self._day_key = (df["code"].to_numpy() << _DAY_BITS) | df["day"].to_numpy()
+        self._chart_count = by_artist["chart_count"].cumsum().to_numpy(dtype=np.int64)
+        self._best_rank = by_artist["best_rank"].cummin().to_numpy(dtype=np.int64)
+        self._track_count = by_artist["new_tracks"].cumsum().to_numpy(dtype=np.int64)
+        self._region_mask = by_artist["new_regions"].cumsum().to_numpy(dtype=np.int64)
+
+        region_codes = firsts["artist_key"].astype(categories).cat.codes.to_numpy(dtype=np.int64)
+        self._region_key = np.sort(
+            ((region_codes * N_COUNTRIES + firsts["region_code"].to_numpy(dtype=np.int64)) << _DAY_BITS)
+            | _days(firsts["first_date"])
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, artist_key) -> bool:
+        i = np.searchsorted(self.keys, artist_key)
+        return i < len(self.keys) and self.keys[i] == artist_key
+
+    def _locate(self, artist_keys, as_of) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(artist codes, as-of days, entry positions, has-history mask) for each query."""
+        codes = pd.Categorical(np.asarray(artist_keys, dtype=object), categories=self.keys).codes.astype(np.int64)
+        days = _days(as_of)
+        # Last entry strictly before the as-of day
+        pos = np.searchsorted(self._day_key, (np.maximum(codes, 0) << _DAY_BITS) | days) - 1
+        found = (codes >= 0) & (pos >= 0)
+        found[found] = (self._day_key[pos[found]] >> _DAY_BITS) == codes[found]
+        return codes, days, pos, found
+
+    def as_of_many(self, artist_keys, as_of) -> pd.DataFrame:
+        """Artist features for each (artist_key, as_of) pair, counting history
+        strictly before as_of; artists without any get zero history.
+        """
+        _, _, pos, found = self._locate(artist_keys, as_of)
+        n = len(pos)
+        chart_count = np.zeros(n, dtype=np.int64)
+        best_rank = np.full(n, NO_HISTORY_BEST_RANK, dtype=np.int64)
+        track_count = np.zeros(n, dtype=np.int64)
+        region_mask = np.zeros(n, dtype=np.int64)
+        at = pos[found]
+        chart_count[found] = self._chart_count[at]
+        best_rank[found] = self._best_rank[at]
+        track_count[found] = self._track_count[at]
+        region_mask[found] = self._region_mask[at]
+        unique_regions = np.bitwise_count(region_mask).astype(np.int64)
+        return pd.DataFrame({
+            "artist_prior_chart_count": chart_count,
+            "artist_prior_unique_regions": unique_regions,
+            "artist_prior_best_rank": best_rank,
+            "artist_prior_unique_tracks": track_count,
+            "artist_country_ratio": np.divide(
+                unique_regions, track_count, out=np.zeros(n), where=track_count > 0,
+            ),
+            "region_mask": region_mask,
+        })
+
+    def success_in_target(self, artist_keys, as_of) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """artist_prior_success_in_target for every charted country, as
+        (query index, country code, distinct tracks) triples; other
+        (query, country) pairs are 0.
+
+        Counts the artist's tracks that charted there before as_of. Training
+        also excludes the observed track, which never has earlier rows.
+        """
+        codes, days, pos, found = self._locate(artist_keys, as_of)
+        mask = np.zeros(len(pos), dtype=np.int64)
+        mask[found] = self._region_mask[pos[found]]
+        bits = (mask[:, None] >> np.arange(N_COUNTRIES, dtype=np.int64)) & 1
+        query, region = np.nonzero(bits)
+        base = (codes[query] * N_COUNTRIES + region) << _DAY_BITS
+        counts = np.searchsorted(self._region_key, base | days[query]) - np.searchsorted(self._region_key, base)
+        return query, region, counts.astype(np.int64)
+
+    def as_of(self, artist_key: str, as_of: date) -> dict:
+        """Artist history dict for build_prediction_rows (see empty_artist_history)."""
+        row = self.as_of_many([artist_key], [as_of]).iloc[0]
+        _, region, counts = self.success_in_target([artist_key], [as_of])
+        success = np.zeros(N_COUNTRIES, dtype=np.int64)
+        success[region] = counts
+        return {
+            "artist_prior_chart_count": int(row["artist_prior_chart_count"]),
+            "artist_prior_unique_regions": int(row["artist_prior_unique_regions"]),
+            "artist_prior_best_rank": int(row["artist_prior_best_rank"]),
+            "artist_prior_unique_tracks": int(row["artist_prior_unique_tracks"]),
+            "multi_artist_flag": 0,
+            "artist_country_ratio": float(row["artist_country_ratio"]),
+            "success_in_target": success,
+        }
+
+
+@st.cache_resource
+def load_artist_history() -> ArtistHistoryIndex:
+    return _build_artist_history()
+
+
+@disk_cache([CATALOG_PATH])
+def _build_artist_history() -> ArtistHistoryIndex:
+    from src.catalog import catalog_connection
+
+    with catalog_connection() as con:
+        daily = con.execute("SELECT * FROM artist_credit_daily").fetchdf()
+        firsts = con.execute("SELECT * FROM artist_credit_firsts").fetchdf()
+    return ArtistHistoryIndex(daily, firsts)
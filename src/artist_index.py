@@ -0,0 +1,165 @@
+"""In-memory artist autocomplete over the catalog's ``artist_names`` table.
+
+Artist names are normalized (accents stripped, case-folded, whitespace
+collapsed) into the same ``artist_key`` the catalog aggregates under. Every
+word-start suffix of a key ("bad bunny", "bunny") goes into one sorted list,
+so a prefix query is two bisects; results are ranked by prior chart count,
+with the top candidates for every 1–2 character prefix precomputed. When the
+prefix yields too few candidates, a trigram index adds close spellings
+(ranked by trigram Jaccard similarity, then chart count).
+"""
+
+from __future__ import annotations
+
+import bisect
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from src.config import CATALOG_PATH
+from src.disk_cache import disk_cache
+
+SHORT_PREFIX_LEN = 2
+SHORT_PREFIX_TOP = 32
+MIN_TRIGRAM_SIMILARITY = 0.3
+
+# Unicode space separators (DuckDB's trim) and RE2's \s (the catalog's regexp_replace)
+_SPACE_SEPARATORS = " \u00a0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u202f\u205f\u3000"
+_RE2_WHITESPACE = re.compile(r"[\t\n\f\r ]+")
+
+
+def normalize_artist_name(name: str) -> str:
+    """Python twin of the catalog's artist_key expression; the two must agree.
+
+    strip_accents is NFD, drop every mark (Mn/Mc/Me), recompose (NFC), so
+    compatibility characters (fullwidth, ligatures, roman numerals) are kept
+    as they are. lower() is per character, which leaves a final sigma as σ.
+    """
+    decomposed = unicodedata.normalize("NFD", name.strip(_SPACE_SEPARATORS))
+    stripped = unicodedata.normalize(
+        "NFC", "".join(ch for ch in decomposed if unicodedata.category(ch) not in ("Mn", "Mc", "Me")),
+    )
+    lowered = "".join(ch.lower() for ch in stripped)
+    return _RE2_WHITESPACE.sub(" ", lowered).strip(_SPACE_SEPARATORS)
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass(frozen=True)
+class ArtistSuggestion:
+    artist_key: str
+    display_name: str
+    chart_count: int
+
+
+class ArtistIndex:
+    def __init__(self, artists: pd.DataFrame):
+        """``artists`` has one row per artist_key with display_name and chart_count."""
+        artists = artists.sort_values("artist_key").reset_index(drop=True)
+        self.keys = artists["artist_key"].tolist()
+        self.display_names = artists["display_name"].tolist()
+        self.counts = artists["chart_count"].to_numpy(dtype=np.int64)
+        self._key_pos = {key: i for i, key in enumerate(self.keys)}
+
+        # Word-start suffixes, sorted, each pointing at its artist
+        entries = sorted(
+            (key[start:], i)
+            for i, key in enumerate(self.keys)
+            for start in [0] + [j + 1 for j, ch in enumerate(key) if ch == " "]
+        )
+        self._entry_text = [text for text, _ in entries]
+        self._entry_artist = np.array([i for _, i in entries], dtype=np.int32)
+
+        short_prefixes = {text[:n] for text in self._entry_text for n in range(1, SHORT_PREFIX_LEN + 1)}
+        self._short_prefix_top = {
+            prefix: self._top_by_count(self._entry_range(prefix), SHORT_PREFIX_TOP)
+            for prefix in short_prefixes
+        }
+
+        postings: dict[str, list[int]] = defaultdict(list)
+        self._n_trigrams = np.zeros(len(self.keys), dtype=np.int32)
+        for i, key in enumerate(self.keys):
+            grams = _trigrams(key)
+            self._n_trigrams[i] = len(grams)
+            for gram in grams:
+                postings[gram].append(i)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _top_by_count(self, ids: np.ndarray, k: int) -> np.ndarray:
+        if len(ids) > k:
+            ids = ids[np.argpartition(-self.counts[ids], k - 1)[:k]]
+        return ids[np.lexsort((ids, -self.counts[ids]))]
+
+    def _entry_range(self, prefix: str) -> np.ndarray:
+        """Distinct artists with a word-start suffix beginning with prefix."""
+        lo = bisect.bisect_left(self._entry_text, prefix)
+        hi = bisect.bisect_left(self._entry_text, prefix + "\uffff", lo)
+        return np.unique(self._entry_artist[lo:hi])
+
+    def _prefix_ids(self, prefix: str, k: int) -> np.ndarray:
+        if len(prefix) <= SHORT_PREFIX_LEN and k <= SHORT_PREFIX_TOP:
+            return self._short_prefix_top.get(prefix, np.empty(0, dtype=np.int32))[:k]
+        return self._top_by_count(self._entry_range(prefix), k)
+
+    def _fuzzy_ids(self, query: str, k: int) -> np.ndarray:
+        grams = [g for g in _trigrams(query) if g in self._postings]
+        if not grams:
+            return np.empty(0, dtype=np.int32)
+        candidates = np.concatenate([self._postings[g] for g in grams])
+        ids, shared = np.unique(candidates, return_counts=True)
+        similarity = shared / (len(_trigrams(query)) + self._n_trigrams[ids] - shared)
+        keep = similarity >= MIN_TRIGRAM_SIMILARITY
+        ids, similarity = ids[keep], similarity[keep]
+        order = np.lexsort((-self.counts[ids], -similarity))[:k]
+        return ids[order]
+
+    def suggest(self, query: str, k: int = 8) -> list[ArtistSuggestion]:
+        """Up to k artists whose name (or any word in it) starts with the
+        query, most-charted first, topped up with close spellings.
+        """
+        normalized = normalize_artist_name(query)
+        if not normalized:
+            return []
+        ids = list(self._prefix_ids(normalized, k))
+        if len(ids) < k:
+            seen = set(ids)
+            ids += [i for i in self._fuzzy_ids(normalized, 2 * k) if i not in seen][: k - len(ids)]
+        return [
+            ArtistSuggestion(self.keys[i], self.display_names[i], int(self.counts[i]))
+            for i in ids
+        ]
+
+    def resolve(self, name: str) -> str | None:
+        """Canonical artist_key for an exactly matching name, else None."""
+        key = normalize_artist_name(name)
+        return key if key in self._key_pos else None
+
+    def display_name(self, artist_key: str) -> str:
+        return self.display_names[self._key_pos[artist_key]]
+
+
+@st.cache_resource
+def load_artist_index() -> ArtistIndex:
+    return _build_artist_index()
+
+
+@disk_cache([CATALOG_PATH])
+def _build_artist_index() -> ArtistIndex:
+    from src.catalog import catalog_connection
+
+    with catalog_connection() as con:
+        artists = con.execute(
+            "SELECT artist_key, display_name, chart_count FROM artist_names"
+        ).fetchdf()
+    return ArtistIndex(artists)
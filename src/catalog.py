@@ -0,0 +1,357 @@
+"""Persistent DuckDB catalog over the v2/v3 datasets.
+
+``datasets/catalog.duckdb`` registers the parquet datasets as views and
+materializes the aggregates the app queries repeatedly:
+
+- ``artist_track_stats``: chart rows and best rank per (artist, track, country)
+- ``artist_credit_stats`` / ``artist_names``: the same per credited artist
+  (artist strings split on ", ") under a normalized ``artist_key``, plus each
+  key's display name and total chart count for the autocomplete index
+- ``track_names``: track_code/track_id → title, artist (from the track dictionary)
+- ``country_daily_stats``: top200 streams, entries and new entries per (country, date)
+- ``artist_credit_daily`` / ``artist_credit_firsts``: top200 aggregates per
+  credited artist key that ``src.artist_history`` builds its as-of index from
+- ``track_country_firsts``: first top200 date per (track, country), the
+  events ``src.corridors`` counts diffusion corridors from
+
+Parameterized lookups are stored in the catalog as table macros, so callers
+bind values instead of rebuilding SQL. The app reads through a small pool of
+cursors on one read-only connection and never rebuilds the catalog itself:
+a stale catalog is served with a warning. Rebuild with
+``python -m src.catalog refresh``, which builds into a per-process temp file
+under an exclusive ``catalog.duckdb.lock`` so concurrent refreshes on one
+host run one at a time; ``python -m src.catalog bench`` times artist lookups
+against an ad-hoc connection over v2.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import queue
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import duckdb
+
+try:
+    import fcntl
+except ImportError:  # Windows: refreshes are not serialized across processes
+    fcntl = None
+
+from src.artifacts import source_fingerprint, v2_files
+from src.artist_history import history_queries
+from src.corridors import FIRST_CHART_SQL
+from src.country_priors import COUNTRY_DAY_STATS_SQL
+from src.config import CATALOG_PATH, DATA_DIR, TRACK_DICTIONARY_PATH, V2_DATA_DIR
+from src.track_dictionary import load_track_dictionary
+
+DEFAULT_POOL_SIZE = 4
+
+_V2_SOURCE = f"read_parquet('{V2_DATA_DIR.as_posix()}/*/*.parquet', hive_partitioning=true)"
+
+# Bump when tables or macros change so existing catalogs count as stale.
+CATALOG_SCHEMA_VERSION = "5"
+
+# Must agree with src.artist_index.normalize_artist_name.
+_ARTIST_KEY_SQL = r"trim(regexp_replace(lower(strip_accents(credited_name)), '\s+', ' ', 'g'))"
+
+_CREDITS = """(
+    SELECT * FROM (
+        SELECT *, TRIM(UNNEST(string_split(artist, ', '))) AS credited_name FROM v2 WHERE artist IS NOT NULL
+    ) WHERE credited_name <> ''
+)"""
+_ARTIST_HISTORY = history_queries(_CREDITS, _ARTIST_KEY_SQL)
+
+_MATERIALIZED = {
+    "artist_track_stats": """
+        SELECT
+            LOWER(artist) AS artist_lc,
+            track_id,
+            source_country_norm,
+            COUNT(*) AS chart_count,
+            MIN(rank) AS best_rank
+        FROM v2
+        WHERE artist IS NOT NULL
+        GROUP BY ALL
+        ORDER BY artist_lc
+    """,
+    "artist_credit_stats": f"""
+        WITH credits AS (
+            SELECT TRIM(UNNEST(string_split(artist, ', '))) AS credited_name, track_id, source_country_norm, rank
+            FROM v2
+            WHERE artist IS NOT NULL
+        )
+        SELECT
+            {_ARTIST_KEY_SQL} AS artist_key,
+            track_id,
+            source_country_norm,
+            MODE(credited_name) AS display_name,
+            COUNT(*) AS chart_count,
+            MIN(rank) AS best_rank
+        FROM credits
+        WHERE credited_name <> ''
+        GROUP BY ALL
+        ORDER BY artist_key
+    """,
+    "artist_names": """
+        SELECT
+            artist_key,
+            MODE(display_name) AS display_name,
+            SUM(chart_count) AS chart_count,
+            COUNT(DISTINCT track_id) AS track_count
+        FROM artist_credit_stats
+        GROUP BY artist_key
+        ORDER BY artist_key
+    """,
+    "track_names": f"""
+        SELECT track_code, track_id, title, artist
+        FROM read_parquet('{TRACK_DICTIONARY_PATH.as_posix()}')
+    """,
+    "country_daily_stats": COUNTRY_DAY_STATS_SQL.format(source="v2") + "ORDER BY country, date",
+    "artist_credit_daily": _ARTIST_HISTORY["daily"],
+    "artist_credit_firsts": _ARTIST_HISTORY["firsts"],
+    "track_country_firsts": FIRST_CHART_SQL.format(source="v2") + "ORDER BY track_id",
+}
+
+_MACROS = {
+    # Same substring match and aggregates as the original per-call v2 scan.
+    "artist_stats": """
+        (name) AS TABLE
+        SELECT
+            COALESCE(SUM(chart_count), 0) AS chart_count,
+            COUNT(DISTINCT source_country_norm) AS unique_regions,
+            MIN(best_rank) AS best_rank,
+            COUNT(DISTINCT track_id) AS unique_tracks,
+            LIST(DISTINCT source_country_norm) AS countries
+        FROM artist_track_stats
+        WHERE artist_lc LIKE '%' || LOWER(name) || '%'
+    """,
+    "artist_stats_by_key": """
+        (key) AS TABLE
+        SELECT
+            COALESCE(SUM(chart_count), 0) AS chart_count,
+            COUNT(DISTINCT source_country_norm) AS unique_regions,
+            MIN(best_rank) AS best_rank,
+            COUNT(DISTINCT track_id) AS unique_tracks,
+            LIST(DISTINCT source_country_norm) AS countries
+        FROM artist_credit_stats
+        WHERE artist_key = key
+    """,
+    "track_name": """
+        (tid) AS TABLE
+        SELECT title, artist FROM track_names WHERE track_id = tid
+    """,
+}
+
+
+def catalog_fingerprint() -> str:
+    return f"{CATALOG_SCHEMA_VERSION}:{source_fingerprint(v2_files())}"
+
+
+# ---------------------------------------------------------------------------
+# Refresh
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def _refresh_lock(path: Path):
+    """Exclusive lock on ``<catalog>.lock``, held for a whole rebuild."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(path.name + ".lock"), "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def refresh_catalog(path: Path = CATALOG_PATH, force: bool = True) -> dict[str, float]:
+    """Rebuild the catalog into a temp file and swap it in. Returns seconds per step,
+    or an empty dict if ``force`` is off and the catalog was already fresh
+    (e.g. another process rebuilt it while this one waited for the lock).
+
+    Open read-only connections keep the previous file until they reconnect.
+    """
+    with _refresh_lock(path):
+        if not force and catalog_is_fresh(path):
+            return {}
+        return _build_catalog(path)
+
+
+def _build_catalog(path: Path) -> dict[str, float]:
+    timings: dict[str, float] = {}
+    t0 = time.perf_counter()
+    load_track_dictionary()
+    timings["track_dictionary"] = time.perf_counter() - t0
+
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    con = duckdb.connect(str(tmp_path))
+    try:
+        con.execute(f"CREATE VIEW v2 AS SELECT * FROM {_V2_SOURCE}")
+        for split in ["train", "val", "test"]:
+            for name, file in [(f"v3_{split}", f"{split}.parquet"), (f"v3_{split}_footprints", f"{split}_footprints.parquet")]:
+                if (DATA_DIR / file).exists():
+                    con.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet('{(DATA_DIR / file).as_posix()}')")
+
+        for name, query in _MATERIALIZED.items():
+            t0 = time.perf_counter()
+            con.execute(f"CREATE TABLE {name} AS {query}")
+            timings[name] = time.perf_counter() - t0
+        for name, body in _MACROS.items():
+            con.execute(f"CREATE MACRO {name}{body}")
+
+        con.execute("CREATE TABLE catalog_meta (key VARCHAR, value VARCHAR)")
+        con.execute(
+            "INSERT INTO catalog_meta VALUES ('v2_fingerprint', ?), ('refreshed_at', ?)",
+            [catalog_fingerprint(), datetime.now().isoformat(timespec="seconds")],
+        )
+        con.execute("CHECKPOINT")
+    except BaseException:
+        con.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    con.close()
+    tmp_path.replace(path)
+    return timings
+
+
+def catalog_is_fresh(path: Path = CATALOG_PATH) -> bool:
+    """True if the catalog exists and was built from the current v2 files
+    (or v2 is not available locally, in which case the shipped catalog is used).
+    """
+    if not path.exists():
+        return False
+    if not v2_files():
+        return True
+    con = duckdb.connect(str(path), read_only=True)
+    try:
+        row = con.execute("SELECT value FROM catalog_meta WHERE key = 'v2_fingerprint'").fetchone()
+    except duckdb.Error:
+        return False
+    finally:
+        con.close()
+    return row is not None and row[0] == catalog_fingerprint()
+
+
+# ---------------------------------------------------------------------------
+# Connection pool
+# ---------------------------------------------------------------------------
+
+class CatalogPool:
+    """Fixed set of cursors over one read-only catalog connection.
+
+    DuckDB cursors share the database instance but each carries its own
+    client context, so one cursor per concurrent caller is thread-safe.
+    """
+
+    def __init__(self, path: Path = CATALOG_PATH, size: int = DEFAULT_POOL_SIZE):
+        self._con = duckdb.connect(str(path), read_only=True)
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(self._con.cursor())
+
+    @contextmanager
+    def connection(self):
+        cursor = self._idle.get()
+        try:
+            yield cursor
+        finally:
+            self._idle.put(cursor)
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+        self._con.close()
+
+
+_pool: CatalogPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> CatalogPool:
+    """Process-wide pool over the existing catalog. A stale catalog is served
+    with a warning; rebuilding is left to ``python -m src.catalog refresh``.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if not CATALOG_PATH.exists():
+                raise FileNotFoundError(f"{CATALOG_PATH} is missing; build it with `python -m src.catalog refresh`")
+            if not catalog_is_fresh():
+                warnings.warn(
+                    f"{CATALOG_PATH} was built from different v2 files; serving it anyway. "
+                    "Run `python -m src.catalog refresh` to rebuild.",
+                    RuntimeWarning, stacklevel=2,
+                )
+            _pool = CatalogPool(CATALOG_PATH)
+        return _pool
+
+
+@contextmanager
+def catalog_connection():
+    with get_pool().connection() as cursor:
+        yield cursor
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def _bench(artists: list[str], repeat: int) -> None:
+    adhoc_sql = f"""
+        SELECT COUNT(*), COUNT(DISTINCT source_country_norm), MIN(rank),
+               COUNT(DISTINCT track_id), LIST(DISTINCT source_country_norm)
+        FROM {_V2_SOURCE}
+        WHERE LOWER(artist) LIKE '%' || LOWER(?) || '%'
+    """
+    pool = get_pool()
+    for artist in artists:
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            con = duckdb.connect()
+            adhoc = con.execute(adhoc_sql, [artist]).fetchone()
+            con.close()
+        adhoc_ms = (time.perf_counter() - t0) / repeat * 1000
+
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            with pool.connection() as cursor:
+                pooled = cursor.execute("SELECT * FROM artist_stats(?)", [artist]).fetchone()
+        pooled_ms = (time.perf_counter() - t0) / repeat * 1000
+
+        match = adhoc[:4] == pooled[:4] or (adhoc[0] == 0 and pooled[0] == 0)
+        print(f"{artist!r:30s} ad-hoc {adhoc_ms:8.1f} ms   catalog {pooled_ms:7.2f} ms   "
+              f"x{adhoc_ms / max(pooled_ms, 1e-6):.0f}   {'same result' if match else 'RESULT MISMATCH'}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage the persistent DuckDB catalog.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    refresh = sub.add_parser("refresh", help="Rebuild views and materialized aggregates")
+    refresh.add_argument("--force", action="store_true", help="Rebuild even if the catalog is fresh")
+    bench = sub.add_parser("bench", help="Time artist lookups: ad-hoc v2 scan vs catalog")
+    bench.add_argument("artists", nargs="+")
+    bench.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        timings = refresh_catalog(force=args.force)
+        if not timings:
+            print(f"{CATALOG_PATH} is up to date")
+            return
+        for step, seconds in timings.items():
+            print(f"  {step:22s} {seconds:7.2f} s")
+        print(f"Wrote {CATALOG_PATH}")
+    else:
+        _bench(args.artists, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
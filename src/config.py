@@ -1,6 +1,8 @@
-"""Paths, constants, and feature lists loaded from training_summary.json."""
+"""Paths, constants, and feature lists loaded lazily from training_summary.json."""
 
+import functools
 import json
+import os
 from pathlib import Path
 
 
@@ -23,6 +25,7 @@ DATA_DIR = ROOT / "datasets" / "v3_features"
 MODEL_DIR = ROOT / "artifacts" / "models" / "xgboost_final_pipeline"
 EVAL_DIR = ROOT / "artifacts" / "evaluations" / "xgboost_final_pipeline"
 V2_DATA_DIR = ROOT / "datasets" / "v2" / "full"
+AUX_DATA_DIR = ROOT / "datasets" / "v1_aux"
 COUNTRIES_CSV = ROOT / "datasets" / "Countries Data By Aadarsh Vani.csv"
 CULTURAL_DIST_CSV = ROOT / "datasets" / "cultural_distance_matrix.csv"
 
@@ -31,19 +34,74 @@ TRAIN_PATH = DATA_DIR / "train.parquet"
 VAL_PATH = DATA_DIR / "val.parquet"
 TEST_PATH = DATA_DIR / "test.parquet"
 
+# --- Feature build (src.features): month-partitioned splits, LLM language cache ---
+V3_PARTITIONED_DIR = DATA_DIR / "partitioned"
+SONG_LANGUAGE_CACHE_PATH = DATA_DIR / "song_language_cache.json"
+
+# --- Incremental daily updates (src.incremental): per-date feature store + chart-history state ---
+V3_DAILY_DIR = DATA_DIR / "daily"
+INCREMENTAL_STATE_PATH = DATA_DIR / "incremental_state.duckdb"
+
+# --- Track dictionary (built from v2 by src.track_dictionary) ---
+TRACK_DICTIONARY_PATH = ROOT / "datasets" / "track_dictionary.parquet"
+TRACK_INDEX_PATH = ROOT / "datasets" / "track_dictionary.idx.npy"
+
+# --- Target-market priors by (date, country) (src.country_priors) ---
+COUNTRY_PRIORS_PATH = ROOT / "datasets" / "country_priors.npz"
+
+# --- Diffusion corridors by (month, origin, target) (src.corridors) ---
+CORRIDORS_PATH = ROOT / "datasets" / "corridors.npz"
+
+# --- Persistent DuckDB catalog (built by src.catalog) ---
+CATALOG_PATH = ROOT / "datasets" / "catalog.duckdb"
+
+# --- Evaluation / demo artifacts ---
+TEST_PREDICTIONS_PATH = EVAL_DIR / "test_predictions.parquet"
+DEMO_TRACK_SUMMARY_PATH = EVAL_DIR / "demo_track_summary.parquet"
+TEST_CONTRIBUTIONS_PATH = EVAL_DIR / "test_contributions.npy"
+TEST_CONTRIBUTIONS_INDEX_PATH = EVAL_DIR / "test_contributions_index.parquet"
+
+# --- Disk cache for loader results (see src.disk_cache) ---
+ARTIFACT_CACHE_DIR = Path(os.environ.get("ARTIFACT_CACHE_DIR", ROOT / ".cache" / "artifacts"))
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get("ARTIFACT_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+# --- Headless training (src.training): per-fold feature matrices reused across Optuna trials ---
+TRAINING_CACHE_DIR = Path(os.environ.get("TRAINING_CACHE_DIR", ROOT / ".cache" / "training"))
+
 # --- Constants ---
 RANDOM_STATE = 42
 TOP_K = 5
 
-# --- Load training summary ---
+# --- Training summary (read on first access, not at import) ---
 _SUMMARY_PATH = MODEL_DIR / "training_summary.json"
-with open(_SUMMARY_PATH) as _f:
-    TRAINING_SUMMARY = json.load(_f)
 
-PRUNED_ROW_FEATURE_COLS: list[str] = TRAINING_SUMMARY["pruned_row_feature_cols"]
-TRACK_FEATURE_COLS: list[str] = TRAINING_SUMMARY["track_feature_cols"]
-FILL_VALUES_TRAIN: dict[str, float] = TRAINING_SUMMARY["fill_values_train"]
-FILL_VALUES_FINAL: dict[str, float] = TRAINING_SUMMARY["fill_values_final"]
+# Module attributes resolved from training_summary.json by __getattr__ below:
+#   TRAINING_SUMMARY: dict
+#   PRUNED_ROW_FEATURE_COLS: list[str]
+#   TRACK_FEATURE_COLS: list[str]
+#   FILL_VALUES_TRAIN: dict[str, float]
+#   FILL_VALUES_FINAL: dict[str, float]
+_SUMMARY_ATTRS = {
+    "TRAINING_SUMMARY": None,
+    "PRUNED_ROW_FEATURE_COLS": "pruned_row_feature_cols",
+    "TRACK_FEATURE_COLS": "track_feature_cols",
+    "FILL_VALUES_TRAIN": "fill_values_train",
+    "FILL_VALUES_FINAL": "fill_values_final",
+}
+
+
+@functools.cache
+def load_training_summary() -> dict:
+    with open(_SUMMARY_PATH) as f:
+        return json.load(f)
+
+
+def __getattr__(name: str):
+    if name in _SUMMARY_ATTRS:
+        key = _SUMMARY_ATTRS[name]
+        summary = load_training_summary()
+        return summary if key is None else summary[key]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- Country list (62 Spotify markets) ---
 COUNTRY_LIST = [
@@ -114,6 +172,38 @@ COUNTRY_CONTINENT: dict[str, str] = {
 def country_to_rank_col(country: str) -> str:
     return "rank_" + country.lower().replace(" ", "_")
 
+# --- Country interning ---
+# uint8 code = position in COUNTRY_LIST; a set of countries is a 64-bit mask
+# with bit `code` set. UNKNOWN_COUNTRY_CODE marks names outside the 62 markets.
+N_COUNTRIES = len(COUNTRY_LIST)
+UNKNOWN_COUNTRY_CODE = 255
+COUNTRY_CODE: dict[str, int] = {c: i for i, c in enumerate(COUNTRY_LIST)}
+
+
+def countries_to_mask(countries) -> int:
+    mask = 0
+    for country in countries:
+        code = COUNTRY_CODE.get(country)
+        if code is not None:
+            mask |= 1 << code
+    return mask
+
+
+def mask_to_countries(mask: int) -> list[str]:
+    return [c for i, c in enumerate(COUNTRY_LIST) if mask >> i & 1]
+
+
+# Per-country membership masks: bit j of SAME_LANGUAGE_MASKS[i] is set when
+# COUNTRY_LIST[j] shares a primary language with COUNTRY_LIST[i].
+SAME_LANGUAGE_MASKS: list[int] = [
+    countries_to_mask(o for o in COUNTRY_LIST if COUNTRY_PRIMARY_LANG[o] == COUNTRY_PRIMARY_LANG[c])
+    for c in COUNTRY_LIST
+]
+SAME_CONTINENT_MASKS: list[int] = [
+    countries_to_mask(o for o in COUNTRY_LIST if COUNTRY_CONTINENT[o] == COUNTRY_CONTINENT[c])
+    for c in COUNTRY_LIST
+]
+
 # --- Available song languages ---
 SONG_LANGUAGES = [
     ("en", "English"), ("es", "Spanish"), ("pt", "Portuguese"),
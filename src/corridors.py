@@ -0,0 +1,288 @@
+"""Diffusion corridors: historical origin → target transition rates and lags.
+
+A track's first top200 entry in a country is an *event*. An event in origin
+o is followed by a *transition* to target t when the track first enters t
+1–60 days later (the label horizon); it is *at risk* of one unless the
+track had already entered t that day or before. Events are bucketed by the
+calendar month of the origin entry, so the history is a sparse
+(month × origin × target × lag) count tensor, found in one vectorized pass
+over first entries sorted by (track, date).
+
+A bucket is only counted once its 60-day horizon has closed. For each
+observation month the served tables hold, over the 12 most recent closed
+buckets, the transition rate (transitions / at-risk events) and the median
+lag in days of the transitions, as float32 months × 62 × 62 matrices (NaN
+where there is no history). Features for a (footprint, target) pair are a
+gather over the footprint's origin rows, as for ``cultural_dist_min``
+(``build_prediction_rows`` adds them to prediction rows; no model uses them yet):
+
+- ``corridor_rate_max``: highest transition rate from any origin
+- ``corridor_lag_min``: shortest median lag from any origin
+
+The store is ``datasets/corridors.npz``; ``python -m src.corridors build``
+rebuilds it from the catalog's ``track_country_firsts``, and
+``src.incremental`` extends it whenever a month's horizon closes. The app
+only loads it and never builds it in a request.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from src.artifacts import source_fingerprint
+from src.config import CORRIDORS_PATH, N_COUNTRIES
+from src.data import encode_countries
+
+HORIZON_DAYS = 60
+WINDOW_MONTHS = 12
+
+# First top200 date per (track, country): the events corridors are counted from.
+FIRST_CHART_SQL = """
+    SELECT track_id, region AS country, MIN(date) AS first_chart_date
+    FROM {source}
+    WHERE chart = 'top200'
+    GROUP BY track_id, region
+"""
+
+_LAG_BINS = HORIZON_DAYS + 1
+
+
+def _days(values) -> np.ndarray:
+    return pd.to_datetime(pd.Series(values)).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+def _month_of(days: np.ndarray) -> np.ndarray:
+    return np.asarray(days).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def _month_start(months) -> np.ndarray:
+    return np.asarray(months).astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+
+
+def _last_closed(last_day: int) -> int:
+    """Latest bucket whose every event has 60 days of data by ``last_day``."""
+    month = int(_month_of(np.int64(last_day)))
+    while _month_start(month + 1) + HORIZON_DAYS > last_day + 1:
+        month -= 1
+    return month
+
+
+def _window_end(months: np.ndarray) -> np.ndarray:
+    """Latest bucket closed before the first day of each observation month."""
+    end = months - 3
+    return np.where(_month_start(end + 1) + HORIZON_DAYS <= _month_start(months), end, end - 1)
+
+
+def transition_pass(firsts: pd.DataFrame, lo: int, hi: int) -> dict[str, np.ndarray]:
+    """Event, at-risk and transition counts for origin buckets ``lo..hi``.
+
+    ``firsts``: FIRST_CHART_SQL rows, including every entry of each track with
+    an event in those buckets. Returns dense ``events`` (buckets, 62) and
+    ``blocked`` (buckets, 62, 62) counts and the sparse ``transitions`` as
+    (bucket, origin, target, lag, count) columns; buckets are relative to lo.
+    """
+    codes = encode_countries(firsts["country"])
+    known = codes < N_COUNTRIES
+    frame = pd.DataFrame({
+        "track": pd.factorize(firsts["track_id"].to_numpy()[known])[0],
+        "code": codes[known].astype(np.int64),
+        "day": _days(firsts["first_chart_date"])[known],
+    }).sort_values(["track", "day"], kind="stable")
+    track, code, day = (frame[c].to_numpy() for c in ("track", "code", "day"))
+    bucket = _month_of(day) - lo
+    n_buckets = hi - lo + 1
+    in_range = (bucket >= 0) & (bucket < n_buckets)
+
+    events = np.zeros((n_buckets, N_COUNTRIES), dtype=np.int64)
+    np.add.at(events, (bucket[in_range], code[in_range]), 1)
+    blocked = np.zeros((n_buckets, N_COUNTRIES, N_COUNTRIES), dtype=np.int64)
+    moves = []
+    # Entry i and the entry k places later in the same track, for every k
+    for k in range(1, len(track)):
+        a = np.flatnonzero(track[:-k] == track[k:])
+        if not a.size:
+            break
+        b = a + k
+        lag = day[b] - day[a]
+        # b's target was already entered when b's origin event happened
+        at = a[in_range[b]]
+        np.add.at(blocked, (bucket[at + k], code[at + k], code[at]), 1)
+        same_day = a[(lag == 0) & in_range[a]]
+        np.add.at(blocked, (bucket[same_day], code[same_day], code[same_day + k]), 1)
+        move = (lag >= 1) & (lag <= HORIZON_DAYS) & in_range[a]
+        moves.append(np.stack([bucket[a[move]], code[a[move]], code[b[move]], lag[move]]))
+
+    cells = np.concatenate(moves, axis=1) if moves else np.zeros((4, 0), dtype=np.int64)
+    cells, counts = np.unique(cells, axis=1, return_counts=True)
+    return {"events": events, "blocked": blocked, "transitions": np.vstack([cells, counts]).astype(np.int64)}
+
+
+class CorridorTensor:
+    def __init__(self, first_bucket: int, events: np.ndarray, blocked: np.ndarray, transitions: np.ndarray):
+        """Counts per origin bucket from ``first_bucket`` (months since 1970-01),
+        as returned by transition_pass (transitions with absolute buckets).
+        """
+        self.first_bucket = first_bucket
+        self.events = events
+        self.blocked = blocked
+        self.transitions = transitions
+        self._derive_tables()
+
+    @property
+    def last_bucket(self) -> int:
+        return self.first_bucket + len(self.events) - 1
+
+    @property
+    def last_month(self) -> date:
+        """Last closed bucket, as its first day."""
+        return np.datetime64(self.last_bucket, "M").astype("datetime64[D]").astype(date)
+
+    def _derive_tables(self) -> None:
+        # One row per observation month, up to the first that sees every bucket
+        months = np.arange(self.first_bucket, self.last_bucket + 5)
+        ends = np.minimum(_window_end(months), self.last_bucket)
+        months = months[: np.searchsorted(ends, self.last_bucket) + 1]
+        ends = ends[: len(months)] - self.first_bucket
+        starts = np.maximum(ends - WINDOW_MONTHS + 1, 0)
+
+        n_rows = len(months)
+        t_bucket, origin, target, lag, count = self.transitions
+        t_bucket = t_bucket - self.first_bucket
+        moved = np.zeros((len(self.events), N_COUNTRIES, N_COUNTRIES), dtype=np.int64)
+        np.add.at(moved, (t_bucket, origin, target), count)
+
+        def window_sums(counts: np.ndarray) -> np.ndarray:
+            cumulative = np.concatenate([np.zeros_like(counts[:1]), np.cumsum(counts, axis=0)])
+            sums = cumulative[np.maximum(ends + 1, 0)] - cumulative[starts]
+            sums[ends < 0] = 0
+            return sums
+
+        at_risk = window_sums(self.events)[:, :, None] - window_sums(self.blocked)
+        at_risk[:, np.arange(N_COUNTRIES), np.arange(N_COUNTRIES)] = 0
+        moved = window_sums(moved)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.rate = np.where(at_risk > 0, moved / at_risk, np.nan).astype(np.float32)
+
+        # Lower median lag per window, from the sparse lag histogram
+        self.median_lag = np.full((n_rows, N_COUNTRIES, N_COUNTRIES), np.nan, dtype=np.float32)
+        for row in range(n_rows):
+            if ends[row] < 0:
+                continue
+            sel = (t_bucket >= starts[row]) & (t_bucket <= ends[row])
+            hist = np.zeros((N_COUNTRIES, N_COUNTRIES, _LAG_BINS), dtype=np.int64)
+            np.add.at(hist, (origin[sel], target[sel], lag[sel]), count[sel])
+            cumulative = np.cumsum(hist, axis=2)
+            total = cumulative[:, :, -1]
+            median = np.argmax(cumulative * 2 >= total[:, :, None], axis=2)
+            self.median_lag[row] = np.where(total > 0, median, np.nan)
+        self.first_month = int(months[0])
+
+    @classmethod
+    def from_firsts(cls, firsts: pd.DataFrame, last_date) -> CorridorTensor:
+        """One pass over first entries, counting buckets closed by ``last_date``."""
+        first_bucket = int(_month_of(_days(firsts["first_chart_date"]).min()))
+        last_bucket = _last_closed(int(_days([last_date])[0]))
+        if last_bucket < first_bucket:
+            raise ValueError(f"no month of first entries has a closed {HORIZON_DAYS}-day horizon by {last_date}")
+        counts = transition_pass(firsts, first_bucket, last_bucket)
+        counts["transitions"][0] += first_bucket
+        return cls(first_bucket, **counts)
+
+    def pending(self, last_date) -> tuple[date, date] | None:
+        """First and last day of the buckets ``last_date`` closes, or None."""
+        closed = _last_closed(int(_days([last_date])[0]))
+        if closed <= self.last_bucket:
+            return None
+        start, end = _month_start([self.last_bucket + 1, closed + 1])
+        return np.datetime64(int(start), "D").astype(date), np.datetime64(int(end) - 1, "D").astype(date)
+
+    def update(self, firsts: pd.DataFrame, last_date) -> bool:
+        """Add the buckets closed by ``last_date``; ``firsts`` holds every entry
+        of the tracks with an event in them (see pending). False if none closed.
+        """
+        closed = _last_closed(int(_days([last_date])[0]))
+        if closed <= self.last_bucket:
+            return False
+        counts = transition_pass(firsts, self.last_bucket + 1, closed)
+        counts["transitions"][0] += self.last_bucket + 1
+        self.events = np.concatenate([self.events, counts["events"]])
+        self.blocked = np.concatenate([self.blocked, counts["blocked"]])
+        self.transitions = np.concatenate([self.transitions, counts["transitions"]], axis=1)
+        self._derive_tables()
+        return True
+
+    def lookup(self, day: date, origin_codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """(62,) corridor_rate_max and corridor_lag_min over the origins."""
+        if not len(origin_codes):
+            return np.full(N_COUNTRIES, np.nan, np.float32), np.full(N_COUNTRIES, np.nan, np.float32)
+        month = (day.year - 1970) * 12 + day.month - 1
+        row = min(max(month - self.first_month, 0), len(self.rate) - 1)
+        return (np.fmax.reduce(self.rate[row][origin_codes], axis=0),
+                np.fmin.reduce(self.median_lag[row][origin_codes], axis=0))
+
+    def save(self, path: Path = CORRIDORS_PATH) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f, first_bucket=np.int64(self.first_bucket), events=self.events, blocked=self.blocked,
+                transitions=self.transitions, first_month=np.int64(self.first_month),
+                rate=self.rate, median_lag=self.median_lag,
+            )
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path = CORRIDORS_PATH) -> CorridorTensor:
+        with np.load(path) as data:
+            tensor = cls.__new__(cls)
+            tensor.first_bucket = int(data["first_bucket"])
+            tensor.first_month = int(data["first_month"])
+            for name in ("events", "blocked", "transitions", "rate", "median_lag"):
+                setattr(tensor, name, data[name])
+        return tensor
+
+
+def build_corridors(path: Path = CORRIDORS_PATH) -> CorridorTensor:
+    """Rebuild the store from the catalog's track_country_firsts."""
+    from src.catalog import catalog_connection
+
+    with catalog_connection() as con:
+        firsts = con.execute("SELECT * FROM track_country_firsts").fetchdf()
+    tensor = CorridorTensor.from_firsts(firsts, firsts["first_chart_date"].max())
+    tensor.save(path)
+    return tensor
+
+
+def load_corridors() -> CorridorTensor:
+    """The current store (reloaded after monthly updates). Building is left
+    to ``python -m src.corridors build``.
+    """
+    return _load_corridors(source_fingerprint([CORRIDORS_PATH]))
+
+
+@st.cache_resource
+def _load_corridors(fingerprint: str) -> CorridorTensor:
+    if not CORRIDORS_PATH.exists():
+        raise FileNotFoundError(f"{CORRIDORS_PATH} is missing; build it with `python -m src.corridors build`")
+    return CorridorTensor.load(CORRIDORS_PATH)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage the origin x target x month diffusion corridor store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="Rebuild the store from the catalog's track_country_firsts")
+    parser.parse_args()
+    tensor = build_corridors()
+    print(f"Wrote {CORRIDORS_PATH} ({len(tensor.events)} monthly buckets through {tensor.last_month:%Y-%m}, "
+          f"{tensor.transitions.shape[1]:,} non-zero (month, origin, target, lag) cells)")
+
+
+if __name__ == "__main__":
+    main()
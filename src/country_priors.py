@@ -0,0 +1,201 @@
+"""Target-market priors by (date, country): trailing 30-day stream and new-entry rates.
+
+``target_avg_daily_streams`` and ``target_new_entry_rate_30d`` describe a
+target market over the 30 days before the observation date (top200 streams
+per chart entry, and the share of entries that were new). Per-day top200
+stats are accumulated into int64 prefix sums over a dense calendar, so the
+window for any date is one subtraction of two rows. The served tables are
+float32 (days + 1) × 62 matrices with 0 where a market had no entries
+(as the v3 build fills them), indexed by days since the first chart date;
+dates past the last chart day use its most recent window.
+
+The v3 build (``src.features``) reads the same windows in float64, and the
+incremental build appends each processed day, so training rows, daily rows
+and live predictions share one table. The store is
+``datasets/country_priors.npz``; ``python -m src.country_priors`` rebuilds
+it from the catalog's ``country_daily_stats``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from src.artifacts import source_fingerprint
+from src.config import COUNTRY_LIST, COUNTRY_PRIORS_PATH, N_COUNTRIES
+from src.data import encode_countries
+
+WINDOW_DAYS = 30
+
+# Per-(country, date) top200 stats the priors are accumulated from.
+COUNTRY_DAY_STATS_SQL = """
+    SELECT
+        region AS country,
+        date,
+        SUM(streams) AS total_streams,
+        COUNT(*) AS chart_entries,
+        SUM(CASE WHEN trend = 'NEW_ENTRY' THEN 1 ELSE 0 END) AS new_entries
+    FROM {source}
+    WHERE chart = 'top200'
+    GROUP BY region, date
+"""
+
+_STAT_COLUMNS = ["total_streams", "chart_entries", "new_entries"]
+
+
+def _day(value) -> int:
+    return int(np.datetime64(pd.Timestamp(value).date(), "D").astype(np.int64))
+
+
+def _days(values) -> np.ndarray:
+    return pd.to_datetime(pd.Series(values)).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+def _daily_matrix(stats: pd.DataFrame, start: int, n_days: int) -> np.ndarray:
+    """(3, n_days, 62) int64 stats on a dense calendar from ``start``."""
+    daily = np.zeros((len(_STAT_COLUMNS), n_days, N_COUNTRIES), dtype=np.int64)
+    codes = encode_countries(stats["country"])
+    known = codes < N_COUNTRIES
+    offsets = _days(stats["date"])[known] - start
+    for i, col in enumerate(_STAT_COLUMNS):
+        np.add.at(daily[i], (offsets, codes[known]), stats[col].fillna(0).to_numpy(dtype=np.int64)[known])
+    return daily
+
+
+class CountryPriors:
+    def __init__(self, start: int, cumulative: np.ndarray):
+        """``cumulative[s, i, c]``: stat s summed over days before start + i."""
+        self.start = start
+        self.cumulative = cumulative
+        self._derive_tables()
+
+    def _derive_tables(self) -> None:
+        avg, rate = self._window(np.arange(self.cumulative.shape[1]))
+        self.avg_daily_streams = np.nan_to_num(avg).astype(np.float32)
+        self.new_entry_rate = np.nan_to_num(rate).astype(np.float32)
+
+    @classmethod
+    def from_daily(cls, stats: pd.DataFrame) -> CountryPriors:
+        """One pass over per-(country, date) stats (COUNTRY_DAY_STATS_SQL columns)."""
+        days = _days(stats["date"])
+        start = int(days.min())
+        daily = _daily_matrix(stats, start, int(days.max()) - start + 1)
+        cumulative = np.zeros((daily.shape[0], daily.shape[1] + 1, N_COUNTRIES), dtype=np.int64)
+        np.cumsum(daily, axis=1, out=cumulative[:, 1:])
+        return cls(start, cumulative)
+
+    @property
+    def last_day(self) -> date:
+        """Last chart day included."""
+        return (np.datetime64(self.start + self.cumulative.shape[1] - 2, "D")).astype(date)
+
+    def rows(self, dates) -> np.ndarray:
+        """Table row for each observation date (clipped to the table)."""
+        return np.clip(_days(dates) - self.start, 0, self.cumulative.shape[1] - 1)
+
+    def _window(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        window = self.cumulative[:, rows] - self.cumulative[:, np.maximum(rows - WINDOW_DAYS, 0)]
+        streams, entries, new_entries = window.astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (np.where(entries > 0, streams / entries, np.nan),
+                    np.where(entries > 0, new_entries / entries, np.nan))
+
+    def exact(self, dates) -> tuple[np.ndarray, np.ndarray]:
+        """float64 (len(dates), 62) priors, NaN where a market had no entries."""
+        return self._window(self.rows(dates))
+
+    def lookup(self, day) -> tuple[np.ndarray, np.ndarray]:
+        """float32 (62,) priors for one observation date, as served."""
+        row = self.rows([day])[0]
+        return self.avg_daily_streams[row], self.new_entry_rate[row]
+
+    def append_day(self, day, stats: pd.DataFrame) -> None:
+        """Add one chart day after last_day (days in between count as empty)."""
+        offset = _day(day) - self.start
+        n_days = self.cumulative.shape[1] - 1
+        if offset < n_days:
+            raise ValueError(f"{day} is not after the last chart day {self.last_day}")
+        daily = np.zeros((len(_STAT_COLUMNS), offset + 1 - n_days, N_COUNTRIES), dtype=np.int64)
+        if len(stats):
+            daily[:, -1] = _daily_matrix(stats, _day(day), 1)[:, 0]
+        extension = self.cumulative[:, -1:] + np.cumsum(daily, axis=1)
+        self.cumulative = np.concatenate([self.cumulative, extension], axis=1)
+        self._derive_tables()
+
+    def save(self, path: Path = COUNTRY_PRIORS_PATH) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f, start=np.int64(self.start), cumulative=self.cumulative,
+                avg_daily_streams=self.avg_daily_streams, new_entry_rate=self.new_entry_rate,
+            )
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path = COUNTRY_PRIORS_PATH) -> CountryPriors:
+        with np.load(path) as data:
+            priors = cls.__new__(cls)
+            priors.start = int(data["start"])
+            priors.cumulative = data["cumulative"]
+            priors.avg_daily_streams = data["avg_daily_streams"]
+            priors.new_entry_rate = data["new_entry_rate"]
+        return priors
+
+    def to_frame(self, dates) -> pd.DataFrame:
+        """Long (observation_time, target_country) rows of exact priors."""
+        dates = pd.Series(pd.unique(pd.Series(dates)))
+        avg, rate = self.exact(dates)
+        return pd.DataFrame({
+            "observation_time": np.repeat(dates.to_numpy(), N_COUNTRIES),
+            "target_country": np.tile(np.asarray(COUNTRY_LIST, dtype=object), len(dates)),
+            "target_avg_daily_streams": avg.ravel(),
+            "target_new_entry_rate_30d": rate.ravel(),
+        })
+
+
+def build_country_priors(path: Path = COUNTRY_PRIORS_PATH) -> CountryPriors:
+    """Rebuild the store from the catalog's country_daily_stats."""
+    from src.catalog import catalog_connection
+
+    with catalog_connection() as con:
+        stats = con.execute("SELECT * FROM country_daily_stats").fetchdf()
+    priors = CountryPriors.from_daily(stats)
+    priors.save(path)
+    return priors
+
+
+def load_country_priors() -> CountryPriors | None:
+    """The current store (reloaded after daily updates); built on first use.
+    None without a store or catalog to build it from.
+    """
+    return _load_country_priors(source_fingerprint([COUNTRY_PRIORS_PATH]))
+
+
+@st.cache_resource
+def _load_country_priors(fingerprint: str) -> CountryPriors | None:
+    if COUNTRY_PRIORS_PATH.exists():
+        return CountryPriors.load(COUNTRY_PRIORS_PATH)
+    try:
+        return build_country_priors()
+    except Exception as e:
+        st.warning(f"Target-market priors unavailable, using training medians: {e}")
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the (date x country) target-market prior tables.")
+    parser.parse_args()
+    priors = build_country_priors()
+    print(f"Wrote {COUNTRY_PRIORS_PATH} ({priors.cumulative.shape[1]} days x {N_COUNTRIES} countries, "
+          f"through {priors.last_day})")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@
 
 from __future__ import annotations
 
-import duckdb
+from datetime import date
+
 import numpy as np
 import pandas as pd
 import streamlit as st
@@ -14,11 +15,50 @@ from src.config import (
     CONTINENT_ONEHOT_COLS,
     CULTURAL_DIST_CSV,
     COUNTRIES_CSV,
-    FILL_VALUES_FINAL,
-    PRUNED_ROW_FEATURE_COLS,
-    V2_DATA_DIR,
+    MODEL_DIR,
+    N_COUNTRIES,
+    SAME_CONTINENT_MASKS,
+    SAME_LANGUAGE_MASKS,
+    UNKNOWN_COUNTRY_CODE,
+    countries_to_mask,
     country_to_rank_col,
 )
+from src.disk_cache import disk_cache
+
+
+# ---------------------------------------------------------------------------
+# Country interning
+# ---------------------------------------------------------------------------
+
+COUNTRY_DTYPE = pd.CategoricalDtype(COUNTRY_LIST)
+SAME_LANGUAGE_MASK_ARRAY = np.array(SAME_LANGUAGE_MASKS, dtype=np.uint64)
+SAME_CONTINENT_MASK_ARRAY = np.array(SAME_CONTINENT_MASKS, dtype=np.uint64)
+
+
+def encode_countries(values) -> np.ndarray:
+    """Country names -> uint8 codes (UNKNOWN_COUNTRY_CODE for non-markets)."""
+    codes = pd.Categorical(values, dtype=COUNTRY_DTYPE).codes
+    return np.where(codes < 0, UNKNOWN_COUNTRY_CODE, codes).astype(np.uint8)
+
+
+def codes_in_mask(codes: np.ndarray, mask: int) -> np.ndarray:
+    """Vectorized membership test of uint8 country codes against a footprint mask."""
+    codes = np.asarray(codes, dtype=np.uint64)
+    known = codes < N_COUNTRIES
+    bits = (np.uint64(mask) >> np.where(known, codes, 0)) & np.uint64(1)
+    return known & (bits == 1)
+
+
+def intern_country_column(df: pd.DataFrame, col: str = "target_country") -> pd.DataFrame:
+    """Store a country-name column as a COUNTRY_LIST categorical (uint8 codes).
+    Left unchanged if it holds names outside the 62 markets.
+    """
+    if col not in df.columns or isinstance(df[col].dtype, pd.CategoricalDtype):
+        return df
+    interned = df[col].astype(COUNTRY_DTYPE)
+    if interned.isna().sum() == df[col].isna().sum():
+        df[col] = interned
+    return df
 
 
 # ---------------------------------------------------------------------------
@@ -32,6 +72,8 @@ FEATURE_EXCLUDE = [
 
 
 def load_row_level_split(path, max_tracks: int | None = None) -> pd.DataFrame:
+    import duckdb
+
     con = duckdb.connect()
     parquet_path = path.as_posix()
     if max_tracks is None:
@@ -51,7 +93,65 @@ def load_row_level_split(path, max_tracks: int | None = None) -> pd.DataFrame:
         """
     df = con.execute(query).fetchdf()
     df["observation_time"] = pd.to_datetime(df["observation_time"])
+    intern_country_column(df)
+    con.close()
+    return df
+
+
+# Per-target columns that the track-level split aggregates to _mean / _max
+TARGET_SPECIFIC_COLS = [
+    "artist_prior_success_in_target",
+    "target_population",
+    "target_avg_daily_streams",
+    "target_new_entry_rate_30d",
+    "target_continent_africa",
+    "target_continent_asia",
+    "target_continent_europe",
+    "target_continent_north_america",
+    "target_continent_oceania",
+    "target_continent_south_america",
+    "cultural_dist_min",
+    "cultural_dist_missing",
+    "same_language_flag",
+    "same_continent_flag",
+    "neighbor_entered_count",
+]
+EXCLUDE_FROM_TRACK_LEVEL = {"target_country", "did_enter_within_60d", "days_to_entry"}
+
+
+def load_track_level_split(path) -> pd.DataFrame:
+    """One row per track (stage-1 will-spread classifier input): will_spread,
+    min_days_to_spread, candidate_count, the track-constant columns and
+    _mean/_max aggregates of TARGET_SPECIFIC_COLS.
+    """
+    import duckdb
+
+    con = duckdb.connect()
+    parquet_path = path.as_posix()
+    raw_cols = list(con.execute(f"SELECT * FROM read_parquet('{parquet_path}') LIMIT 0").fetchdf().columns)
+    constant_cols = [c for c in raw_cols if c not in EXCLUDE_FROM_TRACK_LEVEL and c not in TARGET_SPECIFIC_COLS]
+    rank_cols = [c for c in raw_cols if c.startswith("rank_")]
+
+    select_parts = [
+        "track_id",
+        "MAX(CAST(did_enter_within_60d AS INTEGER)) AS will_spread",
+        "MIN(CASE WHEN did_enter_within_60d = 1 THEN days_to_entry END) AS min_days_to_spread",
+        "COUNT(*) AS candidate_count",
+    ]
+    select_parts.extend(f"ANY_VALUE({col}) AS {col}" for col in constant_cols if col != "track_id")
+    for col in TARGET_SPECIFIC_COLS:
+        select_parts.append(f"AVG({col}) AS {col}_mean")
+        select_parts.append(f"MAX({col}) AS {col}_max")
+
+    df = con.execute(f"""
+        SELECT {', '.join(select_parts)}
+        FROM read_parquet('{parquet_path}')
+        GROUP BY track_id
+        ORDER BY track_id
+    """).fetchdf()
     con.close()
+    df["observation_time"] = pd.to_datetime(df["observation_time"])
+    df["origin_country_count_at_obs"] = (df[rank_cols].fillna(0) > 0).sum(axis=1)
     return df
 
 
@@ -72,45 +172,87 @@ def prepare_ranker_inputs(
 
 
 # ---------------------------------------------------------------------------
-# Artist lookup (NEW)
+# Track offset index
 # ---------------------------------------------------------------------------
 
-_V2_PARQUET = f"read_parquet('{V2_DATA_DIR.as_posix()}/*/*.parquet')"
+class TrackSlicer:
+    """A frame stored sorted by track_id with a track_id -> (start, stop) index,
+    so selecting one track is a contiguous positional slice instead of a scan.
+    """
+
+    def __init__(self, df: pd.DataFrame, track_col: str = "track_id"):
+        if not df[track_col].is_monotonic_increasing:
+            df = df.sort_values(track_col, kind="stable")
+        self.df = df.reset_index(drop=True)
+        track_ids = self.df[track_col].to_numpy()
+        if len(track_ids):
+            starts = np.flatnonzero(np.r_[True, track_ids[1:] != track_ids[:-1]])
+            stops = np.r_[starts[1:], len(track_ids)]
+        else:
+            starts = stops = np.empty(0, dtype=np.int64)
+        self.offsets: dict[str, tuple[int, int]] = {
+            track_id: (int(start), int(stop))
+            for track_id, start, stop in zip(track_ids[starts], starts, stops)
+        }
 
+    def __contains__(self, track_id) -> bool:
+        return track_id in self.offsets
 
-def lookup_artist(artist_name: str) -> dict:
-    """Query v2 dataset for an artist's prior chart history.
-    Returns dict with artist_prior_chart_count, artist_prior_unique_regions,
-    artist_prior_best_rank, artist_prior_unique_tracks, multi_artist_flag.
-    Returns zeros if artist not found.
-    """
-    zeros = {
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def get(self, track_id) -> pd.DataFrame:
+        start, stop = self.offsets.get(track_id, (0, 0))
+        return self.df.iloc[start:stop]
+
+
+# ---------------------------------------------------------------------------
+# Artist lookup (NEW)
+# ---------------------------------------------------------------------------
+
+def empty_artist_history() -> dict:
+    """Zero-history artist features, used when the artist is not in v2."""
+    return {
         "artist_prior_chart_count": 0,
         "artist_prior_unique_regions": 0,
-        "artist_prior_best_rank": 200,
+        "artist_prior_best_rank": 201,
         "artist_prior_unique_tracks": 0,
         "multi_artist_flag": 0,
         "artist_country_ratio": 0.0,
-        "charted_countries": set(),
+        "success_in_target": np.zeros(N_COUNTRIES, dtype=np.int64),
     }
+
+
+def lookup_artist(artist_name: str, exact: bool = False, as_of: date | None = None) -> dict:
+    """Query v2 dataset for an artist's prior chart history.
+    Returns dict with artist_prior_chart_count, artist_prior_unique_regions,
+    artist_prior_best_rank, artist_prior_unique_tracks, multi_artist_flag,
+    artist_country_ratio and per-target success_in_target counts.
+    With exact=True, artist_name is a canonical artist_key (see
+    src.artist_index) and the features count top200 history strictly before
+    as_of (default today), as in training (see src.artist_history).
+    Otherwise it is a case-insensitive substring of the v2 artist string,
+    matched over all of v2.
+    Returns zeros if artist not found.
+    """
+    zeros = empty_artist_history()
     if not artist_name or not artist_name.strip():
         return zeros
 
-    con = duckdb.connect()
+    if exact:
+        from src.artist_history import load_artist_history
+
+        try:
+            return load_artist_history().as_of(artist_name, as_of or date.today())
+        except Exception as e:
+            st.warning(f"Artist lookup failed: {e}")
+            return zeros
+
+    from src.catalog import catalog_connection
+
     try:
-        result = con.execute(
-            f"""
-            SELECT
-                COUNT(*) as chart_count,
-                COUNT(DISTINCT source_country_norm) as unique_regions,
-                MIN(rank) as best_rank,
-                COUNT(DISTINCT track_id) as unique_tracks,
-                LIST(DISTINCT source_country_norm) as countries
-            FROM {_V2_PARQUET}
-            WHERE LOWER(artist) LIKE '%' || LOWER(?) || '%'
-            """,
-            [artist_name.strip()],
-        ).fetchdf()
+        with catalog_connection() as con:
+            result = con.execute("SELECT * FROM artist_stats(?)", [artist_name.strip()]).fetchdf()
 
         if result.empty or result.iloc[0]["chart_count"] == 0:
             return zeros
@@ -127,13 +269,11 @@ def lookup_artist(artist_name: str) -> dict:
             "artist_country_ratio": (
                 int(row["unique_regions"]) / 62.0 if row["unique_regions"] else 0.0
             ),
-            "charted_countries": countries,
+            "success_in_target": codes_in_mask(np.arange(N_COUNTRIES), countries_to_mask(countries)).astype(np.int64),
         }
     except Exception as e:
         st.warning(f"Artist lookup failed: {e}")
         return zeros
-    finally:
-        con.close()
 
 
 # ---------------------------------------------------------------------------
@@ -141,13 +281,29 @@ def lookup_artist(artist_name: str) -> dict:
 # ---------------------------------------------------------------------------
 
 @st.cache_data
+@disk_cache([COUNTRIES_CSV, CULTURAL_DIST_CSV, MODEL_DIR / "training_summary.json"])
 def load_reference_data() -> dict:
     """Load country metadata and cultural distance matrix. Returns dict with
     'countries_df', 'cultural_dist_df', and 'country_metadata'.
     """
+    from src.config import FILL_VALUES_FINAL
+
     countries_df = pd.read_csv(COUNTRIES_CSV)
     cultural_dist_df = pd.read_csv(CULTURAL_DIST_CSV, index_col="country")
 
+    # Dense 62x62 distance matrix in COUNTRY_LIST order (NaN where unknown)
+    cultural_dist_matrix = (
+        cultural_dist_df.reindex(index=COUNTRY_LIST, columns=COUNTRY_LIST).to_numpy(dtype=float)
+    )
+
+    # Top-5 cultural neighbours of each target as a footprint mask
+    neighbor_masks = np.zeros(N_COUNTRIES, dtype=np.uint64)
+    for code, target in enumerate(COUNTRY_LIST):
+        if target in cultural_dist_df.index:
+            target_dists = cultural_dist_df.loc[target].dropna().sort_values()
+            neighbors = [c for c in target_dists.index[:6] if c != target][:5]
+            neighbor_masks[code] = np.uint64(countries_to_mask(neighbors))
+
     # Build per-country metadata for the 62 Spotify markets
     country_metadata = {}
     for country in COUNTRY_LIST:
@@ -163,18 +319,11 @@ def load_reference_data() -> dict:
         "countries_df": countries_df,
         "cultural_dist_df": cultural_dist_df,
         "country_metadata": country_metadata,
+        "cultural_dist_matrix": cultural_dist_matrix,
+        "neighbor_masks": neighbor_masks,
     }
 
 
-def _get_cultural_distance(cultural_dist_df: pd.DataFrame, origin: str, target: str) -> float | None:
-    """Get Hofstede cultural distance between two countries. Returns None if not available."""
-    if origin in cultural_dist_df.index and target in cultural_dist_df.columns:
-        val = cultural_dist_df.loc[origin, target]
-        if pd.notna(val):
-            return float(val)
-    return None
-
-
 # ---------------------------------------------------------------------------
 # Build prediction rows for custom song (NEW)
 # ---------------------------------------------------------------------------
@@ -188,135 +337,126 @@ def build_prediction_rows(
 
     song_input keys:
         artist_name, song_title, song_language, chart_footprint (list of {country, rank}),
-        on_viral50, release_date, explicit, audio_features (dict)
+        on_viral50, release_date, observation_date (first chart date, default today),
+        explicit, audio_features (dict)
     """
-    cultural_dist_df = reference_data["cultural_dist_df"]
+    from src.config import FILL_VALUES_FINAL, PRUNED_ROW_FEATURE_COLS
+
     country_metadata = reference_data["country_metadata"]
+    n = N_COUNTRIES
 
-    # Origin countries from chart footprint
+    # Origin countries from chart footprint, as a 62-bit mask
     chart_footprint = song_input.get("chart_footprint", [])
-    origin_countries = {entry["country"] for entry in chart_footprint}
     origin_ranks = {entry["country"]: entry["rank"] for entry in chart_footprint}
-
-    # Compute days_since_release
-    from datetime import date
-    release_date = song_input.get("release_date", date.today())
-    days_since_release = (date.today() - release_date).days
+    footprint_mask = np.uint64(countries_to_mask(origin_ranks))
+    origin_codes = encode_countries(list(origin_ranks))
+    origin_codes = origin_codes[origin_codes != UNKNOWN_COUNTRY_CODE]
+
+    # Compute days_since_release as of the observation (first chart) date
+    observation_date = song_input.get("observation_date", date.today())
+    release_date = song_input.get("release_date", observation_date)
+    days_since_release = (observation_date - release_date).days
     is_friday_release = 1 if release_date.weekday() == 4 else 0
 
-    rows = []
-    for target in COUNTRY_LIST:
-        row = {}
-
-        # Rank columns: set the rank for countries in footprint, 0 otherwise
-        for country in COUNTRY_LIST:
-            rank_col = country_to_rank_col(country)
-            if rank_col in PRUNED_ROW_FEATURE_COLS:
-                row[rank_col] = origin_ranks.get(country, 0)
-
-        # Audio features (use provided or defaults from fill values)
-        audio_defaults = {
-            "af_danceability": FILL_VALUES_FINAL.get("af_danceability", 0.7),
-            "af_energy": FILL_VALUES_FINAL.get("af_energy", 0.64),
-            "af_valence": FILL_VALUES_FINAL.get("af_valence", 0.5),
-            "af_tempo": FILL_VALUES_FINAL.get("af_tempo", 120.0),
-            "af_acousticness": FILL_VALUES_FINAL.get("af_acousticness", 0.2),
-            "af_speechiness": FILL_VALUES_FINAL.get("af_speechiness", 0.08),
-            "af_instrumentalness": FILL_VALUES_FINAL.get("af_instrumentalness", 0.0),
-            "af_liveness": FILL_VALUES_FINAL.get("af_liveness", 0.12),
-            "af_key": FILL_VALUES_FINAL.get("af_key", 5.0),
-            "af_loudness": FILL_VALUES_FINAL.get("af_loudness", -6.8),
-            "af_mode": FILL_VALUES_FINAL.get("af_mode", 1.0),
-            "af_time_signature": FILL_VALUES_FINAL.get("af_time_signature", 4.0),
-            "duration_ms": FILL_VALUES_FINAL.get("duration_ms", 193846.0),
-        }
-        user_audio = song_input.get("audio_features", {})
-        for k, default in audio_defaults.items():
-            row[k] = user_audio.get(k, default)
-
-        # Track metadata
-        row["explicit"] = 1 if song_input.get("explicit", False) else 0
-        row["days_since_release"] = max(days_since_release, 0)
-        row["is_friday_release"] = is_friday_release
-        row["track_in_viral50_at_obs"] = 1 if song_input.get("on_viral50", False) else 0
-
-        # Artist history
-        row["artist_prior_chart_count"] = artist_info["artist_prior_chart_count"]
-        row["artist_prior_unique_regions"] = artist_info["artist_prior_unique_regions"]
-        row["artist_prior_best_rank"] = artist_info["artist_prior_best_rank"]
-        row["artist_prior_unique_tracks"] = artist_info["artist_prior_unique_tracks"]
-        row["multi_artist_flag"] = artist_info["multi_artist_flag"]
-        row["artist_country_ratio"] = artist_info["artist_country_ratio"]
-
-        # Artist prior success in target
-        charted_countries = artist_info.get("charted_countries", set())
-        row["artist_prior_success_in_target"] = 1 if target in charted_countries else 0
-
-        # Target country priors
-        meta = country_metadata.get(target, {})
-        row["target_population"] = meta.get("population", FILL_VALUES_FINAL.get("target_population", 10_000_000))
-        row["target_avg_daily_streams"] = FILL_VALUES_FINAL.get("target_avg_daily_streams", 10738.0)
-        row["target_new_entry_rate_30d"] = FILL_VALUES_FINAL.get("target_new_entry_rate_30d", 0.051)
-
-        # Continent one-hot
-        target_continent = COUNTRY_CONTINENT.get(target, "")
-        for col in CONTINENT_ONEHOT_COLS:
-            continent_name = col.replace("target_continent_", "").replace("_", " ").title()
-            row[col] = 1 if continent_name == target_continent else 0
-
-        # Origin-target relationship features
-        song_lang = song_input.get("song_language", "en")
-        target_lang = COUNTRY_PRIMARY_LANG.get(target, "")
-
-        # same_language_flag: any origin country shares language with target
-        row["same_language_flag"] = 0
-        for oc in origin_countries:
-            if COUNTRY_PRIMARY_LANG.get(oc, "") == target_lang:
-                row["same_language_flag"] = 1
-                break
-
-        # song_lang_matches_target
-        row["song_lang_matches_target"] = 1 if song_lang == target_lang else 0
-
-        # same_continent_flag
-        target_cont = COUNTRY_CONTINENT.get(target, "")
-        row["same_continent_flag"] = 0
-        for oc in origin_countries:
-            if COUNTRY_CONTINENT.get(oc, "") == target_cont:
-                row["same_continent_flag"] = 1
-                break
-
-        # Cultural distance
-        min_dist = None
-        for oc in origin_countries:
-            d = _get_cultural_distance(cultural_dist_df, oc, target)
-            if d is not None:
-                min_dist = d if min_dist is None else min(min_dist, d)
-        if min_dist is not None:
-            row["cultural_dist_min"] = min_dist
-            row["cultural_dist_missing"] = 0
-        else:
-            row["cultural_dist_min"] = FILL_VALUES_FINAL.get("cultural_dist_min", 1.67)
-            row["cultural_dist_missing"] = 1
+    columns: dict[str, object] = {}
 
-        # neighbor_entered_count: count of target's cultural neighbors in origin set
-        row["neighbor_entered_count"] = 0
-        if target in cultural_dist_df.index:
-            target_dists = cultural_dist_df.loc[target].dropna().sort_values()
-            # Top-5 closest countries (excluding self)
-            neighbors = [c for c in target_dists.index[:6] if c != target][:5]
-            row["neighbor_entered_count"] = len(set(neighbors) & origin_countries)
-
-        # Temporal
-        from datetime import date as _date
-        today = _date.today()
-        row["observation_month"] = today.month
-        row["observation_year"] = today.year
-
-        # Metadata for display (not features)
-        row["target_country"] = target
-
-        rows.append(row)
-
-    df = pd.DataFrame(rows)
-    return df
+    # Rank columns: set the rank for countries in footprint, 0 otherwise
+    for country in COUNTRY_LIST:
+        rank_col = country_to_rank_col(country)
+        if rank_col in PRUNED_ROW_FEATURE_COLS:
+            columns[rank_col] = origin_ranks.get(country, 0)
+
+    # Audio features (use provided or defaults from fill values)
+    audio_defaults = {
+        "af_danceability": FILL_VALUES_FINAL.get("af_danceability", 0.7),
+        "af_energy": FILL_VALUES_FINAL.get("af_energy", 0.64),
+        "af_valence": FILL_VALUES_FINAL.get("af_valence", 0.5),
+        "af_tempo": FILL_VALUES_FINAL.get("af_tempo", 120.0),
+        "af_acousticness": FILL_VALUES_FINAL.get("af_acousticness", 0.2),
+        "af_speechiness": FILL_VALUES_FINAL.get("af_speechiness", 0.08),
+        "af_instrumentalness": FILL_VALUES_FINAL.get("af_instrumentalness", 0.0),
+        "af_liveness": FILL_VALUES_FINAL.get("af_liveness", 0.12),
+        "af_key": FILL_VALUES_FINAL.get("af_key", 5.0),
+        "af_loudness": FILL_VALUES_FINAL.get("af_loudness", -6.8),
+        "af_mode": FILL_VALUES_FINAL.get("af_mode", 1.0),
+        "af_time_signature": FILL_VALUES_FINAL.get("af_time_signature", 4.0),
+        "duration_ms": FILL_VALUES_FINAL.get("duration_ms", 193846.0),
+    }
+    user_audio = song_input.get("audio_features", {})
+    for k, default in audio_defaults.items():
+        columns[k] = user_audio.get(k, default)
+
+    # Track metadata
+    columns["explicit"] = 1 if song_input.get("explicit", False) else 0
+    columns["days_since_release"] = max(days_since_release, 0)
+    columns["is_friday_release"] = is_friday_release
+    columns["track_in_viral50_at_obs"] = 1 if song_input.get("on_viral50", False) else 0
+
+    # Artist history
+    columns["artist_prior_chart_count"] = artist_info["artist_prior_chart_count"]
+    columns["artist_prior_unique_regions"] = artist_info["artist_prior_unique_regions"]
+    columns["artist_prior_best_rank"] = artist_info["artist_prior_best_rank"]
+    columns["artist_prior_unique_tracks"] = artist_info["artist_prior_unique_tracks"]
+    columns["multi_artist_flag"] = artist_info["multi_artist_flag"]
+    columns["artist_country_ratio"] = artist_info["artist_country_ratio"]
+
+    # Artist prior success in target: distinct tracks that charted there
+    columns["artist_prior_success_in_target"] = artist_info["success_in_target"]
+
+    # Target country priors
+    default_population = FILL_VALUES_FINAL.get("target_population", 10_000_000)
+    columns["target_population"] = [
+        country_metadata.get(target, {}).get("population", default_population) for target in COUNTRY_LIST
+    ]
+    # Trailing 30-day market stats as of the observation date (src.country_priors)
+    country_priors = reference_data.get("country_priors")
+    if country_priors is not None:
+        avg_daily_streams, new_entry_rate = country_priors.lookup(observation_date)
+        columns["target_avg_daily_streams"] = avg_daily_streams
+        columns["target_new_entry_rate_30d"] = new_entry_rate
+    else:
+        columns["target_avg_daily_streams"] = FILL_VALUES_FINAL.get("target_avg_daily_streams", 10738.0)
+        columns["target_new_entry_rate_30d"] = FILL_VALUES_FINAL.get("target_new_entry_rate_30d", 0.051)
+
+    # Continent one-hot
+    target_continents = np.array([COUNTRY_CONTINENT.get(t, "") for t in COUNTRY_LIST])
+    for col in CONTINENT_ONEHOT_COLS:
+        continent_name = col.replace("target_continent_", "").replace("_", " ").title()
+        columns[col] = (target_continents == continent_name).astype(int)
+
+    # Origin-target relationship features: bitwise AND / popcount against the footprint
+    song_lang = song_input.get("song_language", "en")
+    target_langs = np.array([COUNTRY_PRIMARY_LANG.get(t, "") for t in COUNTRY_LIST])
+    columns["same_language_flag"] = ((SAME_LANGUAGE_MASK_ARRAY & footprint_mask) != 0).astype(int)
+    columns["song_lang_matches_target"] = (target_langs == song_lang).astype(int)
+    columns["same_continent_flag"] = ((SAME_CONTINENT_MASK_ARRAY & footprint_mask) != 0).astype(int)
+
+    # Cultural distance: min over origin rows of the 62x62 matrix
+    if origin_codes.size:
+        min_dist = np.fmin.reduce(reference_data["cultural_dist_matrix"][origin_codes], axis=0)
+    else:
+        min_dist = np.full(n, np.nan)
+    dist_missing = np.isnan(min_dist)
+    columns["cultural_dist_min"] = np.where(
+        dist_missing, FILL_VALUES_FINAL.get("cultural_dist_min", 1.67), min_dist,
+    )
+    columns["cultural_dist_missing"] = dist_missing.astype(int)
+
+    # Diffusion corridors: best historical transition rate / lag from any origin (src.corridors)
+    corridors = reference_data.get("corridors")
+    if corridors is not None:
+        columns["corridor_rate_max"], columns["corridor_lag_min"] = corridors.lookup(observation_date, origin_codes)
+
+    # neighbor_entered_count: count of target's cultural neighbors in origin set
+    columns["neighbor_entered_count"] = np.bitwise_count(
+        reference_data["neighbor_masks"] & footprint_mask
+    ).astype(int)
+
+    # Temporal
+    columns["observation_month"] = observation_date.month
+    columns["observation_year"] = observation_date.year
+
+    # Metadata for display (not features)
+    columns["target_country"] = pd.Categorical(COUNTRY_LIST, dtype=COUNTRY_DTYPE)
+
+    return pd.DataFrame(columns, index=pd.RangeIndex(n))
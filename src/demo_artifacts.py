@@ -0,0 +1,97 @@
+"""Offline-built artifacts for Demo mode, with source-fingerprint invalidation.
+
+Run ``python -m src.demo_artifacts`` after producing test predictions to
+(re)build everything; the app also rebuilds a stale artifact on first load.
+"""
+
+from __future__ import annotations
+
+import argparse
+
+import pandas as pd
+
+from src.artifacts import read_fresh_parquet, source_fingerprint, write_fingerprinted_parquet
+from src.config import DEMO_TRACK_SUMMARY_PATH, TEST_PREDICTIONS_PATH, TOP_K, TRACK_DICTIONARY_PATH
+from src.track_dictionary import load_track_dictionary
+
+
+# ---------------------------------------------------------------------------
+# Demo track summary
+# ---------------------------------------------------------------------------
+
+def compute_demo_track_summary(df: pd.DataFrame, names: pd.DataFrame, top_k: int = TOP_K) -> pd.DataFrame:
+    """Per-track actual-country count, top-k hits and recall for tracks that
+    spread to 2+ countries, in one grouped pass over the predictions.
+    """
+    positives = df.loc[df["did_enter_within_60d"] == 1, ["track_id", "target_country"]]
+    actual_counts = positives.groupby("track_id", observed=True)["target_country"].nunique()
+    actual_counts = actual_counts[actual_counts >= 2]
+
+    # Top-k rows per track (stable sort == nsmallest(keep="first"))
+    ranked = df[df["track_id"].isin(actual_counts.index)].sort_values(
+        ["track_id", "predicted_rank"], kind="stable",
+    )
+    top = ranked[ranked.groupby("track_id", sort=False).cumcount() < top_k]
+    top_hits = (
+        top.loc[top["did_enter_within_60d"] == 1, ["track_id", "target_country"]]
+        .drop_duplicates()
+        .groupby("track_id")
+        .size()
+    )
+
+    track_summary = actual_counts.rename("actual_countries").reset_index()
+    track_summary["top5_hits"] = (
+        track_summary["track_id"].map(top_hits).fillna(0).astype(int)
+    )
+    track_summary["recall"] = track_summary["top5_hits"] / track_summary["actual_countries"]
+
+    # Join track names
+    track_summary = track_summary.merge(names, on="track_id", how="left")
+    track_summary["title"] = track_summary["title"].fillna("Unknown")
+    track_summary["artist"] = track_summary["artist"].fillna("Unknown")
+    track_summary["display_name"] = track_summary["title"] + " — " + track_summary["artist"]
+    return track_summary.sort_values("actual_countries", ascending=False).reset_index(drop=True)
+
+
+def demo_track_summary_fingerprint() -> str:
+    return source_fingerprint([TEST_PREDICTIONS_PATH, TRACK_DICTIONARY_PATH])
+
+
+def build_demo_track_summary() -> pd.DataFrame:
+    df = pd.read_parquet(
+        TEST_PREDICTIONS_PATH,
+        columns=["track_id", "target_country", "did_enter_within_60d", "predicted_rank"],
+    )
+    summary = compute_demo_track_summary(df, load_track_dictionary().names())
+    write_fingerprinted_parquet(summary, DEMO_TRACK_SUMMARY_PATH, demo_track_summary_fingerprint())
+    return summary
+
+
+def load_demo_track_summary() -> pd.DataFrame:
+    """Memory-map the summary artifact, rebuilding it if the predictions changed."""
+    summary = read_fresh_parquet(DEMO_TRACK_SUMMARY_PATH, demo_track_summary_fingerprint())
+    if summary is None:
+        summary = build_demo_track_summary()
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build Demo-mode artifacts from test predictions.")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if artifacts are fresh")
+    args = parser.parse_args()
+
+    load_track_dictionary()
+    fresh = read_fresh_parquet(DEMO_TRACK_SUMMARY_PATH, demo_track_summary_fingerprint())
+    if args.force or fresh is None:
+        summary = build_demo_track_summary()
+        print(f"Wrote {DEMO_TRACK_SUMMARY_PATH} ({len(summary)} tracks)")
+    else:
+        print(f"{DEMO_TRACK_SUMMARY_PATH} is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Disk-persistent cache for loader results, shared by every app process on a host.
+
+``@disk_cache(inputs)`` keys an entry by the function, its arguments, a
+fingerprint of the input files and a code version (a hash of the defining
+module's source plus an optional ``version=`` string), so replicas and
+restarts reuse each other's work, and any input change or deploy that edits
+the loader or classes defined next to it misses naturally. DataFrames are
+stored as uncompressed Arrow IPC (Feather v2) files, read through a memory
+map and converted to pandas (one copy, no parsing); other values are
+pickled. Entries are written atomically, a hit refreshes the
+entry's mtime, and the directory is trimmed least-recently-used first once it
+exceeds ``ARTIFACT_CACHE_MAX_BYTES``.
+
+Stack it under ``st.cache_data`` / ``st.cache_resource`` so the in-process
+cache still serves reruns and the disk cache serves cold processes.
+"""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import os
+import pickle
+import sys
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+import pyarrow as pa
+
+from src.artifacts import source_fingerprint
+from src.config import ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES
+
+_ARROW_SUFFIX = ".arrow"
+_PICKLE_SUFFIX = ".pkl"
+
+
+@functools.cache
+def _module_source_hash(module_name: str) -> str:
+    path = getattr(sys.modules.get(module_name), "__file__", None)
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest() if path else ""
+
+
+def _entry_key(func: Callable, args: tuple, kwargs: dict, fingerprint: str, version: str = "") -> str:
+    h = hashlib.sha256()
+    h.update(f"{func.__module__}.{func.__qualname__}\n".encode())
+    h.update(f"{_module_source_hash(func.__module__)}:{version}\n".encode())
+    h.update(repr((args, sorted(kwargs.items()))).encode())
+    h.update(fingerprint.encode())
+    return h.hexdigest()
+
+
+def _read_entry(path: Path):
+    if path.suffix == _ARROW_SUFFIX:
+        with pa.memory_map(str(path)) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    with path.open("rb") as f:
+        return pickle.load(f)
+
+
+def _write_entry(path: Path, value) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    if isinstance(value, pd.DataFrame):
+        table = pa.Table.from_pandas(value)
+        with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        with tmp_path.open("wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def evict(cache_dir: Path = ARTIFACT_CACHE_DIR, max_bytes: int = ARTIFACT_CACHE_MAX_BYTES) -> int:
+    """Delete least-recently-used entries until the cache fits. Returns bytes freed."""
+    entries = []
+    for path in cache_dir.glob("*"):
+        if path.suffix not in (_ARROW_SUFFIX, _PICKLE_SUFFIX):
+            continue
+        try:
+            st = path.stat()
+        except FileNotFoundError:  # evicted by another process
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    freed = 0
+    for _, size, path in sorted(entries):
+        if total - freed <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        freed += size
+    return freed
+
+
+def disk_cache(inputs: list[Path] | Callable[[], list[Path]], cache_dir: Path | None = None, version: str = ""):
+    """Cache a loader's result on disk, invalidated when any input file or the
+    loader's module source changes.
+
+    ``inputs`` is a list of source paths or a zero-argument callable returning
+    one (for globbed inputs). Arguments must have a stable ``repr``. Bump
+    ``version`` when the result depends on code in another module.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            directory = cache_dir or ARTIFACT_CACHE_DIR
+            paths = inputs() if callable(inputs) else inputs
+            key = _entry_key(func, args, kwargs, source_fingerprint(paths), version)
+            for suffix in (_ARROW_SUFFIX, _PICKLE_SUFFIX):
+                path = directory / f"{key}{suffix}"
+                try:
+                    value = _read_entry(path)
+                except (FileNotFoundError, pa.ArrowInvalid, pickle.UnpicklingError, EOFError):
+                    continue
+                os.utime(path)  # LRU recency
+                return value
+
+            value = func(*args, **kwargs)
+            directory.mkdir(parents=True, exist_ok=True)
+            suffix = _ARROW_SUFFIX if isinstance(value, pd.DataFrame) else _PICKLE_SUFFIX
+            _write_entry(directory / f"{key}{suffix}", value)
+            evict(directory)
+            return value
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,203 @@
+"""Per-prediction ranker explanations from exact TreeSHAP contributions.
+
+XGBoost's ``pred_contribs`` gives, for every row, each feature's additive
+contribution to the raw ranker score (plus a bias term); they sum to the
+score, so they explain the model's own ranking rather than a heuristic.
+Contributions are summed into the ``feature_category`` groups from
+``src.metrics`` for display.
+
+Production computes them in one batched call over the 62 prediction rows.
+For the test set they are precomputed by ``python -m src.explain`` into a
+float16 ``.npy`` (one row per test pair, one column per feature + bias) that
+the Demo memory-maps, with a fingerprinted index of (track_id,
+target_country) rows alongside.
+"""
+
+from __future__ import annotations
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from src.artifacts import read_fresh_parquet, source_fingerprint, write_fingerprinted_parquet
+from src.config import (
+    MODEL_DIR,
+    TEST_CONTRIBUTIONS_INDEX_PATH,
+    TEST_CONTRIBUTIONS_PATH,
+    TEST_PATH,
+)
+from src.data import TrackSlicer, intern_country_column
+from src.metrics import feature_category
+from src.sparse_features import model_feature_matrix
+
+RANKER_PATH = MODEL_DIR / "stage2_country_ranker.json"
+BIAS_COLUMN = "bias"
+BUILD_CHUNK_ROWS = 65_536
+
+CATEGORY_LABELS = {
+    "current_footprint": "current chart footprint",
+    "artist_history": "artist history",
+    "target_country_priors": "target market priors",
+    "origin_target_relationship": "origin–target proximity",
+    "aggregates": "footprint aggregates",
+    "audio_track_metadata": "audio & track metadata",
+    "temporal": "timing",
+    "other": "other features",
+    BIAS_COLUMN: "baseline",
+}
+
+
+def _booster(model):
+    return model.get_booster() if hasattr(model, "get_booster") else model
+
+
+def ranker_contributions(model, X) -> np.ndarray:
+    """(n_rows, n_features + 1) TreeSHAP contributions; the last column is the bias.
+
+    Uses the same trees as the sklearn wrapper's predict (up to the best
+    iteration when the model was early-stopped), so rows sum to its scores.
+    """
+    import xgboost as xgb
+
+    booster = _booster(model)
+    best = booster.attr("best_iteration")
+    iteration_range = (0, int(best) + 1) if best is not None else (0, 0)
+    return booster.predict(xgb.DMatrix(X), pred_contribs=True, iteration_range=iteration_range)
+
+
+def group_contributions(contributions: np.ndarray, feature_cols: list[str]) -> pd.DataFrame:
+    """Sum per-feature contributions into feature_category columns (+ bias)."""
+    categories = [feature_category(col) for col in feature_cols]
+    names = list(dict.fromkeys(categories))
+    membership = np.zeros((len(feature_cols), len(names)), dtype=np.float32)
+    membership[np.arange(len(feature_cols)), [names.index(c) for c in categories]] = 1.0
+    contributions = np.asarray(contributions, dtype=np.float32)
+    grouped = pd.DataFrame(contributions[:, :-1] @ membership, columns=names)
+    grouped[BIAS_COLUMN] = contributions[:, -1]
+    return grouped
+
+
+def explain_rows(
+    model, df: pd.DataFrame, feature_cols: list[str], fill_values: dict | pd.Series,
+    sparse: bool | None = None,
+) -> pd.DataFrame:
+    """Grouped contributions for prediction rows, indexed by target_country."""
+    contributions = ranker_contributions(model, model_feature_matrix(model, df, feature_cols, fill_values, sparse))
+    grouped = group_contributions(contributions, feature_cols)
+    grouped.index = df["target_country"].astype(str).to_numpy()
+    return grouped
+
+
+def describe_contributions(row: pd.Series, n: int = 2) -> str:
+    """'pushed up by X (+0.42), Y (+0.10); held back by Z (−0.08)' for one row."""
+    features = row.drop(BIAS_COLUMN, errors="ignore").sort_values(ascending=False)
+    up = [f"{CATEGORY_LABELS.get(k, k)} ({v:+.2f})" for k, v in features.head(n).items() if v > 0]
+    down = [f"{CATEGORY_LABELS.get(k, k)} ({v:+.2f})" for k, v in features.tail(n)[::-1].items() if v < 0]
+    parts = []
+    if up:
+        parts.append("pushed up by " + ", ".join(up))
+    if down:
+        parts.append("held back by " + ", ".join(down))
+    return "; ".join(parts) or "no single feature group stands out"
+
+
+def contribution_table(grouped: pd.DataFrame) -> pd.DataFrame:
+    """Display form: readable category names, led by the raw score they sum to."""
+    table = grouped.rename(columns=CATEGORY_LABELS)
+    table.insert(0, "raw score", grouped.sum(axis=1))
+    return table.round(3)
+
+
+# ---------------------------------------------------------------------------
+# Precomputed test-set contributions
+# ---------------------------------------------------------------------------
+
+class ContributionStore:
+    """Memory-mapped float16 contributions with a per-track row index."""
+
+    def __init__(self, index: pd.DataFrame, contributions: np.ndarray, feature_cols: list[str]):
+        self.index = TrackSlicer(index)
+        self.contributions = contributions
+        self.feature_cols = feature_cols
+
+    def get(self, track_id) -> pd.DataFrame:
+        """Grouped contributions for one track's rows, indexed by target_country."""
+        rows = self.index.get(track_id)
+        if rows.empty:
+            return pd.DataFrame()
+        start, stop = int(rows["row"].iloc[0]), int(rows["row"].iloc[-1]) + 1
+        grouped = group_contributions(self.contributions[start:stop], self.feature_cols)
+        grouped.index = rows["target_country"].astype(str).to_numpy()
+        return grouped
+
+
+def test_contributions_fingerprint() -> str:
+    return source_fingerprint([TEST_PATH, RANKER_PATH])
+
+
+def build_test_contributions() -> ContributionStore:
+    """Score the test split's contributions in chunks straight into a float16 .npy."""
+    import xgboost as xgb
+
+    from src.config import FILL_VALUES_FINAL, PRUNED_ROW_FEATURE_COLS
+    from src.data import load_row_level_split
+
+    booster = xgb.Booster(model_file=str(RANKER_PATH))
+    df = load_row_level_split(TEST_PATH)
+    df = df.sort_values(["track_id", "target_country"], kind="stable").reset_index(drop=True)
+
+    tmp_path = TEST_CONTRIBUTIONS_PATH.with_name(TEST_CONTRIBUTIONS_PATH.stem + ".tmp.npy")
+    out = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=np.float16, shape=(len(df), len(PRUNED_ROW_FEATURE_COLS) + 1),
+    )
+    for start in range(0, len(df), BUILD_CHUNK_ROWS):
+        chunk = df.iloc[start:start + BUILD_CHUNK_ROWS]
+        X = model_feature_matrix(booster, chunk, PRUNED_ROW_FEATURE_COLS, FILL_VALUES_FINAL)
+        out[start:start + len(chunk)] = ranker_contributions(booster, X)
+    out.flush()
+    del out
+    tmp_path.replace(TEST_CONTRIBUTIONS_PATH)
+
+    index = intern_country_column(df[["track_id", "target_country"]].copy())
+    index["row"] = np.arange(len(index), dtype=np.int64)
+    # Written last: a fresh index implies a complete contributions file.
+    write_fingerprinted_parquet(index, TEST_CONTRIBUTIONS_INDEX_PATH, test_contributions_fingerprint())
+    return ContributionStore(
+        index, np.load(TEST_CONTRIBUTIONS_PATH, mmap_mode="r"), list(PRUNED_ROW_FEATURE_COLS),
+    )
+
+
+def load_test_contributions() -> ContributionStore | None:
+    """Memory-map the precomputed contributions; None if missing or stale.
+
+    Never rebuilt on load (a full TreeSHAP pass over the test split is an
+    offline job). Without a local test split or ranker to check against,
+    existing contributions are used as shipped.
+    """
+    from src.config import PRUNED_ROW_FEATURE_COLS
+
+    fingerprint = test_contributions_fingerprint() if TEST_PATH.exists() and RANKER_PATH.exists() else None
+    index = read_fresh_parquet(TEST_CONTRIBUTIONS_INDEX_PATH, fingerprint)
+    if index is None or not TEST_CONTRIBUTIONS_PATH.exists():
+        return None
+    contributions = np.load(TEST_CONTRIBUTIONS_PATH, mmap_mode="r")
+    return ContributionStore(index, contributions, list(PRUNED_ROW_FEATURE_COLS))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Precompute ranker TreeSHAP contributions for the test split.")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the contributions are fresh")
+    args = parser.parse_args()
+
+    fresh = read_fresh_parquet(TEST_CONTRIBUTIONS_INDEX_PATH, test_contributions_fingerprint())
+    if args.force or fresh is None or not TEST_CONTRIBUTIONS_PATH.exists():
+        store = build_test_contributions()
+        size_mb = TEST_CONTRIBUTIONS_PATH.stat().st_size / 1e6
+        print(f"Wrote {TEST_CONTRIBUTIONS_PATH} ({store.contributions.shape[0]} rows, {size_mb:.1f} MB)")
+    else:
+        print(f"{TEST_CONTRIBUTIONS_PATH} is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""External-memory XGBoost training of the ranker and regressor over parquet.
+
+``load_row_level_split`` materializes a whole split in pandas, which is why
+the training set is the 5:1 negative downsample. Here the rows are streamed
+instead, so the stage 2/3 models can be fit on the natural-rate
+``full.parquet`` (or a ``partitioned/`` glob) in bounded memory:
+
+1. ``stage_source`` runs one DuckDB ``COPY`` that projects the needed
+   columns, applies the row filter and writes them to a staging parquet
+   file in row groups of ``batch_rows``. For the ranker the copy is also
+   ordered by (track_id, target_country) so each query group is contiguous;
+   ``full.parquet`` is not grouped by track, and DuckDB sorts out of core
+   (spilling to ``work_dir/tmp`` past ``memory_limit``).
+2. ``ParquetBatches`` (an ``xgboost.DataIter``) reads one row group per
+   batch, fills missing values with the fill values and hands XGBoost a
+   float32 block (CSR with zero ranks left out under ``--sparse``). Ranker batches end on a query-group boundary: the trailing,
+   possibly incomplete track is carried into the next batch, so a group is
+   never split between batches.
+3. ``xgb.ExtMemQuantileDMatrix`` sketches the batches and keeps the
+   quantized pages in ``work_dir/xgb_cache``; boosting reads them back page
+   by page. Only per-row labels, group ids and gradients stay in memory.
+
+Parameters and rounds default to the current training_summary.json (the
+Optuna best params and final_n_estimators), so the result is the production
+model refit on more rows. ``--where`` defaults to the train + val rows
+(DEFAULT_WHERE), so the test period stays held out. The model is saved under
+the app's file name in a separate ``--out`` directory (DEFAULT_OUT_DIR, not
+MODEL_DIR), with ``<model>.summary.json`` recording how it was trained;
+copying it over the production model is a deliberate step.
+
+    python -m src.external_memory train ranker
+    python -m src.external_memory train regressor --source 'datasets/v3_features/partitioned/**/*.parquet'
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from src.config import DATA_DIR, MODEL_DIR, RANDOM_STATE, TRAINING_CACHE_DIR
+from src.data import make_feature_matrix
+from src.models import transform_target
+from src.sparse_features import mark_sparse, sparse_feature_matrix
+from src.training import STAGES
+
+DEFAULT_BATCH_ROWS = 250_000
+DEFAULT_OUT_DIR = MODEL_DIR.parent / "xgboost_external_memory"
+# Train + val: the test split is tracks first charting from 2021 on.
+DEFAULT_WHERE = "observation_time < DATE '2021-01-01'"
+GROUP_KEYS = ["track_id", "target_country"]
+MODEL_FILES = {"ranker": "stage2_country_ranker.json", "regressor": "stage3_days_to_entry_regressor.json"}
+SUMMARY_KEYS = {"ranker": "stage2_ranker", "regressor": "stage3_regressor"}
+
+# Rows each stage trains on; the regressor only sees tracks that entered.
+STAGE_FILTERS = {
+    "ranker": "TRUE",
+    "regressor": "did_enter_within_60d = 1 AND days_to_entry IS NOT NULL",
+}
+
+
+def connect(work_dir: Path, threads: int | None = None, memory_limit: str | None = None):
+    """In-memory DuckDB whose sorts and scans spill to work_dir/tmp."""
+    import duckdb
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    con = duckdb.connect()
+    con.execute(f"SET threads = {threads or os.cpu_count()}")
+    if memory_limit:
+        con.execute(f"SET memory_limit = '{memory_limit}'")
+    con.execute(f"SET temp_directory = '{(work_dir / 'tmp').as_posix()}'")
+    return con
+
+
+def stage_source(
+    stage: str, source: str | Path, feature_cols: list[str], out_path: Path, where: str | None = None,
+    batch_rows: int = DEFAULT_BATCH_ROWS, threads: int | None = None, memory_limit: str | None = None,
+) -> int:
+    """Write the stage's projected, filtered rows of source (a parquet file or
+    glob) to out_path in row groups of batch_rows, ordered by GROUP_KEYS for
+    the ranker. Returns the row count.
+    """
+    label_cols = ["did_enter_within_60d"] if stage == "ranker" else ["days_to_entry"]
+    columns = [*GROUP_KEYS, *label_cols, *feature_cols]
+    condition = STAGE_FILTERS[stage] + (f" AND ({where})" if where else "")
+    order = f"ORDER BY {', '.join(GROUP_KEYS)}" if stage == "ranker" else ""
+
+    con = connect(out_path.parent, threads, memory_limit)
+    # Row order only matters when it is requested explicitly
+    con.execute(f"SET preserve_insertion_order = {'true' if order else 'false'}")
+    select = ", ".join(f'"{c}"' for c in columns)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    con.execute(f"""
+        COPY (
+            SELECT {select} FROM read_parquet('{Path(source).as_posix()}', union_by_name = true)
+            WHERE {condition} {order}
+        ) TO '{tmp_path.as_posix()}' (FORMAT PARQUET, COMPRESSION 'zstd', ROW_GROUP_SIZE {batch_rows})
+    """)
+    rows = con.execute(f"SELECT COUNT(*) FROM read_parquet('{tmp_path.as_posix()}')").fetchone()[0]
+    con.close()
+    os.replace(tmp_path, out_path)
+    return int(rows)
+
+
+class ParquetBatches(xgb.DataIter):
+    """DataIter over a staged parquet file, one row group per batch.
+
+    Features are filled with fill_values and cast to float32 per batch. For
+    the ranker each batch carries whole query groups (as ``qid``, increasing
+    across batches); the regressor label is transform_target(days_to_entry).
+    With ``sparse`` the batch is the CSR encoding of sparse_feature_matrix.
+    """
+
+    def __init__(self, path: Path, stage: str, feature_cols: list[str], fill_values: dict | pd.Series,
+                 cache_prefix: Path, target_transform: str = "log1p", sparse: bool = False):
+        import pyarrow.parquet as pq
+
+        self.file = pq.ParquetFile(path)
+        self.stage = stage
+        self.feature_cols = feature_cols
+        self.fill_values = fill_values
+        self.target_transform = target_transform
+        self.sparse = sparse
+        self.columns = [*GROUP_KEYS, "did_enter_within_60d" if stage == "ranker" else "days_to_entry", *feature_cols]
+        self._row_group = 0
+        self._carry: pd.DataFrame | None = None
+        self._next_qid = 0
+        super().__init__(cache_prefix=str(cache_prefix))
+
+    def reset(self) -> None:
+        self._row_group = 0
+        self._carry = None
+        self._next_qid = 0
+
+    def _read_batch(self) -> pd.DataFrame | None:
+        """Next row group; for the ranker, cut back to the last complete track."""
+        if self._row_group >= self.file.num_row_groups:
+            batch, self._carry = self._carry, None
+            return batch
+        batch = self.file.read_row_group(self._row_group, columns=self.columns).to_pandas()
+        self._row_group += 1
+        if self.stage != "ranker":
+            return batch
+        if self._carry is not None:
+            batch = pd.concat([self._carry, batch], ignore_index=True)
+        last_track = batch["track_id"].iat[-1]
+        cut = int(np.searchsorted((batch["track_id"] == last_track).to_numpy(), True))
+        if cut == 0 and self._row_group < self.file.num_row_groups:
+            # One track spans the whole batch; keep reading until it ends
+            self._carry = batch
+            return self._read_batch()
+        self._carry = batch.iloc[cut:].reset_index(drop=True) if cut else None
+        return batch.iloc[:cut] if cut else batch
+
+    def next(self, input_data) -> bool:
+        batch = self._read_batch()
+        if batch is None or batch.empty:
+            return False
+        if self.sparse:
+            X = sparse_feature_matrix(batch, self.feature_cols, self.fill_values)
+        else:
+            X = make_feature_matrix(batch, self.feature_cols, self.fill_values).to_numpy(dtype=np.float32, na_value=np.nan)
+        if self.stage == "ranker":
+            codes = pd.factorize(batch["track_id"])[0]
+            input_data(
+                data=X, label=batch["did_enter_within_60d"].to_numpy(dtype=np.float32),
+                qid=codes + self._next_qid, feature_names=self.feature_cols,
+            )
+            self._next_qid += int(codes.max()) + 1
+        else:
+            input_data(
+                data=X, label=transform_target(batch["days_to_entry"], self.target_transform),
+                feature_names=self.feature_cols,
+            )
+        return True
+
+
+def train_external(
+    stage: str,
+    source: str | Path,
+    work_dir: Path,
+    params: dict,
+    n_estimators: int,
+    feature_cols: list[str],
+    fill_values: dict | pd.Series,
+    where: str | None = None,
+    eval_where: str | None = None,
+    target_transform: str = "log1p",
+    batch_rows: int = DEFAULT_BATCH_ROWS,
+    threads: int | None = None,
+    memory_limit: str | None = None,
+    sparse: bool = False,
+) -> tuple[xgb.Booster, dict]:
+    """Stage source, build the external-memory matrices and boost n_estimators
+    rounds (early-stopped on the eval_where rows, if given, and cut back to
+    the best round). Returns the booster and a report of row counts and timings.
+    A ``sparse`` booster is marked so scoring feeds it the same encoding.
+    """
+    report: dict = {"stage": stage}
+    t0 = time.perf_counter()
+    staged = {"train": where}
+    if eval_where:
+        staged["eval"] = eval_where
+    paths = {}
+    for name, condition in staged.items():
+        paths[name] = work_dir / f"{stage}_{name}.parquet"
+        report[f"{name}_rows"] = stage_source(
+            stage, source, feature_cols, paths[name], condition, batch_rows, threads, memory_limit,
+        )
+    report["stage_s"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    cache_dir = work_dir / "xgb_cache"
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    cache_dir.mkdir(parents=True)
+    matrices = {}
+    for name, path in paths.items():
+        batches = ParquetBatches(path, stage, feature_cols, fill_values, cache_dir / name, target_transform, sparse)
+        matrices[name] = xgb.ExtMemQuantileDMatrix(
+            batches, nthread=threads or -1, ref=matrices.get("train"),
+        )
+        report[f"{name}_batches"] = batches.file.num_row_groups
+    report["dmatrix_s"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    settings = STAGES[stage]
+    booster_params = {
+        "objective": settings["objective"], "eval_metric": settings["eval_metric"], "tree_method": "hist",
+        "seed": RANDOM_STATE, "nthread": threads or -1, **params,
+    }
+    evals_result: dict = {}
+    booster = xgb.train(
+        booster_params, matrices["train"], num_boost_round=n_estimators,
+        evals=[(matrices["eval"], "eval")] if "eval" in matrices else (),
+        early_stopping_rounds=settings["early_stopping_rounds"] if "eval" in matrices else None,
+        evals_result=evals_result, verbose_eval=False,
+    )
+    report["train_s"] = time.perf_counter() - t0
+    if evals_result:
+        history = evals_result["eval"][settings["eval_metric"]]
+        report[f"eval_{settings['eval_metric']}"] = float(history[booster.best_iteration])
+        booster = booster[: booster.best_iteration + 1]
+    report["rounds"] = booster.num_boosted_rounds()
+    if sparse:
+        mark_sparse(booster)
+    return booster, report
+
+
+def main() -> None:
+    from src.config import load_training_summary
+
+    parser = argparse.ArgumentParser(description="External-memory training of the ranker / regressor over parquet.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="Stream a parquet source into an external-memory fit and save the model")
+    train.add_argument("stage", choices=sorted(MODEL_FILES))
+    train.add_argument("--source", default=str(DATA_DIR / "full.parquet"), help="Parquet file or glob")
+    train.add_argument("--where", default=DEFAULT_WHERE,
+                       help=f"SQL filter on the source rows (default: train + val, {DEFAULT_WHERE!r}; 'TRUE' for all)")
+    train.add_argument("--eval-where", help="SQL filter for early-stopping rows (same source)")
+    train.add_argument("--n-estimators", type=int, help="Boosting rounds (default: the summary's final_n_estimators)")
+    train.add_argument("--fill", choices=["final", "train"], default="final",
+                       help="Summary fill-value set to impute with")
+    train.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS)
+    train.add_argument("--threads", type=int)
+    train.add_argument("--memory-limit", help="DuckDB memory limit for staging, e.g. 4GB")
+    train.add_argument("--sparse", action="store_true",
+                       help="Stream CSR batches (a rank of 0 is missing); the model is scored the same way")
+    train.add_argument("--work-dir", type=Path, default=TRAINING_CACHE_DIR / "external_memory")
+    train.add_argument("--out", type=Path, default=DEFAULT_OUT_DIR,
+                       help="Output directory (kept apart from the production MODEL_DIR by default)")
+    args = parser.parse_args()
+
+    summary = load_training_summary()
+    stage_summary = summary[SUMMARY_KEYS[args.stage]]
+    params = stage_summary["best_params"]
+    n_estimators = args.n_estimators or stage_summary["final_n_estimators"]
+    target_transform = stage_summary.get("target_transform", "log1p")
+    booster, report = train_external(
+        args.stage, args.source, args.work_dir / args.stage, params, n_estimators,
+        summary["pruned_row_feature_cols"], summary[f"fill_values_{args.fill}"],
+        args.where, args.eval_where, target_transform,
+        args.batch_rows, args.threads, args.memory_limit, args.sparse,
+    )
+    args.out.mkdir(parents=True, exist_ok=True)
+    model_path = args.out / MODEL_FILES[args.stage]
+    booster.save_model(model_path)
+    run_summary = {
+        "stage": args.stage,
+        "model_file": model_path.name,
+        "source": str(args.source),
+        "where": args.where,
+        "eval_where": args.eval_where,
+        "best_params": params,
+        "n_estimators": n_estimators,
+        "fill_values": args.fill,
+        "target_transform": target_transform if args.stage == "regressor" else None,
+        "feature_encoding": "sparse" if args.sparse else "dense",
+        "pruned_row_feature_cols": summary["pruned_row_feature_cols"],
+        "report": report,
+    }
+    with open(model_path.with_suffix(".summary.json"), "w", encoding="utf-8") as f:
+        json.dump(run_summary, f, indent=2)
+    for key, value in report.items():
+        print(f"  {key:28s} {value:>12,.3f}" if isinstance(value, float) else f"  {key:28s} {value!s:>12}")
+    print(f"Wrote {model_path} and {model_path.with_suffix('.summary.json').name}")
+
+
+if __name__ == "__main__":
+    main()
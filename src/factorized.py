@@ -0,0 +1,249 @@
+"""Factorized v3 splits: track, country and pair tables instead of one wide table.
+
+A v3 split has one row per (track, target_country), and every track-level
+column (61 ``rank_*``, audio features, metadata, artist history) is
+repeated on each of a track's 62 rows. The factorized form of
+``<split>.parquet`` is a directory ``<split>_factorized/`` with:
+
+- ``tracks.parquet``: one row per (track_id, observation_time), in that
+  order, holding the track-level columns
+- ``countries.parquet``: one row per target country (code = position in
+  COUNTRY_LIST) with the country-level columns
+- ``pairs.parquet``: the split's rows in their original order, holding
+  ``track_row`` / ``country_code`` keys and only the pair-level columns
+- ``columns.json``: the split's column order
+
+The writer checks that every track and country column really is constant
+per key. ``FactorizedSplit`` reassembles the split (``frame``) or builds
+float32 feature matrices directly with index gathers (``feature_matrix``,
+``batches``), so the repeated values never exist on disk or in memory
+outside the batch being built. Feature engineering writes the directories
+next to each split; ``python -m src.factorized`` builds them for splits
+exported earlier.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.config import COUNTRY_LIST, DATA_DIR, N_COUNTRIES
+
+KEY_COLUMNS = ["track_id", "observation_time", "target_country"]
+LABEL_COLUMNS = ["did_enter_within_60d", "days_to_entry"]
+# Columns that vary by target country within a track; the rest of the
+# non-key columns are track-level unless they are country-level.
+PAIR_COLUMNS = [
+    "artist_prior_success_in_target",
+    "target_avg_daily_streams",
+    "target_new_entry_rate_30d",
+    "cultural_dist_min",
+    "cultural_dist_missing",
+    "same_language_flag",
+    "song_lang_matches_target",
+    "same_continent_flag",
+    "neighbor_entered_count",
+    *LABEL_COLUMNS,
+]
+COUNTRY_COLUMN_PREFIX = "target_continent_"
+
+
+def factorized_path(split_path: Path) -> Path:
+    return split_path.with_name(f"{split_path.stem}_factorized")
+
+
+def classify_columns(columns: list[str]) -> dict[str, list[str]]:
+    """Split non-key columns into track-, country- and pair-level lists."""
+    levels = {"track": [], "country": [], "pair": []}
+    for col in columns:
+        if col in KEY_COLUMNS:
+            continue
+        if col in PAIR_COLUMNS:
+            levels["pair"].append(col)
+        elif col == "target_population" or col.startswith(COUNTRY_COLUMN_PREFIX):
+            levels["country"].append(col)
+        else:
+            levels["track"].append(col)
+    return levels
+
+
+def build_factorized(split_path: Path, out_dir: Path | None = None) -> Path:
+    """Write the factorized form of a split parquet file."""
+    import duckdb
+
+    out_dir = out_dir or factorized_path(split_path)
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    con = duckdb.connect()
+    try:
+        con.execute(f"CREATE VIEW split AS SELECT * FROM read_parquet('{split_path.as_posix()}', file_row_number = true)")
+        columns = [c for c in con.execute("DESCRIBE split").fetchdf()["column_name"] if c != "file_row_number"]
+        levels = classify_columns(columns)
+        country_list = "[" + ", ".join(f"'{c}'" for c in COUNTRY_LIST) + "]"
+
+        checks = {
+            "track": (["track_id", "observation_time"], levels["track"]),
+            "country": (["target_country"], levels["country"]),
+        }
+        for level, (key, cols) in checks.items():
+            keys, distinct = con.execute(f"""
+                SELECT COUNT(DISTINCT ({", ".join(key)})), COUNT(*)
+                FROM (SELECT DISTINCT {", ".join(key + cols)} FROM split)
+            """).fetchone()
+            if keys != distinct:
+                raise ValueError(f"{split_path.name}: {level}-level columns vary within a {level} "
+                                 f"({distinct:,} distinct rows for {keys:,} keys)")
+
+        track_cols = ", ".join(["track_id", "observation_time", *levels["track"]])
+        con.execute(f"""
+            CREATE TABLE tracks AS
+            SELECT DISTINCT ON (track_id, observation_time) {track_cols}
+            FROM split
+            ORDER BY track_id, observation_time
+        """)
+        con.execute(f"""
+            COPY (SELECT * FROM tracks) TO '{(tmp_dir / "tracks.parquet").as_posix()}'
+            (FORMAT PARQUET, COMPRESSION 'zstd')
+        """)
+        country_cols = ", ".join(["target_country", *levels["country"]])
+        con.execute(f"""
+            COPY (
+                SELECT (list_position({country_list}, target_country) - 1)::UTINYINT AS country_code, *
+                FROM (SELECT DISTINCT ON (target_country) {country_cols} FROM split)
+                ORDER BY country_code
+            ) TO '{(tmp_dir / "countries.parquet").as_posix()}' (FORMAT PARQUET, COMPRESSION 'zstd')
+        """)
+        pair_cols = ", ".join(f"s.{col}" for col in levels["pair"])
+        con.execute(f"""
+            COPY (
+                SELECT
+                    t.track_row::INTEGER AS track_row,
+                    (list_position({country_list}, s.target_country) - 1)::UTINYINT AS country_code,
+                    {pair_cols}
+                FROM split s
+                JOIN (SELECT track_id, observation_time, row_number() OVER (ORDER BY track_id, observation_time) - 1 AS track_row
+                      FROM tracks) t USING (track_id, observation_time)
+                ORDER BY s.file_row_number
+            ) TO '{(tmp_dir / "pairs.parquet").as_posix()}' (FORMAT PARQUET, COMPRESSION 'zstd')
+        """)
+    finally:
+        con.close()
+    with open(tmp_dir / "columns.json", "w") as f:
+        json.dump({"columns": columns, **levels}, f, indent=2)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    tmp_dir.replace(out_dir)
+    return out_dir
+
+
+class FactorizedSplit:
+    def __init__(self, tracks: pd.DataFrame, countries: pd.DataFrame, pairs: pd.DataFrame, columns: dict):
+        self.tracks = tracks
+        # Indexed by country code, with empty rows for countries not in the split
+        self.countries = countries.set_index("country_code").reindex(range(N_COUNTRIES)).reset_index(drop=True)
+        self.pairs = pairs
+        self.columns = columns["columns"]
+        self.levels = {level: columns[level] for level in ("track", "country", "pair")}
+        self.track_row = pairs["track_row"].to_numpy()
+        self.country_code = pairs["country_code"].to_numpy()
+
+    @classmethod
+    def load(cls, path: Path) -> FactorizedSplit:
+        """Read a factorized directory (or the one next to a split parquet path)."""
+        if path.suffix == ".parquet":
+            path = factorized_path(path)
+        with open(path / "columns.json") as f:
+            columns = json.load(f)
+        return cls(
+            pd.read_parquet(path / "tracks.parquet"),
+            pd.read_parquet(path / "countries.parquet"),
+            pd.read_parquet(path / "pairs.parquet"),
+            columns,
+        )
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def memory_bytes(self) -> int:
+        return sum(int(df.memory_usage(index=False, deep=True).sum()) for df in (self.tracks, self.countries, self.pairs))
+
+    def _gather(self, col: str, rows: np.ndarray | None) -> pd.Series:
+        """One split column for the selected pair rows."""
+        if col in self.levels["pair"]:
+            source, index = self.pairs[col], rows
+        elif col in self.levels["country"]:
+            source, index = self.countries[col], self.country_code if rows is None else self.country_code[rows]
+        elif col == "target_country":
+            codes = self.country_code if rows is None else self.country_code[rows]
+            return pd.Series(pd.Categorical.from_codes(codes, categories=COUNTRY_LIST))
+        else:
+            source, index = self.tracks[col], self.track_row if rows is None else self.track_row[rows]
+        if index is None:
+            return source.reset_index(drop=True)
+        return source.take(index).reset_index(drop=True)
+
+    def frame(self, rows: np.ndarray | None = None) -> pd.DataFrame:
+        """The split's rows (all, or positions ``rows``) in the original layout,
+        with target_country as a COUNTRY_LIST categorical (see intern_country_column).
+        """
+        return pd.DataFrame({col: self._gather(col, rows) for col in self.columns})
+
+    def feature_matrix(
+        self, feature_cols: list[str], fill_values: dict | pd.Series | None = None, rows: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """float32 (rows, features) matrix, NaN filled from ``fill_values``
+        (as make_feature_matrix does), gathered column by column.
+        """
+        n = len(self) if rows is None else len(rows)
+        X = np.empty((n, len(feature_cols)), dtype=np.float32)
+        for j, col in enumerate(feature_cols):
+            values = self._gather(col, rows)
+            if fill_values is not None and col in fill_values:
+                values = values.fillna(fill_values[col])
+            X[:, j] = values.to_numpy(dtype=np.float32, na_value=np.nan)
+        return X
+
+    def ranker_order(self) -> np.ndarray:
+        """Pair rows sorted by (track_id, target_country), as prepare_ranker_inputs sorts them."""
+        return np.lexsort((self.country_code, self.track_row))
+
+    def batches(
+        self, feature_cols: list[str], fill_values: dict | pd.Series | None = None, batch_rows: int = 1_000_000,
+    ):
+        """Yield (X, y, group) for consecutive whole tracks in ranker order,
+        about ``batch_rows`` rows at a time.
+        """
+        order = self.ranker_order()
+        track_row = self.track_row[order]
+        starts = np.flatnonzero(np.r_[True, track_row[1:] != track_row[:-1]])
+        bounds = np.r_[starts, len(order)]
+        label = self.pairs["did_enter_within_60d"].to_numpy(dtype=float)
+        first = 0
+        while first < len(starts):
+            last = max(np.searchsorted(bounds, bounds[first] + batch_rows, side="right") - 1, first + 1)
+            rows = order[bounds[first]:bounds[last]]
+            yield self.feature_matrix(feature_cols, fill_values, rows), label[rows], np.diff(bounds[first:last + 1])
+            first = last
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write factorized track/country/pair tables for v3 splits.")
+    parser.add_argument("splits", nargs="*", default=["train", "val", "test"])
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    args = parser.parse_args()
+    for split in args.splits:
+        split_path = args.data_dir / f"{split}.parquet"
+        out_dir = build_factorized(split_path)
+        size = sum(p.stat().st_size for p in out_dir.iterdir())
+        print(f"{split}: {split_path.stat().st_size / 1e6:8.1f} MB -> {size / 1e6:8.1f} MB ({out_dir})")
+
+
+if __name__ == "__main__":
+    main()
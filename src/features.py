@@ -0,0 +1,766 @@
+"""Headless v2 → v3 feature build: notebook 04 as a sequence of DuckDB stages.
+
+Every stage is one set-based ``CREATE TABLE ... AS`` over the previous ones:
+first appearances and observation points, the day-0 chart footprint, artist
+history, the (track, target_country) expansion, target-market statistics,
+origin–target relationships, song-language matches, labels, final assembly
+and the temporal split. The stage SQL is the notebook's, except that artist
+history and target-market priors are read from the point-in-time tables of
+``src.artist_history`` and ``src.country_priors`` (shared with serving)
+rather than recomputed per observation; the values are the same, so
+``python -m src.features build`` reproduces ``datasets/v3_features`` row for
+row (train negatives aside: the notebook's Bernoulli sample is not
+reproducible, so they are re-drawn with a seeded hash);
+``python -m src.features verify`` checks a build against a reference.
+
+Stages run multi-threaded in a disk-backed database whose temp directory
+lets joins and aggregates spill instead of exhausting memory. Splits are
+written Hive-partitioned by split and observation month
+(``partitioned/split=test/obs_month=2021-03/``) next to the flat
+``{split}.parquet`` / ``{split}_footprints.parquet`` files the app and
+notebooks read, the factorized ``{split}_factorized/`` track/country/pair
+tables (``src.factorized``), plus ``full.parquet`` and ``manifest.json``.
+
+Song languages come from the notebook's LLM cache
+(``song_language_cache.json``); tracks missing from it count as no match.
+Run the notebook's detection cell to extend the cache for new tracks.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.artist_history import ArtistHistoryIndex, history_queries
+from src.country_priors import COUNTRY_DAY_STATS_SQL, CountryPriors
+from src.config import (
+    AUX_DATA_DIR,
+    COUNTRY_LIST,
+    COUNTRY_PRIMARY_LANG,
+    DATA_DIR,
+    SONG_LANGUAGE_CACHE_PATH,
+    V2_DATA_DIR,
+    V3_PARTITIONED_DIR,
+    country_to_rank_col,
+)
+from src.factorized import build_factorized
+from src.footprints import footprint_query
+
+SPLITS = ["train", "val", "test"]
+HORIZON_DAYS = 60
+TRAIN_NEGATIVES_PER_POSITIVE = 5
+SAMPLE_SEED = 42
+PARTITION_COLUMN = "obs_month"
+
+AUDIO_COLS = [
+    "af_danceability", "af_energy", "af_valence", "af_tempo",
+    "af_acousticness", "af_speechiness", "af_instrumentalness", "af_liveness",
+    "af_key", "af_loudness", "af_mode", "af_time_signature",
+]
+
+# Notebook 04 matched Belgian targets against French.
+SONG_LANG_TARGET = {**COUNTRY_PRIMARY_LANG, "Belgium": "fr"}
+
+
+def _snake(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def continent_flag(continent: str) -> str:
+    """Column name of a target-continent indicator."""
+    return f"target_continent_{_snake(continent)}"
+
+
+def _rank_cols() -> list[str]:
+    return [country_to_rank_col(c) for c in COUNTRY_LIST]
+
+
+# ---------------------------------------------------------------------------
+# Stages (each: name -> SQL for one CREATE TABLE, given build parameters)
+# ---------------------------------------------------------------------------
+
+def _tracks(p: dict) -> str:
+    firsts = ",\n            ".join(
+        f"FIRST({col} ORDER BY date, region) AS {col}"
+        for col in ["title", "artist", "release_date", "duration_ms", "explicit", *AUDIO_COLS]
+    )
+    return f"""
+        SELECT
+            *,
+            CASE WHEN isodow(release_date) = 5 THEN 1 ELSE 0 END AS is_friday_release
+        FROM (
+            SELECT
+                track_id,
+                MIN(date) AS first_chart_date,
+                {firsts}
+            FROM v2
+            WHERE chart = 'top200'
+            GROUP BY track_id
+        )
+    """
+
+
+def _observation_points(p: dict) -> str:
+    return "SELECT track_id, first_chart_date AS observation_time FROM tracks"
+
+
+def _obs_with_ranks(p: dict) -> str:
+    pivot = ",\n            ".join(
+        f"COALESCE(MAX(CASE WHEN region = '{c}' THEN rank END), 0) AS {country_to_rank_col(c)}"
+        for c in COUNTRY_LIST
+    )
+    return f"""
+        WITH top200_ranks AS (
+            SELECT
+                op.track_id,
+                op.observation_time,
+                {pivot}
+            FROM observation_points op
+            LEFT JOIN v2
+                ON v2.track_id = op.track_id
+                AND v2.date = op.observation_time
+                AND v2.chart = 'top200'
+            GROUP BY op.track_id, op.observation_time
+        ),
+        viral_flag AS (
+            SELECT op.track_id, op.observation_time, MAX(1) AS track_in_viral50_at_obs
+            FROM observation_points op
+            JOIN v2
+                ON v2.track_id = op.track_id
+                AND v2.date = op.observation_time
+                AND v2.chart = 'viral50'
+            GROUP BY op.track_id, op.observation_time
+        )
+        SELECT t.*, COALESCE(v.track_in_viral50_at_obs, 0) AS track_in_viral50_at_obs
+        FROM top200_ranks t
+        LEFT JOIN viral_flag v
+            ON v.track_id = t.track_id AND v.observation_time = t.observation_time
+    """
+
+
+def _origin_set(p: dict) -> str:
+    """(track, observation_time, origin_country) for every charting rank column."""
+    names = ", ".join(f"('{country_to_rank_col(c)}', '{c}')" for c in COUNTRY_LIST)
+    return f"""
+        WITH long AS (
+            UNPIVOT obs_with_ranks ON {", ".join(_rank_cols())} INTO NAME rank_col VALUE origin_rank
+        )
+        SELECT long.track_id, long.observation_time, names.country AS origin_country
+        FROM long
+        JOIN (VALUES {names}) AS names(rank_col, country) USING (rank_col)
+        WHERE long.origin_rank > 0
+    """
+
+
+def _track_artist_flag(p: dict) -> str:
+    return """
+        SELECT
+            track_id,
+            artist,
+            CASE WHEN artist LIKE '%feat.%'
+                 OR artist LIKE '%Feat.%'
+                 OR artist LIKE '%, %'
+                 OR artist LIKE '% & %'
+                 OR artist LIKE '% x %'
+                 OR artist LIKE '% X %'
+            THEN 1 ELSE 0 END AS multi_artist_flag
+        FROM tracks
+    """
+
+
+def _artist_features(p: dict) -> str:
+    """From the point-in-time index (see prepare_stage): rows for artists with history."""
+    return f"""
+        SELECT
+            track_id,
+            observation_time,
+            artist_prior_chart_count::BIGINT AS artist_prior_chart_count,
+            artist_prior_unique_regions::BIGINT AS artist_prior_unique_regions,
+            artist_prior_best_rank::{p["rank_type"]} AS artist_prior_best_rank,
+            artist_prior_unique_tracks::BIGINT AS artist_prior_unique_tracks,
+            artist_country_ratio::DOUBLE AS artist_country_ratio
+        FROM artist_as_of
+        WHERE artist_prior_unique_tracks > 0
+    """
+
+
+def _pairs(p: dict) -> str:
+    """Every (track, target) pair except targets the track already charts in."""
+    return """
+        SELECT owr.*, cl.country AS target_country
+        FROM obs_with_ranks owr
+        CROSS JOIN country_list cl
+        ANTI JOIN origin_set os
+            ON os.track_id = owr.track_id
+            AND os.observation_time = owr.observation_time
+            AND os.origin_country = cl.country
+    """
+
+
+def _artist_target_success(p: dict) -> str:
+    return """
+        SELECT
+            track_id,
+            observation_time,
+            target_country,
+            artist_prior_success_in_target::BIGINT AS artist_prior_success_in_target
+        FROM artist_target_as_of
+    """
+
+
+def _target_country_stats(p: dict) -> str:
+    """Trailing 30-day market priors from the (date, country) tables (see prepare_stage)."""
+    continent_cases = ",\n            ".join(
+        f"CASE WHEN cr.continent = '{cont}' THEN 1 ELSE 0 END AS {continent_flag(cont)}"
+        for cont in p["continents"]
+    )
+    return f"""
+        SELECT
+            op.track_id,
+            op.observation_time,
+            cp.target_country,
+            COALESCE(cr.population, 0) AS target_population,
+            cp.target_avg_daily_streams,
+            cp.target_new_entry_rate_30d,
+            {continent_cases}
+        FROM observation_points op
+        JOIN country_priors cp ON cp.observation_time = op.observation_time
+        LEFT JOIN countries_ref cr ON cr.country = cp.target_country
+    """
+
+
+def _cultural_dist_features(p: dict) -> str:
+    return """
+        SELECT
+            p.track_id,
+            p.observation_time,
+            p.target_country,
+            MIN(cd.cultural_distance) AS cultural_dist_min,
+            CASE WHEN MIN(cd.cultural_distance) IS NULL THEN 1 ELSE 0 END AS cultural_dist_missing
+        FROM pairs p
+        JOIN origin_set os
+            ON os.track_id = p.track_id AND os.observation_time = p.observation_time
+        LEFT JOIN cultural_distance cd
+            ON cd.source_country = os.origin_country AND cd.target_country = p.target_country
+        GROUP BY p.track_id, p.observation_time, p.target_country
+    """
+
+
+def _language_features(p: dict) -> str:
+    return """
+        SELECT
+            p.track_id,
+            p.observation_time,
+            p.target_country,
+            MAX(CASE
+                WHEN cr_origin.official_language IS NOT NULL
+                 AND cr_target.official_language IS NOT NULL
+                 AND (
+                    SPLIT_PART(cr_origin.official_language, ',', 1) = SPLIT_PART(cr_target.official_language, ',', 1)
+                    OR cr_origin.official_language LIKE '%' || SPLIT_PART(cr_target.official_language, ',', 1) || '%'
+                    OR cr_target.official_language LIKE '%' || SPLIT_PART(cr_origin.official_language, ',', 1) || '%'
+                 )
+                THEN 1 ELSE 0
+            END) AS same_language_flag,
+            MAX(CASE WHEN cr_origin.continent = cr_target.continent THEN 1 ELSE 0 END) AS same_continent_flag
+        FROM pairs p
+        JOIN origin_set os
+            ON os.track_id = p.track_id AND os.observation_time = p.observation_time
+        LEFT JOIN countries_ref cr_origin ON cr_origin.country = os.origin_country
+        LEFT JOIN countries_ref cr_target ON cr_target.country = p.target_country
+        GROUP BY p.track_id, p.observation_time, p.target_country
+    """
+
+
+def _neighbor_features(p: dict) -> str:
+    return """
+        SELECT
+            p.track_id,
+            p.observation_time,
+            p.target_country,
+            COALESCE(SUM(CASE WHEN os.origin_country IS NOT NULL THEN 1 ELSE 0 END), 0)
+                AS neighbor_entered_count
+        FROM pairs p
+        LEFT JOIN cultural_top5 ct5 ON ct5.source_country = p.target_country
+        LEFT JOIN origin_set os
+            ON os.track_id = p.track_id
+            AND os.observation_time = p.observation_time
+            AND os.origin_country = ct5.target_country
+        GROUP BY p.track_id, p.observation_time, p.target_country
+    """
+
+
+def _song_lang_match_features(p: dict) -> str:
+    return """
+        SELECT
+            p.track_id,
+            p.observation_time,
+            p.target_country,
+            CASE
+                WHEN sld.detected_lang IS NOT NULL
+                 AND cpl.primary_lang IS NOT NULL
+                 AND sld.detected_lang = cpl.primary_lang
+                THEN 1 ELSE 0
+            END AS song_lang_matches_target
+        FROM pairs p
+        LEFT JOIN song_lang_detected sld ON sld.track_id = p.track_id
+        LEFT JOIN country_primary_lang cpl ON cpl.country = p.target_country
+    """
+
+
+def _track_country_first_chart(p: dict) -> str:
+    return """
+        SELECT track_id, region AS country, MIN(date) AS first_chart_date
+        FROM v2
+        WHERE chart = 'top200'
+        GROUP BY track_id, region
+    """
+
+
+def _labels(p: dict) -> str:
+    entered = f"""tcfc.first_chart_date IS NOT NULL
+                 AND tcfc.first_chart_date > p.observation_time
+                 AND tcfc.first_chart_date <= p.observation_time + INTERVAL '{HORIZON_DAYS} days'"""
+    return f"""
+        SELECT
+            p.track_id,
+            p.observation_time,
+            p.target_country,
+            CASE WHEN {entered} THEN 1 ELSE 0 END AS did_enter_within_60d,
+            CASE WHEN {entered} THEN (tcfc.first_chart_date - p.observation_time)::INTEGER
+                 ELSE NULL
+            END AS days_to_entry
+        FROM pairs p
+        LEFT JOIN track_country_first_chart tcfc
+            ON tcfc.track_id = p.track_id AND tcfc.country = p.target_country
+    """
+
+
+def _features_final(p: dict) -> str:
+    ranks = ", ".join(f"p.{col}" for col in _rank_cols())
+    audio = ", ".join(f"t.{col}" for col in AUDIO_COLS)
+    continents = ", ".join(f"tcs.{continent_flag(cont)}" for cont in p["continents"])
+    pair_key = "{a}.track_id = p.track_id AND {a}.observation_time = p.observation_time AND {a}.target_country = p.target_country"
+    return f"""
+        SELECT
+            p.track_id,
+            p.observation_time,
+            p.target_country,
+            {ranks},
+            {audio},
+            t.duration_ms,
+            COALESCE(t.explicit, 0) AS explicit,
+            CASE WHEN t.release_date IS NOT NULL
+                 THEN (p.observation_time - t.release_date)::INTEGER
+                 ELSE NULL
+            END AS days_since_release,
+            COALESCE(t.is_friday_release, 0) AS is_friday_release,
+            p.track_in_viral50_at_obs,
+            COALESCE(af.artist_prior_chart_count, 0)    AS artist_prior_chart_count,
+            COALESCE(af.artist_prior_unique_regions, 0)  AS artist_prior_unique_regions,
+            COALESCE(af.artist_prior_best_rank, 201)     AS artist_prior_best_rank,
+            COALESCE(af.artist_prior_unique_tracks, 0)   AS artist_prior_unique_tracks,
+            COALESCE(taf.multi_artist_flag, 0)           AS multi_artist_flag,
+            COALESCE(af.artist_country_ratio, 0.0)       AS artist_country_ratio,
+            COALESCE(ats.artist_prior_success_in_target, 0) AS artist_prior_success_in_target,
+            COALESCE(tcs.target_population, 0)            AS target_population,
+            COALESCE(tcs.target_avg_daily_streams, 0)     AS target_avg_daily_streams,
+            COALESCE(tcs.target_new_entry_rate_30d, 0)    AS target_new_entry_rate_30d,
+            {continents},
+            COALESCE(cdf.cultural_dist_min, {p["median_dist"]})  AS cultural_dist_min,
+            COALESCE(cdf.cultural_dist_missing, 1)          AS cultural_dist_missing,
+            COALESCE(lf.same_language_flag, 0)              AS same_language_flag,
+            COALESCE(slm.song_lang_matches_target, 0)       AS song_lang_matches_target,
+            COALESCE(lf.same_continent_flag, 0)             AS same_continent_flag,
+            COALESCE(nf.neighbor_entered_count, 0)          AS neighbor_entered_count,
+            EXTRACT(MONTH FROM p.observation_time)::INTEGER AS observation_month,
+            EXTRACT(YEAR FROM p.observation_time)::INTEGER  AS observation_year,
+            lb.did_enter_within_60d,
+            lb.days_to_entry
+        FROM pairs p
+        JOIN tracks t ON t.track_id = p.track_id
+        LEFT JOIN artist_features af
+            ON af.track_id = p.track_id AND af.observation_time = p.observation_time
+        LEFT JOIN track_artist_flag taf ON taf.track_id = p.track_id
+        LEFT JOIN artist_target_success ats ON {pair_key.format(a="ats")}
+        LEFT JOIN target_country_stats tcs ON {pair_key.format(a="tcs")}
+        LEFT JOIN cultural_dist_features cdf ON {pair_key.format(a="cdf")}
+        LEFT JOIN language_features lf ON {pair_key.format(a="lf")}
+        LEFT JOIN neighbor_features nf ON {pair_key.format(a="nf")}
+        LEFT JOIN song_lang_match_features slm ON {pair_key.format(a="slm")}
+        LEFT JOIN labels lb ON {pair_key.format(a="lb")}
+    """
+
+
+def _features_with_split(p: dict) -> str:
+    return """
+        SELECT
+            ff.*,
+            t.first_chart_date,
+            CASE
+                WHEN t.first_chart_date <= '2019-12-31' THEN 'train'
+                WHEN t.first_chart_date >= '2020-01-01' AND t.first_chart_date <= '2020-12-31' THEN 'val'
+                WHEN t.first_chart_date >= '2021-01-01' THEN 'test'
+            END AS split
+        FROM features_final ff
+        JOIN tracks t ON t.track_id = ff.track_id
+    """
+
+
+def _train_set(p: dict) -> str:
+    """All train positives plus a seeded sample of negatives.
+
+    The notebook's ``USING SAMPLE ... (bernoulli, 42)`` is not reproducible
+    under multi-threading, so negatives are kept by a hash of the pair key
+    instead: the same rows on every run, at any thread count.
+    """
+    threshold = int(p["sample_frac"] * 1_000_000)
+    return f"""
+        SELECT * EXCLUDE (first_chart_date, split) FROM features_with_split
+        WHERE split = 'train' AND did_enter_within_60d = 1
+        UNION ALL
+        SELECT * EXCLUDE (first_chart_date, split) FROM features_with_split
+        WHERE split = 'train' AND did_enter_within_60d = 0
+          AND hash(track_id, target_country, {SAMPLE_SEED}) % 1000000 < {threshold}
+    """
+
+
+def _eval_set(split: str):
+    def stage(p: dict) -> str:
+        return f"SELECT * EXCLUDE (first_chart_date, split) FROM features_with_split WHERE split = '{split}'"
+    return stage
+
+
+# Stages in dependency order. Parameters computed between stages
+# (continents, country_priors, rank_type, median_dist, sample_frac) are set by
+# prepare_stage / impute_cultural_dist.
+STAGES = [
+    ("tracks", _tracks),
+    ("observation_points", _observation_points),
+    ("obs_with_ranks", _obs_with_ranks),
+    ("origin_set", _origin_set),
+    ("track_artist_flag", _track_artist_flag),
+    ("artist_features", _artist_features),
+    ("pairs", _pairs),
+    ("artist_target_success", _artist_target_success),
+    ("target_country_stats", _target_country_stats),
+    ("cultural_dist_features", _cultural_dist_features),
+    ("language_features", _language_features),
+    ("neighbor_features", _neighbor_features),
+    ("song_lang_match_features", _song_lang_match_features),
+    ("track_country_first_chart", _track_country_first_chart),
+    ("labels", _labels),
+    ("features_final", _features_final),
+    ("features_with_split", _features_with_split),
+    ("train_set", _train_set),
+    ("val_set", _eval_set("val")),
+    ("test_set", _eval_set("test")),
+]
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+def connect(work_dir: Path, threads: int | None = None, memory_limit: str | None = None):
+    """Disk-backed DuckDB for the build; intermediates spill to work_dir/tmp."""
+    import duckdb
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    con = duckdb.connect(str(work_dir / "_feature_eng.duckdb"))
+    con.execute(f"SET threads = {threads or os.cpu_count()}")
+    if memory_limit:
+        con.execute(f"SET memory_limit = '{memory_limit}'")
+    con.execute(f"SET temp_directory = '{(work_dir / 'tmp').as_posix()}'")
+    con.execute("SET preserve_insertion_order = false")
+    return con
+
+
+def register_reference_tables(con, aux_dir: Path, language_cache: Path) -> None:
+    """Auxiliary views, the country list/languages and the song-language cache.
+
+    Everything the stages read besides ``v2``; shared with ``src.incremental``.
+    """
+    for name, file in [
+        ("cultural_distance", "cultural_distance_long.parquet"),
+        ("cultural_top5", "cultural_distance_top5.parquet"),
+        ("countries_ref", "countries_reference_clean.parquet"),
+    ]:
+        con.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM read_parquet('{(aux_dir / file).as_posix()}')")
+
+    con.execute("CREATE OR REPLACE TABLE country_list AS SELECT UNNEST($1::VARCHAR[]) AS country", [COUNTRY_LIST])
+    con.execute("CREATE OR REPLACE TABLE country_primary_lang (country VARCHAR, primary_lang VARCHAR)")
+    con.executemany("INSERT INTO country_primary_lang VALUES (?, ?)", list(SONG_LANG_TARGET.items()))
+
+    cache = {}
+    if language_cache.exists():
+        with open(language_cache) as f:
+            cache = json.load(f)
+    else:
+        print(f"  {language_cache} not found: song_lang_matches_target will be 0")
+    languages = pd.DataFrame({"track_id": list(cache), "detected_lang": list(cache.values())}, dtype=object)
+    con.register("_song_lang_cache", languages)
+    con.execute("CREATE OR REPLACE TABLE song_lang_cache AS SELECT track_id::VARCHAR AS track_id, "
+                "detected_lang::VARCHAR AS detected_lang FROM _song_lang_cache")
+    con.unregister("_song_lang_cache")
+
+
+def _register_sources(con, v2_dir: Path, aux_dir: Path, language_cache: Path) -> None:
+    con.execute(
+        f"CREATE OR REPLACE VIEW v2 AS SELECT * FROM "
+        f"read_parquet('{v2_dir.as_posix()}/year=*/*.parquet', hive_partitioning=true)"
+    )
+    regions = [r for (r,) in con.execute("SELECT DISTINCT region FROM v2 ORDER BY region").fetchall()]
+    if sorted(regions) != sorted(COUNTRY_LIST):
+        raise ValueError(f"v2 has {len(regions)} regions; expected the {len(COUNTRY_LIST)} in COUNTRY_LIST")
+    register_reference_tables(con, aux_dir, language_cache)
+
+
+def _artist_history_as_of(con, params: dict) -> None:
+    """Look every observation point's artist up in a point-in-time index over v2."""
+    index = ArtistHistoryIndex(*(con.execute(sql).fetchdf() for sql in history_queries("v2", "artist").values()))
+    obs = con.execute("""
+        SELECT op.track_id, op.observation_time, t.artist
+        FROM observation_points op JOIN tracks t ON op.track_id = t.track_id
+    """).fetchdf()
+    features = index.as_of_many(obs["artist"], obs["observation_time"]).drop(columns="region_mask")
+    query, region, counts = index.success_in_target(obs["artist"], obs["observation_time"])
+    success = pd.DataFrame({
+        "track_id": obs["track_id"].to_numpy()[query],
+        "observation_time": obs["observation_time"].to_numpy()[query],
+        "target_country": np.asarray(COUNTRY_LIST, dtype=object)[region],
+        "artist_prior_success_in_target": counts,
+    })
+    params["rank_type"] = con.execute("SELECT typeof(rank) FROM v2 LIMIT 1").fetchone()[0]
+    _create_from_frame(con, "artist_as_of", pd.concat([obs[["track_id", "observation_time"]], features], axis=1))
+    _create_from_frame(con, "artist_target_as_of", success)
+
+
+def _create_from_frame(con, table: str, frame: pd.DataFrame) -> None:
+    """Materialize a DataFrame, with observation_time typed as in observation_points."""
+    date_type = con.execute("SELECT typeof(observation_time) FROM observation_points LIMIT 1").fetchone()
+    cast = f" REPLACE (observation_time::{date_type[0]} AS observation_time)" if date_type else ""
+    con.register(f"_{table}", frame)
+    con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT *{cast} FROM _{table}")
+    con.unregister(f"_{table}")
+
+
+def prepare_stage(con, name: str, params: dict) -> None:
+    """Compute the parameters / helper tables a stage needs before it runs."""
+    if name == "artist_features":
+        _artist_history_as_of(con, params)
+    elif name == "target_country_stats":
+        params["continents"] = [r for (r,) in con.execute("""
+            SELECT DISTINCT cr.continent FROM country_list cl
+            JOIN countries_ref cr ON cr.country = cl.country
+            WHERE cr.continent IS NOT NULL ORDER BY cr.continent
+        """).fetchall()]
+        if params.get("country_priors") is None:
+            stats = con.execute(COUNTRY_DAY_STATS_SQL.format(source="v2")).fetchdf()
+            params["country_priors"] = CountryPriors.from_daily(stats)
+        dates = con.execute("SELECT DISTINCT observation_time FROM observation_points").fetchdf()["observation_time"]
+        _create_from_frame(con, "country_priors", params["country_priors"].to_frame(dates))
+    elif name == "song_lang_match_features":
+        con.execute("""
+            CREATE OR REPLACE TABLE song_lang_detected AS
+            SELECT t.track_id, c.detected_lang
+            FROM tracks t LEFT JOIN song_lang_cache c USING (track_id)
+        """)
+    elif name == "train_set":
+        train_pos, train_neg = con.execute("""
+            SELECT SUM(did_enter_within_60d), COUNT(*) - SUM(did_enter_within_60d)
+            FROM features_with_split WHERE split = 'train'
+        """).fetchone()
+        target_neg = (train_pos or 0) * TRAIN_NEGATIVES_PER_POSITIVE
+        params["sample_frac"] = min(1.0, target_neg / train_neg) if train_neg else 1.0
+
+
+def impute_cultural_dist(con, params: dict) -> None:
+    """Fill missing cultural_dist_min with params["median_dist"].
+
+    A full build sets it to the median over pairs that have a distance; the
+    incremental build passes the one recorded in the manifest.
+    """
+    if params.get("median_dist") is None:
+        params["median_dist"] = con.execute(
+            "SELECT MEDIAN(cultural_dist_min) FROM cultural_dist_features WHERE cultural_dist_min IS NOT NULL"
+        ).fetchone()[0]
+    con.execute(
+        "UPDATE cultural_dist_features SET cultural_dist_min = $1 WHERE cultural_dist_min IS NULL",
+        [params["median_dist"]],
+    )
+
+
+def _create(con, name: str, sql: str, timings: dict[str, float]) -> None:
+    t0 = time.perf_counter()
+    con.execute(f"CREATE OR REPLACE TABLE {name} AS {sql}")
+    timings[name] = time.perf_counter() - t0
+
+
+def build_features(
+    out_dir: Path = DATA_DIR,
+    v2_dir: Path = V2_DATA_DIR,
+    aux_dir: Path = AUX_DATA_DIR,
+    language_cache: Path = SONG_LANGUAGE_CACHE_PATH,
+    work_dir: Path | None = None,
+    threads: int | None = None,
+    memory_limit: str | None = None,
+) -> dict[str, float]:
+    """Run every stage and export the splits. Returns seconds per stage."""
+    work_dir = work_dir or out_dir / "_work"
+    con = connect(work_dir, threads, memory_limit)
+    timings: dict[str, float] = {}
+    try:
+        _register_sources(con, v2_dir, aux_dir, language_cache)
+        params: dict = {}
+        for name, stage in STAGES:
+            prepare_stage(con, name, params)
+            _create(con, name, stage(params), timings)
+            if name == "cultural_dist_features":
+                impute_cultural_dist(con, params)
+
+        t0 = time.perf_counter()
+        export_splits(con, out_dir, params)
+        timings["export"] = time.perf_counter() - t0
+    finally:
+        con.close()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return timings
+
+
+def export_splits(con, out_dir: Path, params: dict) -> None:
+    """Write flat, factorized and month-partitioned splits, footprints, full.parquet and the manifest."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    partitioned = out_dir / V3_PARTITIONED_DIR.name
+    shutil.rmtree(partitioned, ignore_errors=True)
+    for split in SPLITS:
+        table = f"{split}_set"
+        con.execute(f"COPY (SELECT * FROM {table}) TO '{(out_dir / f'{split}.parquet').as_posix()}' "
+                    "(FORMAT PARQUET, COMPRESSION 'zstd')")
+        con.execute(f"COPY ({footprint_query(table)}) TO '{(out_dir / f'{split}_footprints.parquet').as_posix()}' "
+                    "(FORMAT PARQUET, COMPRESSION 'zstd')")
+        build_factorized(out_dir / f"{split}.parquet")
+        con.execute(f"""
+            COPY (SELECT *, '{split}' AS split, strftime(observation_time, '%Y-%m') AS {PARTITION_COLUMN} FROM {table})
+            TO '{partitioned.as_posix()}'
+            (FORMAT PARQUET, COMPRESSION 'zstd', PARTITION_BY (split, {PARTITION_COLUMN}), OVERWRITE_OR_IGNORE)
+        """)
+    con.execute(f"COPY (SELECT * EXCLUDE (first_chart_date, split) FROM features_with_split) "
+                f"TO '{(out_dir / 'full.parquet').as_posix()}' (FORMAT PARQUET, COMPRESSION 'zstd')")
+
+    manifest = {
+        "created": datetime.now().isoformat(),
+        "description": "Feature-engineered dataset for Top-5 Country Ranker (60-day horizon, first-chart-day observation)",
+        # Imputation value the incremental build (src.incremental) must reuse
+        "cultural_dist_median": params["median_dist"],
+        "splits": {},
+    }
+    for split in SPLITS:
+        rows, positives, tracks = con.execute(
+            f"SELECT COUNT(*), SUM(did_enter_within_60d), COUNT(DISTINCT track_id) FROM {split}_set"
+        ).fetchone()
+        manifest["splits"][split] = {
+            "rows": rows,
+            "positives": positives,
+            "positive_rate": round(positives / rows * 100, 2) if rows else 0.0,
+            "tracks": tracks,
+            "file": f"{split}.parquet",
+            "footprints_file": f"{split}_footprints.parquet",
+            "factorized_dir": f"{split}_factorized",
+            "partitions": f"partitioned/split={split}",
+        }
+    with open(out_dir / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_partitioned(split: str, months: list[str] | None = None, root: Path = V3_PARTITIONED_DIR) -> str:
+    """DuckDB relation over one split's month partitions (optionally a subset of 'YYYY-MM')."""
+    source = f"read_parquet('{root.as_posix()}/split={split}/*/*.parquet', hive_partitioning=true)"
+    where = ""
+    if months:
+        where = " WHERE " + PARTITION_COLUMN + " IN (" + ", ".join(f"'{m}'" for m in months) + ")"
+    return f"(SELECT * EXCLUDE (split, {PARTITION_COLUMN}) FROM {source}{where})"
+
+
+# ---------------------------------------------------------------------------
+# Verify
+# ---------------------------------------------------------------------------
+
+def compare_splits(candidate_dir: Path, reference_dir: Path, splits: list[str] = SPLITS) -> dict[str, dict]:
+    """Schema and multiset row comparison of {split}.parquet between two builds.
+
+    Train negatives are a random sample in the reference (and a hash sample
+    here), so for train only the positives are compared row for row.
+    """
+    import duckdb
+
+    con = duckdb.connect()
+    report = {}
+    for split in splits:
+        where = " WHERE did_enter_within_60d = 1" if split == "train" else ""
+        a = f"(SELECT * FROM read_parquet('{(candidate_dir / f'{split}.parquet').as_posix()}'){where})"
+        b = f"(SELECT * FROM read_parquet('{(reference_dir / f'{split}.parquet').as_posix()}'){where})"
+        schema_a = con.execute(f"DESCRIBE SELECT * FROM {a}").fetchall()
+        schema_b = con.execute(f"DESCRIBE SELECT * FROM {b}").fetchall()
+        rows_a = con.execute(f"SELECT COUNT(*) FROM {a}").fetchone()[0]
+        rows_b = con.execute(f"SELECT COUNT(*) FROM {b}").fetchone()[0]
+        only_a = only_b = None
+        if schema_a == schema_b:
+            only_a = con.execute(f"SELECT COUNT(*) FROM (SELECT * FROM {a} EXCEPT ALL SELECT * FROM {b})").fetchone()[0]
+            only_b = con.execute(f"SELECT COUNT(*) FROM (SELECT * FROM {b} EXCEPT ALL SELECT * FROM {a})").fetchone()[0]
+        report[split] = {
+            "compared": "positives" if split == "train" else "all rows",
+            "same_schema": schema_a == schema_b,
+            "rows": rows_a,
+            "reference_rows": rows_b,
+            "only_in_candidate": only_a,
+            "only_in_reference": only_b,
+            "identical": schema_a == schema_b and only_a == 0 and only_b == 0,
+        }
+    con.close()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the v3 feature splits from v2 (notebook 04, headless).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Run all stages and export the splits")
+    build.add_argument("--out", type=Path, default=DATA_DIR)
+    build.add_argument("--v2", type=Path, default=V2_DATA_DIR)
+    build.add_argument("--aux", type=Path, default=AUX_DATA_DIR)
+    build.add_argument("--language-cache", type=Path, default=SONG_LANGUAGE_CACHE_PATH)
+    build.add_argument("--work-dir", type=Path, help="Database and spill directory (default: <out>/_work)")
+    build.add_argument("--threads", type=int, help="DuckDB threads (default: all cores)")
+    build.add_argument("--memory-limit", help="e.g. 8GB; beyond it operators spill to the work dir")
+    verify = sub.add_parser("verify", help="Compare a build's splits with a reference build")
+    verify.add_argument("candidate", type=Path)
+    verify.add_argument("--reference", type=Path, default=DATA_DIR)
+    verify.add_argument("--splits", nargs="+", default=SPLITS, choices=SPLITS)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        timings = build_features(
+            args.out, args.v2, args.aux, args.language_cache, args.work_dir, args.threads, args.memory_limit,
+        )
+        for stage, seconds in timings.items():
+            print(f"  {stage:28s} {seconds:7.2f} s")
+        print(f"Wrote {args.out}")
+    else:
+        for split, result in compare_splits(args.candidate, args.reference, args.splits).items():
+            status = "identical" if result["identical"] else "DIFFERENT"
+            print(f"{split:5s} {status:9s} ({result['compared']}) rows {result['rows']:,} vs {result['reference_rows']:,}, "
+                  f"schema {'same' if result['same_schema'] else 'differs'}, "
+                  f"only in candidate {result['only_in_candidate']}, only in reference {result['only_in_reference']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Track-level origin footprints: one row per (track_id, observation_time).
+
+The v3 splits repeat a track's 62 ``rank_*`` columns on every pair row. The
+footprint artifact stores them once per track as sparse ``origin_codes`` /
+``origin_ranks`` lists (uint8 positions in COUNTRY_LIST and uint8 top-200
+ranks), sorted by track_id. Feature engineering writes
+``<split>_footprints.parquet`` next to each split; run
+``python -m src.footprints`` to build them for splits exported earlier.
+Readers only load the artifact; they never build it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.config import COUNTRY_LIST, DATA_DIR, N_COUNTRIES, country_to_rank_col
+
+FOOTPRINT_COLUMNS = ["track_id", "observation_time", "origin_codes", "origin_ranks"]
+
+
+def footprint_path(split_path: Path) -> Path:
+    return split_path.with_name(f"{split_path.stem}_footprints.parquet")
+
+
+def footprint_query(source: str) -> str:
+    """One row per (track_id, observation_time) from a pair-level relation.
+
+    DISTINCT ON hashes the two key columns only; the rank vector is then
+    reduced to the countries the track was charting in.
+    """
+    ranks = ", ".join(country_to_rank_col(c) for c in COUNTRY_LIST)
+    return f"""
+        WITH fp AS (
+            SELECT DISTINCT ON (track_id, observation_time)
+                track_id, observation_time, [{ranks}] AS ranks
+            FROM {source}
+        )
+        SELECT
+            track_id,
+            observation_time,
+            [(i - 1)::UTINYINT FOR i IN range(1, {N_COUNTRIES + 1}) IF ranks[i] > 0] AS origin_codes,
+            [r::UTINYINT FOR r IN ranks IF r > 0] AS origin_ranks
+        FROM fp
+        ORDER BY track_id, observation_time
+    """
+
+
+def build_track_footprints(split_path: Path, out_path: Path | None = None) -> Path:
+    out_path = out_path or footprint_path(split_path)
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    import duckdb
+
+    source = f"read_parquet('{split_path.as_posix()}')"
+    con = duckdb.connect()
+    con.execute(
+        f"COPY ({footprint_query(source)}) "
+        f"TO '{tmp_path.as_posix()}' (FORMAT PARQUET, COMPRESSION 'zstd')"
+    )
+    con.close()
+    tmp_path.replace(out_path)
+    return out_path
+
+
+def load_track_footprints(split_path: Path) -> pd.DataFrame:
+    """Read a split's footprint artifact. One older than the split is served
+    with a warning; (re)building is left to ``python -m src.footprints``.
+    """
+    path = footprint_path(split_path)
+    rebuild = f"`python -m src.footprints --splits {split_path.stem}`"
+    if not path.exists():
+        raise FileNotFoundError(f"{path} is missing; build it with {rebuild}")
+    if split_path.exists() and path.stat().st_mtime_ns < split_path.stat().st_mtime_ns:
+        warnings.warn(
+            f"{path} is older than {split_path.name}; serving it anyway. Run {rebuild} to rebuild.",
+            RuntimeWarning, stacklevel=2,
+        )
+    return pd.read_parquet(path, columns=FOOTPRINT_COLUMNS)
+
+
+# ---------------------------------------------------------------------------
+# Decoding
+# ---------------------------------------------------------------------------
+
+def _flatten(footprints: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    lengths = footprints["origin_codes"].map(len).to_numpy()
+    rows = np.repeat(np.arange(len(footprints)), lengths)
+    if not len(rows):
+        empty = np.empty(0, dtype=np.uint8)
+        return rows, empty, empty
+    codes = np.concatenate(footprints["origin_codes"].to_numpy()).astype(np.uint8)
+    ranks = np.concatenate(footprints["origin_ranks"].to_numpy()).astype(np.uint8)
+    return rows, codes, ranks
+
+
+def footprint_rank_matrix(footprints: pd.DataFrame) -> np.ndarray:
+    """Dense (n_tracks, N_COUNTRIES) uint8 rank matrix in COUNTRY_LIST order (0 = not charting)."""
+    rows, codes, ranks = _flatten(footprints)
+    matrix = np.zeros((len(footprints), N_COUNTRIES), dtype=np.uint8)
+    matrix[rows, codes] = ranks
+    return matrix
+
+
+def footprint_masks(footprints: pd.DataFrame) -> np.ndarray:
+    """Per-track 64-bit origin-country masks."""
+    rows, codes, _ = _flatten(footprints)
+    masks = np.zeros(len(footprints), dtype=np.uint64)
+    np.bitwise_or.at(masks, rows, np.left_shift(np.uint64(1), codes.astype(np.uint64)))
+    return masks
+
+
+def footprint_entries(origin_codes, origin_ranks) -> pd.DataFrame:
+    """One footprint as a Country/Rank table, best rank first."""
+    entries = pd.DataFrame({
+        "Country": [COUNTRY_LIST[int(code)] for code in origin_codes],
+        "Rank": np.asarray(origin_ranks, dtype=int),
+    })
+    return entries.sort_values("Rank", kind="stable").reset_index(drop=True)
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build track-level footprint artifacts for v3 splits.")
+    parser.add_argument("--splits", nargs="+", default=["train", "val", "test"])
+    args = parser.parse_args()
+
+    for split in args.splits:
+        split_path = DATA_DIR / f"{split}.parquet"
+        if not split_path.exists():
+            print(f"Skipping {split}: {split_path} not found")
+            continue
+        out_path = build_track_footprints(split_path)
+        n_tracks = len(pd.read_parquet(out_path, columns=["track_id"]))
+        print(f"Wrote {out_path} ({n_tracks} tracks)")
+
+
+if __name__ == "__main__":
+    main()
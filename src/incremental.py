@@ -0,0 +1,462 @@
+"""Daily incremental v3 features: one chart day in, that day's new tracks out.
+
+``src.features`` rebuilds v3 from the whole v2 history. Here a small
+DuckDB state file (``incremental_state.duckdb``) carries the history the
+day-0 features need, aggregated once:
+
+- ``track_first_chart``: first top200 date per (track, country), which
+  identifies new tracks and later provides their labels
+- ``artist_history``: chart rows and best rank per (artist, country, track)
+- ``country_day_stats``: top200 streams, entries and new entries per (country, date)
+
+For a date D, tracks charting in a top200 that have never charted before
+get the same stages as the full build, run over D's chart rows only; the
+artist stages read the state and the target-market stage the
+``src.country_priors`` store (history before D) instead of scanning v2.
+Their rows go to ``daily/obs_date=D/part.parquet`` with NULL labels, then
+D's chart rows are folded into the state and appended to the priors store,
+which the app serves from. Once D is 60 days past a partition's date its
+labels are known, and the partition is rewritten with them; once it is 60
+days past a month's end, the month's first entries are added to the
+``src.corridors`` store. Work per day scales with that day's chart rows and
+the new tracks' artists, not with the history.
+
+Missing cultural distances are imputed with the median recorded in the v3
+manifest, so daily rows match ``full.parquet`` for the same dates.
+
+    python -m src.incremental init --through 2021-12-31
+    python -m src.incremental update --through 2022-01-31
+    python -m src.incremental update 2022-02-01 --source charts_2022-02-01.parquet
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import duckdb
+
+from src.corridors import FIRST_CHART_SQL, CorridorTensor
+from src.country_priors import COUNTRY_DAY_STATS_SQL, CountryPriors
+from src.config import (
+    AUX_DATA_DIR,
+    CORRIDORS_PATH,
+    COUNTRY_PRIORS_PATH,
+    DATA_DIR,
+    INCREMENTAL_STATE_PATH,
+    SONG_LANGUAGE_CACHE_PATH,
+    V2_DATA_DIR,
+    V3_DAILY_DIR,
+)
+from src.features import (
+    HORIZON_DAYS,
+    STAGES,
+    impute_cultural_dist,
+    prepare_stage,
+    register_reference_tables,
+)
+
+PARTITION_COLUMN = "obs_date"
+
+# History tables, built from v2 by init and extended by every update.
+_STATE_TABLES = {
+    "track_first_chart": (FIRST_CHART_SQL, "track_id, country"),
+    "artist_history": ("""
+        SELECT artist, region, track_id, COUNT(*) AS chart_count, MIN(rank) AS best_rank
+        FROM {source}
+        WHERE chart = 'top200' AND artist IS NOT NULL
+        GROUP BY artist, region, track_id
+    """, "artist, region, track_id"),
+    "country_day_stats": (COUNTRY_DAY_STATS_SQL, "country, date"),
+}
+
+# Folds the day's chart rows (table ``day``) into the history tables.
+_FOLD = [
+    f"""INSERT INTO state.track_first_chart
+        {_STATE_TABLES["track_first_chart"][0].format(source="day")}
+        ON CONFLICT DO NOTHING""",
+    f"""INSERT INTO state.artist_history
+        {_STATE_TABLES["artist_history"][0].format(source="day")}
+        ON CONFLICT DO UPDATE SET
+            chart_count = chart_count + EXCLUDED.chart_count,
+            best_rank = LEAST(best_rank, EXCLUDED.best_rank)""",
+    f"""INSERT INTO state.country_day_stats
+        {_STATE_TABLES["country_day_stats"][0].format(source="day")}""",
+]
+
+
+def _v2_source(v2_dir: Path) -> str:
+    return f"read_parquet('{v2_dir.as_posix()}/year=*/*.parquet', hive_partitioning=true)"
+
+
+# ---------------------------------------------------------------------------
+# Stages that read the state instead of the v2 history
+# ---------------------------------------------------------------------------
+
+def _artist_features(p: dict) -> str:
+    return """
+        WITH agg AS (
+            SELECT
+                op.track_id,
+                op.observation_time,
+                SUM(h.chart_count)::BIGINT AS artist_prior_chart_count,
+                COUNT(DISTINCT h.region) AS artist_prior_unique_regions,
+                MIN(h.best_rank) AS artist_prior_best_rank,
+                COUNT(DISTINCT h.track_id) AS artist_prior_unique_tracks
+            FROM observation_points op
+            JOIN tracks t ON op.track_id = t.track_id
+            JOIN state.artist_history h ON h.artist = t.artist
+            GROUP BY op.track_id, op.observation_time
+        )
+        SELECT
+            a.track_id,
+            a.observation_time,
+            COALESCE(a.artist_prior_chart_count, 0) AS artist_prior_chart_count,
+            COALESCE(a.artist_prior_unique_regions, 0) AS artist_prior_unique_regions,
+            COALESCE(a.artist_prior_best_rank, 201) AS artist_prior_best_rank,
+            COALESCE(a.artist_prior_unique_tracks, 0) AS artist_prior_unique_tracks,
+            CASE WHEN COALESCE(a.artist_prior_unique_tracks, 0) = 0 THEN 0.0
+                 ELSE a.artist_prior_unique_regions * 1.0 / a.artist_prior_unique_tracks
+            END AS artist_country_ratio
+        FROM agg a
+    """
+
+
+def _artist_target_success(p: dict) -> str:
+    return """
+        SELECT
+            op.track_id,
+            op.observation_time,
+            h.region AS target_country,
+            COUNT(DISTINCT h.track_id) AS artist_prior_success_in_target
+        FROM observation_points op
+        JOIN tracks t ON op.track_id = t.track_id
+        JOIN state.artist_history h ON h.artist = t.artist AND h.track_id != op.track_id
+        GROUP BY op.track_id, op.observation_time, h.region
+    """
+
+
+def _unlabeled(p: dict) -> str:
+    """Labels are unknown on day 0; back-filled once the horizon has passed."""
+    return """
+        SELECT
+            track_id,
+            observation_time,
+            target_country,
+            NULL::INTEGER AS did_enter_within_60d,
+            NULL::INTEGER AS days_to_entry
+        FROM pairs
+    """
+
+
+_DAILY_OVERRIDES = {
+    "artist_features": _artist_features,
+    "artist_target_success": _artist_target_success,
+    "labels": _unlabeled,
+}
+# Artist stages read state.artist_history, so their v2-wide preparation is skipped.
+_STATE_STAGES = {"artist_features", "artist_target_success"}
+_LAST_DAILY_STAGE = [name for name, _ in STAGES].index("features_final")
+
+# Full-build stages up to features_final, with the history-dependent ones swapped.
+DAILY_STAGES = [
+    (name, _DAILY_OVERRIDES.get(name, stage))
+    for name, stage in STAGES[:_LAST_DAILY_STAGE + 1]
+    if name != "track_country_first_chart"
+]
+
+
+# ---------------------------------------------------------------------------
+# State
+# ---------------------------------------------------------------------------
+
+def _connect(state_path: Path):
+    """In-memory database for the day's stages with the state attached as ``state``."""
+    con = duckdb.connect()
+    con.execute(f"ATTACH '{state_path.as_posix()}' AS state")
+    return con
+
+
+def _manifest_median(manifest_path: Path) -> float:
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"{manifest_path} not found: build v3 first (python -m src.features build) or pass --median")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("cultural_dist_median") is None:
+        raise ValueError(f"{manifest_path} has no cultural_dist_median: rebuild v3 or pass --median")
+    return manifest["cultural_dist_median"]
+
+
+def _priors_from_state(con, through: date, table: str = "country_day_stats") -> CountryPriors:
+    """Priors store rebuilt from the state's country_day_stats, through ``through``."""
+    stats = con.execute(f"SELECT * FROM {table}").fetchdf()
+    priors = CountryPriors.from_daily(stats)
+    if priors.last_day < through:
+        priors.append_day(through, stats.iloc[:0])
+    return priors
+
+
+def _corridors_from_state(con, through: date, table: str = "track_first_chart") -> CorridorTensor:
+    """Corridor store rebuilt from the state's track_first_chart, through ``through``."""
+    return CorridorTensor.from_firsts(con.execute(f"SELECT * FROM {table}").fetchdf(), through)
+
+
+def _update_corridors(con, day: date, corridors_path: Path) -> bool:
+    """Add the month buckets whose 60-day horizon ``day`` closes (about once a month)."""
+    corridors = CorridorTensor.load(corridors_path) if corridors_path.exists() else None
+    if corridors is None:
+        _corridors_from_state(con, day, "state.track_first_chart").save(corridors_path)
+        return True
+    pending = corridors.pending(day)
+    if pending is None:
+        return False
+    firsts = con.execute("""
+        SELECT * FROM state.track_first_chart
+        WHERE track_id IN (
+            SELECT track_id FROM state.track_first_chart WHERE first_chart_date BETWEEN $1 AND $2
+        )
+    """, list(pending)).fetchdf()
+    corridors.update(firsts, day)
+    corridors.save(corridors_path)
+    return True
+
+
+def init_state(
+    through: date,
+    state_path: Path = INCREMENTAL_STATE_PATH,
+    v2_dir: Path = V2_DATA_DIR,
+    median_dist: float | None = None,
+    priors_path: Path = COUNTRY_PRIORS_PATH,
+    corridors_path: Path = CORRIDORS_PATH,
+) -> dict[str, int]:
+    """Build the state (and the priors and corridor stores) from v2 chart rows
+    up to and including ``through``.
+
+    Returns row counts per table. Later updates start the day after ``through``.
+    """
+    if median_dist is None:
+        median_dist = _manifest_median(DATA_DIR / "manifest.json")
+    tmp_path = state_path.with_name(state_path.name + ".tmp")
+    tmp_path.unlink(missing_ok=True)
+    con = duckdb.connect(str(tmp_path))
+    counts = {}
+    try:
+        con.execute(f"CREATE VIEW history AS SELECT * FROM {_v2_source(v2_dir)} WHERE date <= DATE '{through.isoformat()}'")
+        for name, (query, key) in _STATE_TABLES.items():
+            con.execute(f"CREATE TABLE {name} AS {query.format(source='history')}")
+            con.execute(f"ALTER TABLE {name} ADD PRIMARY KEY ({key})")
+            counts[name] = con.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+        con.execute("DROP VIEW history")
+        con.execute("CREATE TABLE meta AS SELECT $1::DATE AS last_date, $2::DOUBLE AS median_dist", [through, median_dist])
+        con.execute("""
+            CREATE TABLE daily_partitions (
+                obs_date DATE PRIMARY KEY, rows BIGINT, new_tracks BIGINT, labeled BOOLEAN
+            )
+        """)
+        con.execute("CHECKPOINT")
+        _priors_from_state(con, through).save(priors_path)
+        _corridors_from_state(con, through).save(corridors_path)
+    finally:
+        con.close()
+    tmp_path.replace(state_path)
+    return counts
+
+
+def last_date(state_path: Path = INCREMENTAL_STATE_PATH) -> date:
+    con = duckdb.connect(str(state_path), read_only=True)
+    try:
+        return con.execute("SELECT last_date FROM meta").fetchone()[0]
+    finally:
+        con.close()
+
+
+# ---------------------------------------------------------------------------
+# Daily update
+# ---------------------------------------------------------------------------
+
+def _partition_path(daily_dir: Path, day: date) -> Path:
+    return daily_dir / f"{PARTITION_COLUMN}={day.isoformat()}" / "part.parquet"
+
+
+def _copy_atomic(con, query: str, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    con.execute(f"COPY ({query}) TO '{tmp_path.as_posix()}' (FORMAT PARQUET, COMPRESSION 'zstd')")
+    tmp_path.replace(path)
+
+
+def _backfill_labels(con, day: date, daily_dir: Path) -> list[date]:
+    """Rewrite every unlabeled partition whose 60-day window closed by ``day``."""
+    due = [d for (d,) in con.execute(
+        "SELECT obs_date FROM state.daily_partitions "
+        "WHERE NOT labeled AND obs_date + $1::INTEGER <= $2 ORDER BY obs_date",
+        [HORIZON_DAYS, day],
+    ).fetchall()]
+    labels_sql = dict(STAGES)["labels"]({})
+    con.execute("CREATE OR REPLACE VIEW track_country_first_chart AS SELECT * FROM state.track_first_chart")
+    for obs_date in due:
+        path = _partition_path(daily_dir, obs_date)
+        con.execute(f"CREATE OR REPLACE TABLE partition_rows AS SELECT * FROM read_parquet('{path.as_posix()}')")
+        con.execute("CREATE OR REPLACE TABLE pairs AS SELECT track_id, observation_time, target_country FROM partition_rows")
+        con.execute(f"CREATE OR REPLACE TABLE labels AS {labels_sql}")
+        _copy_atomic(con, """
+            SELECT r.* REPLACE (lb.did_enter_within_60d AS did_enter_within_60d, lb.days_to_entry AS days_to_entry)
+            FROM partition_rows r
+            JOIN labels lb USING (track_id, observation_time, target_country)
+            ORDER BY r.track_id, r.target_country
+        """, path)
+        con.execute("UPDATE state.daily_partitions SET labeled = true WHERE obs_date = $1", [obs_date])
+    return due
+
+
+def update_day(
+    day: date,
+    source: Path | None = None,
+    state_path: Path = INCREMENTAL_STATE_PATH,
+    daily_dir: Path = V3_DAILY_DIR,
+    v2_dir: Path = V2_DATA_DIR,
+    aux_dir: Path = AUX_DATA_DIR,
+    language_cache: Path = SONG_LANGUAGE_CACHE_PATH,
+    priors_path: Path = COUNTRY_PRIORS_PATH,
+    corridors_path: Path = CORRIDORS_PATH,
+) -> dict:
+    """Add one chart day: features for its new tracks, then fold it into the
+    state and the priors store (and the corridor store when a month closes).
+
+    ``source`` is a parquet file with that day's v2-schema chart rows
+    (top200 and viral50); by default they are read from v2.
+    """
+    t0 = time.perf_counter()
+    con = _connect(state_path)
+    try:
+        previous, median_dist = con.execute("SELECT last_date, median_dist FROM state.meta").fetchone()
+        if day <= previous:
+            raise ValueError(f"{day} is not after the last processed date {previous}")
+        priors = CountryPriors.load(priors_path) if priors_path.exists() else None
+        if priors is None or priors.last_day != previous:
+            # Missing, or out of step after an interrupted update
+            priors = _priors_from_state(con, previous, "state.country_day_stats")
+
+        relation = f"read_parquet('{source.as_posix()}')" if source else _v2_source(v2_dir)
+        year_filter = "" if source else f"year = {day.year} AND "
+        con.execute(f"CREATE TABLE day AS SELECT * FROM {relation} WHERE {year_filter}date = $1", [day])
+        con.execute("""
+            CREATE TABLE new_tracks AS
+            SELECT DISTINCT d.track_id
+            FROM day d
+            ANTI JOIN state.track_first_chart f ON f.track_id = d.track_id
+            WHERE d.chart = 'top200'
+        """)
+        n_new = con.execute("SELECT COUNT(*) FROM new_tracks").fetchone()[0]
+
+        rows = 0
+        if n_new:
+            register_reference_tables(con, aux_dir, language_cache)
+            con.execute("CREATE VIEW v2 AS SELECT * FROM day WHERE track_id IN (SELECT track_id FROM new_tracks)")
+            params = {"median_dist": median_dist, "country_priors": priors}
+            for name, stage in DAILY_STAGES:
+                if name not in _STATE_STAGES:
+                    prepare_stage(con, name, params)
+                con.execute(f"CREATE OR REPLACE TABLE {name} AS {stage(params)}")
+                if name == "cultural_dist_features":
+                    impute_cultural_dist(con, params)
+            rows = con.execute("SELECT COUNT(*) FROM features_final").fetchone()[0]
+            _copy_atomic(con, "SELECT * FROM features_final ORDER BY track_id, target_country",
+                         _partition_path(daily_dir, day))
+
+        # The partition is in place before the state records the day, so a
+        # failed run can simply be repeated.
+        con.execute("BEGIN TRANSACTION")
+        for statement in _FOLD:
+            con.execute(statement)
+        con.execute("UPDATE state.meta SET last_date = $1", [day])
+        if n_new:
+            con.execute("INSERT INTO state.daily_partitions VALUES ($1, $2, $3, false)", [day, rows, n_new])
+        con.execute("COMMIT")
+        priors.append_day(day, con.execute(COUNTRY_DAY_STATS_SQL.format(source="day")).fetchdf())
+        priors.save(priors_path)
+        corridors_updated = _update_corridors(con, day, corridors_path)
+
+        backfilled = _backfill_labels(con, day, daily_dir)
+    finally:
+        con.close()
+    return {
+        "date": day,
+        "new_tracks": n_new,
+        "rows": rows,
+        "backfilled": backfilled,
+        "corridors_updated": corridors_updated,
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+def read_daily(start: date | None = None, end: date | None = None, root: Path = V3_DAILY_DIR) -> str:
+    """DuckDB relation over the daily store, optionally limited to [start, end]."""
+    source = f"read_parquet('{root.as_posix()}/{PARTITION_COLUMN}=*/*.parquet', hive_partitioning=true)"
+    conditions = []
+    if start:
+        conditions.append(f"{PARTITION_COLUMN} >= DATE '{start.isoformat()}'")
+    if end:
+        conditions.append(f"{PARTITION_COLUMN} <= DATE '{end.isoformat()}'")
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return f"(SELECT * EXCLUDE ({PARTITION_COLUMN}) FROM {source}{where})"
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Incremental daily v3 feature updates.")
+    parser.add_argument("--state", type=Path, default=INCREMENTAL_STATE_PATH)
+    parser.add_argument("--daily-dir", type=Path, default=V3_DAILY_DIR)
+    parser.add_argument("--v2", type=Path, default=V2_DATA_DIR)
+    parser.add_argument("--priors", type=Path, default=COUNTRY_PRIORS_PATH)
+    parser.add_argument("--corridors", type=Path, default=CORRIDORS_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    init = sub.add_parser("init", help="Build the history state from v2 up to a date")
+    init.add_argument("--through", type=date.fromisoformat, required=True)
+    init.add_argument("--median", type=float, help="Cultural-distance imputation value (default: v3 manifest)")
+    init.add_argument("--force", action="store_true", help="Replace an existing state")
+    update = sub.add_parser("update", help="Process one chart day, or every day up to --through")
+    update.add_argument("date", type=date.fromisoformat, nargs="?")
+    update.add_argument("--through", type=date.fromisoformat)
+    update.add_argument("--source", type=Path, help="Parquet with the day's chart rows (default: v2)")
+    update.add_argument("--aux", type=Path, default=AUX_DATA_DIR)
+    update.add_argument("--language-cache", type=Path, default=SONG_LANGUAGE_CACHE_PATH)
+    args = parser.parse_args()
+
+    if args.command == "init":
+        if args.state.exists() and not args.force:
+            parser.error(f"{args.state} exists; pass --force to rebuild it")
+        for table, count in init_state(
+            args.through, args.state, args.v2, args.median, args.priors, args.corridors,
+        ).items():
+            print(f"  {table:20s} {count:>12,} rows")
+        print(f"Wrote {args.state} (through {args.through})")
+        return
+
+    if args.source and (args.date is None or args.through):
+        parser.error("--source holds one day: pass its date and no --through")
+    if args.date is None and args.through is None:
+        parser.error("pass a date or --through")
+    start = args.date or last_date(args.state) + timedelta(days=1)
+    end = args.through or start
+    day = start
+    while day <= end:
+        result = update_day(
+            day, args.source, args.state, args.daily_dir, args.v2, args.aux, args.language_cache,
+            args.priors, args.corridors,
+        )
+        labeled = f", labeled {', '.join(d.isoformat() for d in result['backfilled'])}" if result["backfilled"] else ""
+        corridors = ", corridors updated" if result["corridors_updated"] else ""
+        print(f"{day}  {result['new_tracks']:5d} new tracks  {result['rows']:7,} rows  "
+              f"{result['seconds'] * 1000:6.0f} ms{labeled}{corridors}")
+        day += timedelta(days=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -101,6 +101,72 @@ def evaluate_ranked_candidates(scored_df: pd.DataFrame, k: int = 5) -> tuple[dic
     }, track_metrics
 
 
+def grouped_ranking_metrics(
+    scores: np.ndarray, labels: np.ndarray, group: np.ndarray,
+    tie_break: np.ndarray | None = None, k: int = 5,
+) -> dict:
+    """ranking_metrics' positive-track means for rows laid out in contiguous
+    query groups (sizes ``group``, as passed to XGBRanker), vectorized over
+    groups. Labels are binary; ties break on tie_break, then row order.
+    """
+    scores = np.asarray(scores, dtype=float)
+    labels = np.asarray(labels, dtype=float)
+    tie_break = np.zeros(len(scores)) if tie_break is None else np.asarray(tie_break, dtype=float)
+    group = np.asarray(group, dtype=np.int64)
+    starts = np.r_[0, np.cumsum(group)[:-1]]
+    gid = np.repeat(np.arange(len(group)), group)
+
+    order = np.lexsort((-tie_break, -scores, gid))
+    rel = labels[order]
+    position = np.arange(len(rel)) - starts[gid]
+    top = rel * (position < k)
+    positives = np.bincount(gid, weights=rel, minlength=len(group))
+    hits = np.bincount(gid, weights=top, minlength=len(group))
+
+    discount = 1.0 / np.log2(position + 2.0)
+    dcg = np.bincount(gid, weights=top * discount, minlength=len(group))
+    ideal_discount = np.r_[0.0, np.cumsum(1.0 / np.log2(np.arange(k) + 2.0))]
+    idcg = ideal_discount[np.minimum(positives, np.minimum(group, k)).astype(int)]
+
+    running_hits = np.cumsum(rel)
+    running_hits -= np.r_[0.0, running_hits][starts][gid]
+    ap = np.bincount(gid, weights=top * running_hits / (position + 1.0), minlength=len(group))
+
+    has_positive = positives > 0
+    if not has_positive.any():
+        return {f"recall@{k}": None, f"hit_rate@{k}": None, f"ndcg@{k}": None, f"map@{k}": None}
+    p = positives[has_positive]
+    return {
+        f"recall@{k}": float((hits[has_positive] / p).mean()),
+        f"hit_rate@{k}": float((hits[has_positive] > 0).mean()),
+        f"ndcg@{k}": float((dcg[has_positive] / idcg[has_positive]).mean()),
+        f"map@{k}": float((ap[has_positive] / np.minimum(p, k)).mean()),
+    }
+
+
+def choose_recall_threshold(y_true, y_prob, precision_floor: float, beta: float = 2.0) -> tuple[float, str]:
+    """Highest-recall threshold with precision >= precision_floor, or the best
+    F-beta threshold if none reaches the floor.
+    """
+    from sklearn.metrics import precision_recall_curve
+
+    precision, recall, thresholds = precision_recall_curve(y_true, y_prob)
+    table = pd.DataFrame({"threshold": thresholds, "precision": precision[:-1], "recall": recall[:-1]})
+    beta_sq = beta ** 2
+    denom = beta_sq * table["precision"] + table["recall"]
+    table["fbeta"] = np.where(denom == 0, 0.0, (1 + beta_sq) * table["precision"] * table["recall"] / denom.where(denom != 0, 1.0))
+    table = table.sort_values("threshold").reset_index(drop=True)
+
+    eligible = table[table["precision"] >= precision_floor]
+    if not eligible.empty:
+        selected = eligible.sort_values(["recall", "precision", "threshold"], ascending=[False, False, True]).iloc[0]
+        return float(selected["threshold"]), f"highest recall with precision >= {precision_floor:.2f}"
+    selected = table.sort_values(["fbeta", "recall", "precision"], ascending=[False, False, False]).iloc[0]
+    return float(selected["threshold"]), (
+        f"fallback to best f{beta} because no threshold met precision floor {precision_floor:.2f}"
+    )
+
+
 def regression_metrics(y_true: np.ndarray, y_pred: np.ndarray) -> dict:
     from sklearn.metrics import mean_absolute_error, mean_squared_error, median_absolute_error
 
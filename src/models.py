@@ -7,10 +7,10 @@ import time
 import numpy as np
 import pandas as pd
 import streamlit as st
-import xgboost as xgb
 
-from src.config import MODEL_DIR, PRUNED_ROW_FEATURE_COLS, FILL_VALUES_FINAL, TOP_K
-from src.data import make_feature_matrix
+from src.config import COUNTRY_LIST, MODEL_DIR, PRUNED_ROW_FEATURE_COLS, FILL_VALUES_FINAL, TOP_K, countries_to_mask
+from src.data import build_prediction_rows, codes_in_mask, encode_countries
+from src.sparse_features import model_feature_matrix
 
 
 # ---------------------------------------------------------------------------
@@ -20,6 +20,8 @@ from src.data import make_feature_matrix
 @st.cache_resource
 def load_pretrained_models() -> dict:
     """Load stage2 ranker and stage3 regressor from MODEL_DIR."""
+    import xgboost as xgb
+
     ranker = xgb.XGBRanker()
     ranker.load_model(str(MODEL_DIR / "stage2_country_ranker.json"))
 
@@ -43,9 +45,10 @@ def normalize_scores(values: pd.Series) -> pd.Series:
 
 def score_ranker(
     model, df: pd.DataFrame, feature_cols: list[str], fill_values: dict | pd.Series,
+    sparse: bool | None = None,
 ) -> pd.DataFrame:
     ordered = df.sort_values(["target_country"]).reset_index(drop=True)
-    X = make_feature_matrix(ordered, feature_cols, fill_values)
+    X = model_feature_matrix(model, ordered, feature_cols, fill_values, sparse)
     raw_scores = pd.Series(model.predict(X), index=ordered.index)
     scored = ordered[["target_country"]].copy()
     scored["score"] = normalize_scores(raw_scores)
@@ -71,11 +74,22 @@ def inverse_transform_target(y: np.ndarray, target_transform: str = "log1p") ->
     return y_arr
 
 
+def regressor_target_transform() -> str:
+    """Target transform the MODEL_DIR regressor was trained with (the Optuna
+    pick recorded in training_summary.json; summaries predating the search used log1p).
+    """
+    from src.config import TRAINING_SUMMARY
+
+    return TRAINING_SUMMARY["stage3_regressor"].get("target_transform", "log1p")
+
+
 def score_regressor(
     model, df: pd.DataFrame, feature_cols: list[str], fill_values: dict | pd.Series,
-    target_transform: str = "log1p",
+    target_transform: str | None = None, sparse: bool | None = None,
 ) -> pd.DataFrame:
-    X = make_feature_matrix(df, feature_cols, fill_values)
+    if target_transform is None:
+        target_transform = regressor_target_transform()
+    X = model_feature_matrix(model, df, feature_cols, fill_values, sparse)
     preds = model.predict(X)
     preds = inverse_transform_target(preds, target_transform)
     scored = df[["target_country"]].copy()
@@ -94,32 +108,48 @@ def predict_custom_song(
     fill_values: dict | None = None,
     top_k: int = TOP_K,
     origin_countries: set[str] | None = None,
+    sparse: bool | None = None,
+    target_transform: str | None = None,
 ) -> dict:
     """Run ranker + regressor on a 62-row prediction DataFrame.
     origin_countries are excluded from the top-k (already charting there).
-    Returns dict with 'top_k' results, 'all_scores', and 'timing_ms'.
+    Each model scores the feature encoding it was trained on unless sparse
+    is given (see src.sparse_features.model_feature_matrix). Timing
+    predictions are decoded with target_transform (default: the summary's).
+    Returns dict with 'top_k' results, 'all_scores', 'timing_ms', and the
+    ranker's TreeSHAP 'contributions' per target country grouped by feature
+    category (see src.explain), with their own 'explain_ms'.
     """
+    from src.explain import explain_rows
+
     if feature_cols is None:
         feature_cols = PRUNED_ROW_FEATURE_COLS
     if fill_values is None:
         fill_values = FILL_VALUES_FINAL
+    if target_transform is None:
+        target_transform = regressor_target_transform()
 
     t0 = time.time()
 
     # Stage 2: rank countries
     ranker = models["ranker"]
-    X = make_feature_matrix(prediction_df, feature_cols, fill_values)
+    X = model_feature_matrix(ranker, prediction_df, feature_cols, fill_values, sparse)
     raw_scores = pd.Series(ranker.predict(X), index=prediction_df.index)
     norm_scores = normalize_scores(raw_scores)
 
     # Stage 3: predict timing
     regressor = models["regressor"]
-    timing_preds = regressor.predict(X)
-    timing_preds = inverse_transform_target(timing_preds, "log1p")
+    timing_preds = regressor.predict(model_feature_matrix(regressor, prediction_df, feature_cols, fill_values, sparse))
+    timing_preds = inverse_transform_target(timing_preds, target_transform)
     timing_preds = np.clip(timing_preds, 1.0, 60.0)
 
     elapsed_ms = (time.time() - t0) * 1000
 
+    # Exact per-row contributions for all 62 rows in one call
+    t0 = time.time()
+    contributions = explain_rows(ranker, prediction_df, feature_cols, fill_values, sparse)
+    explain_ms = (time.time() - t0) * 1000
+
     # Build results
     results = prediction_df[["target_country"]].copy()
     results["score"] = norm_scores.values
@@ -129,7 +159,9 @@ def predict_custom_song(
 
     # Exclude origin countries (song already charts there)
     if origin_countries:
-        candidates = results[~results["target_country"].isin(origin_countries)].copy()
+        target_codes = encode_countries(results["target_country"])
+        in_origin = codes_in_mask(target_codes, countries_to_mask(origin_countries))
+        candidates = results[~in_origin].copy()
     else:
         candidates = results.copy()
     candidates = candidates.reset_index(drop=True)
@@ -139,4 +171,111 @@ def predict_custom_song(
         "top_k": candidates.head(top_k),
         "all_scores": candidates,
         "timing_ms": elapsed_ms,
+        "contributions": contributions,
+        "explain_ms": explain_ms,
     }
+
+
+# ---------------------------------------------------------------------------
+# What-if footprint sweep
+# ---------------------------------------------------------------------------
+
+DEFAULT_SWEEP_RANK = 50
+
+
+def footprint_extensions(
+    chart_footprint: list[dict],
+    countries: list[str] | None = None,
+    ranks: list[int] | None = None,
+) -> list[tuple[str, int]]:
+    """(country, rank) pairs to add to the footprint, one variant each.
+
+    Defaults to every country not already charting, at DEFAULT_SWEEP_RANK.
+    A country already in the footprint can be swept to a different rank.
+    """
+    charting = {entry["country"] for entry in chart_footprint}
+    if countries is None:
+        countries = [c for c in COUNTRY_LIST if c not in charting]
+    return [(country, int(rank)) for country in countries for rank in (ranks or [DEFAULT_SWEEP_RANK])]
+
+
+def sweep_footprint_extensions(
+    models: dict,
+    song_input: dict,
+    reference_data: dict,
+    artist_info: dict,
+    extensions: list[tuple[str, int]] | None = None,
+    feature_cols: list[str] | None = None,
+    fill_values: dict | None = None,
+    sparse: bool | None = None,
+    target_transform: str | None = None,
+) -> dict:
+    """Score the song with each footprint extension in one stacked model call.
+
+    Every variant's 62 rows (plus the unchanged baseline) are built with
+    build_prediction_rows and scored by a single ranker and regressor
+    predict over the stacked matrix. Deltas are taken on the raw ranker
+    score, since normalized scores are rescaled per variant.
+    Returns dict with long-format 'deltas' (added_country, added_rank,
+    target_country, score_delta, days_delta; NaN where the target charts in
+    the variant), the 'baseline' scores, and 'timing_ms'.
+    """
+    if feature_cols is None:
+        feature_cols = PRUNED_ROW_FEATURE_COLS
+    if fill_values is None:
+        fill_values = FILL_VALUES_FINAL
+    if target_transform is None:
+        target_transform = regressor_target_transform()
+    base_footprint = song_input.get("chart_footprint", [])
+    if extensions is None:
+        extensions = footprint_extensions(base_footprint)
+
+    t0 = time.time()
+
+    footprints = [base_footprint] + [
+        [e for e in base_footprint if e["country"] != country] + [{"country": country, "rank": rank}]
+        for country, rank in extensions
+    ]
+    stacked = pd.concat(
+        [
+            build_prediction_rows({**song_input, "chart_footprint": footprint}, reference_data, artist_info)
+            for footprint in footprints
+        ],
+        ignore_index=True,
+    )
+    ranker, regressor = models["ranker"], models["regressor"]
+    n_variants, n_targets = len(footprints), len(stacked) // len(footprints)
+    raw_scores = ranker.predict(
+        model_feature_matrix(ranker, stacked, feature_cols, fill_values, sparse)
+    ).reshape(n_variants, n_targets)
+    days = np.clip(
+        inverse_transform_target(
+            regressor.predict(model_feature_matrix(regressor, stacked, feature_cols, fill_values, sparse)), target_transform,
+        ),
+        1.0, 60.0,
+    ).reshape(n_variants, n_targets)
+
+    elapsed_ms = (time.time() - t0) * 1000
+
+    targets = stacked["target_country"].iloc[:n_targets].to_numpy()
+    target_codes = encode_countries(targets)
+    charting = np.stack([
+        codes_in_mask(target_codes, countries_to_mask({e["country"] for e in footprint}))
+        for footprint in footprints[1:]
+    ]) if extensions else np.zeros((0, n_targets), dtype=bool)
+    score_delta = np.where(charting, np.nan, raw_scores[1:] - raw_scores[0])
+    days_delta = np.where(charting, np.nan, days[1:] - days[0])
+
+    deltas = pd.DataFrame({
+        "added_country": np.repeat([country for country, _ in extensions], n_targets),
+        "added_rank": np.repeat([rank for _, rank in extensions], n_targets),
+        "target_country": np.tile(targets, len(extensions)),
+        "score_delta": score_delta.ravel(),
+        "days_delta": days_delta.ravel(),
+    })
+    baseline = pd.DataFrame({
+        "target_country": targets,
+        "raw_score": raw_scores[0],
+        "predicted_days_to_entry": days[0],
+    })
+    return {"deltas": deltas, "baseline": baseline, "timing_ms": elapsed_ms, "n_variants": len(extensions)}
@@ -0,0 +1,130 @@
+"""Cold-start profiling for the Streamlit app.
+
+In-app: set ``APP_PROFILE=1`` and the first script run of each process
+reports time to first render and the modules it imported (sidebar + stderr).
+
+Offline: ``python -m src.profiling`` imports each view in a fresh interpreter
+under ``-X importtime`` and prints the import cost per top-level package,
+then runs the app headless (streamlit AppTest) per mode to time the first
+render.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+PROFILE_ENV = "APP_PROFILE"
+VIEW_MODULES = {"Demo": "views.demo", "Production": "views.production"}
+
+_process_profiled = False
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "") not in ("", "0")
+
+
+class FirstRenderTimer:
+    """Times one script run and the modules it newly imported.
+
+    Only the first run in a process reports; later reruns are warm.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.modules_before = set(sys.modules)
+
+    def report(self, mode: str) -> str | None:
+        global _process_profiled
+        if _process_profiled:
+            return None
+        _process_profiled = True
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        new_modules = set(sys.modules) - self.modules_before
+        heavy = sorted({m.split(".")[0] for m in new_modules} & {"duckdb", "xgboost", "sklearn", "scipy", "pyarrow"})
+        message = (
+            f"[cold start] {mode}: first render {elapsed_ms:.0f} ms, "
+            f"{len(new_modules)} modules imported ({', '.join(heavy) or 'no heavy deps'})"
+        )
+        print(message, file=sys.stderr)
+        return message
+
+
+# ---------------------------------------------------------------------------
+# Offline profile
+# ---------------------------------------------------------------------------
+
+def import_time_breakdown(module: str) -> tuple[float, dict[str, float]]:
+    """Cold-import ``module`` in a subprocess. Returns (total ms, self ms per top-level package)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=_project_root(),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+    per_package: dict[str, float] = defaultdict(float)
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        per_package[name.strip().split(".")[0]] += int(self_us) / 1000
+        if not name[1:].startswith(" "):  # top-level import (no nesting indent)
+            total_us += int(cumulative_us)
+    return total_us / 1000, dict(per_package)
+
+
+def headless_first_render_ms(mode: str) -> float:
+    """Run app.py once in a fresh interpreter with ``mode`` selected; wall time in ms."""
+    script = (
+        "import json, time; t0 = time.perf_counter()\n"
+        "from streamlit.testing.v1 import AppTest\n"
+        "at = AppTest.from_file('app.py', default_timeout=600)\n"
+        "at.run()\n"
+        f"if {mode!r} != 'Demo':\n"
+        f"    at.sidebar.radio[0].set_value({mode!r}).run()\n"
+        "errors = [e.value.splitlines()[0] for e in at.exception]\n"
+        "print(json.dumps({'ms': (time.perf_counter() - t0) * 1000, 'errors': errors}))\n"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, cwd=_project_root(),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    if result["errors"]:
+        raise RuntimeError(result["errors"][0])
+    return result["ms"]
+
+
+def _project_root() -> str:
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Profile app cold start: import costs and first render.")
+    parser.add_argument("--modes", nargs="+", default=list(VIEW_MODULES), choices=list(VIEW_MODULES))
+    parser.add_argument("--top", type=int, default=10, help="Packages to list per view")
+    parser.add_argument("--skip-render", action="store_true", help="Only measure imports")
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        module = VIEW_MODULES[mode]
+        total_ms, per_package = import_time_breakdown(module)
+        print(f"\n{mode} ({module}): cold import {total_ms:.0f} ms")
+        for package, ms in sorted(per_package.items(), key=lambda kv: -kv[1])[: args.top]:
+            print(f"  {package:24s} {ms:8.1f} ms")
+        if not args.skip_render:
+            try:
+                print(f"  first render (headless): {headless_first_render_ms(mode):.0f} ms")
+            except RuntimeError as e:
+                print(f"  first render (headless) failed: {e}")
+
+
+if __name__ == "__main__":
+    main()
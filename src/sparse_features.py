@@ -0,0 +1,281 @@
+"""Sparse CSR feature matrices for the mostly-zero ``rank_*`` footprint columns.
+
+61 of the 102 features are ``rank_<country>``, and a track charts in a
+handful of countries, so nearly all of them are 0. Here a feature matrix
+is a ``scipy.sparse.csr_matrix`` (columns in ``feature_cols`` order) that
+stores, per row, only the non-zero ranks plus every other feature:
+
+- a rank of 0 (not charting) is *not stored*, and XGBoost reads an absent
+  entry as missing, so in this encoding "not charting" is "missing";
+- the dense features are always stored, zeros included, so a 0 flag or
+  count stays a value (``csr_matrix(dense)`` would silently drop them).
+
+Models trained on these matrices learn the missing direction for "not
+charting" and must be scored the same way. A model trained on dense
+matrices scores identically only if every split on a rank feature sends
+0 and missing the same way; ``sparse_incompatible_features`` checks that.
+
+``sparse_feature_matrix`` converts a wide frame (a v3 split or
+build_prediction_rows output); ``factorized_sparse_matrix`` goes straight
+from a ``src.factorized`` split, gathering per-track CSR rows without a
+dense rank block. ``python -m src.sparse_features bench`` compares memory
+and speed against the dense ``make_feature_matrix`` path.
+
+Training with ``--sparse`` (``src.training``, ``src.external_memory``)
+marks the saved boosters with ``feature_encoding = "sparse"``, and scoring
+goes through ``model_feature_matrix``, which builds the encoding the model
+was trained on. A dense-trained model is only scored on CSR matrices when
+asked to and ``sparse_incompatible_features`` is empty.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+import weakref
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.config import COUNTRY_LIST, DATA_DIR, country_to_rank_col
+
+RANK_COLS = [country_to_rank_col(c) for c in COUNTRY_LIST]
+FEATURE_ENCODING_ATTR = "feature_encoding"
+
+
+def split_feature_cols(feature_cols: list[str]) -> tuple[list[str], list[str]]:
+    """(rank columns, dense columns) of feature_cols, each in feature_cols order."""
+    ranks = set(RANK_COLS)
+    return [c for c in feature_cols if c in ranks], [c for c in feature_cols if c not in ranks]
+
+
+def assemble_csr(rank_block, dense: np.ndarray, feature_cols: list[str]):
+    """Interleave a CSR rank block (columns = rank columns of feature_cols, in
+    order) and a dense block (the other columns, in order) into one CSR
+    matrix over feature_cols, with every dense entry stored.
+    """
+    from scipy import sparse
+
+    rank_cols, dense_cols = split_feature_cols(feature_cols)
+    position = {col: j for j, col in enumerate(feature_cols)}
+    rank_position = np.array([position[c] for c in rank_cols], dtype=np.int32)
+    dense_position = np.array([position[c] for c in dense_cols], dtype=np.int32)
+
+    n, d = dense.shape
+    rank_block = sparse.csr_matrix(rank_block)
+    rank_block.eliminate_zeros()
+    per_row = np.diff(rank_block.indptr)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(per_row + d, out=indptr[1:])
+    data = np.empty(indptr[-1], dtype=np.float32)
+    indices = np.empty(indptr[-1], dtype=np.int32)
+
+    # Rank entries first in each row, then the dense entries
+    rows = np.repeat(np.arange(n), per_row)
+    dest = indptr[rows] + (np.arange(len(rows)) - rank_block.indptr[rows])
+    data[dest] = rank_block.data
+    indices[dest] = rank_position[rank_block.indices]
+    dest = (indptr[:-1] + per_row)[:, None] + np.arange(d)
+    data[dest] = dense
+    indices[dest] = dense_position
+
+    X = sparse.csr_matrix((data, indices, indptr), shape=(n, len(feature_cols)))
+    X.sort_indices()
+    return X
+
+
+def sparse_feature_matrix(df: pd.DataFrame, feature_cols: list[str], fill_values: dict | pd.Series):
+    """CSR counterpart of make_feature_matrix for a wide frame."""
+    rank_cols, dense_cols = split_feature_cols(feature_cols)
+    ranks = df[rank_cols].to_numpy(dtype=np.float32, na_value=0.0)
+    dense = df[dense_cols].fillna(fill_values).to_numpy(dtype=np.float32, na_value=np.nan)
+    return assemble_csr(ranks, dense, feature_cols)
+
+
+def csr_from_filled(X: np.ndarray, feature_cols: list[str]):
+    """CSR encoding of an already-filled dense array over feature_cols (e.g.
+    cached fold arrays): rank zeros become absent, everything else is stored.
+    """
+    rank_cols, dense_cols = split_feature_cols(feature_cols)
+    position = {col: j for j, col in enumerate(feature_cols)}
+    X = np.asarray(X, dtype=np.float32)
+    return assemble_csr(
+        X[:, [position[c] for c in rank_cols]], X[:, [position[c] for c in dense_cols]], feature_cols,
+    )
+
+
+def factorized_sparse_matrix(
+    split, feature_cols: list[str], fill_values: dict | pd.Series, rows: np.ndarray | None = None,
+):
+    """CSR features for a FactorizedSplit's pair rows (all, or positions
+    ``rows``): each pair gathers its track's sparse footprint row.
+    """
+    from scipy import sparse
+
+    rank_cols, dense_cols = split_feature_cols(feature_cols)
+    track_ranks = sparse.csr_matrix(split.tracks[rank_cols].to_numpy(dtype=np.float32, na_value=0.0))
+    track_row = split.track_row if rows is None else split.track_row[rows]
+    dense = split.feature_matrix(dense_cols, fill_values, rows)
+    return assemble_csr(track_ranks[track_row], dense, feature_cols)
+
+
+def sparse_incompatible_features(model, feature_cols: list[str]) -> list[str]:
+    """Rank features on which some split sends 0 and missing to different
+    children. Empty: the model scores CSR and dense matrices identically.
+    """
+    trees = _booster(model).trees_to_dataframe()
+    splits = trees[trees["Feature"] != "Leaf"]
+    names = splits["Feature"].map(
+        lambda f: feature_cols[int(f[1:])] if f[0] == "f" and f[1:].isdigit() and f not in feature_cols else f
+    )
+    is_rank = names.isin(RANK_COLS).to_numpy()
+    zero_left = (0.0 < splits["Split"].astype(float)).to_numpy()
+    missing_left = (splits["Missing"] == splits["Yes"]).to_numpy()
+    return sorted(set(names[is_rank & (zero_left != missing_left)]))
+
+
+def _booster(model):
+    return model.get_booster() if hasattr(model, "get_booster") else model
+
+
+def mark_sparse(model) -> None:
+    """Record on the booster (saved with the model) that it was trained on CSR features."""
+    _booster(model).set_attr(**{FEATURE_ENCODING_ATTR: "sparse"})
+
+
+def is_sparse_model(model) -> bool:
+    return _booster(model).attr(FEATURE_ENCODING_ATTR) == "sparse"
+
+
+_sparse_compatible: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def model_feature_matrix(
+    model, df: pd.DataFrame, feature_cols: list[str], fill_values: dict | pd.Series, sparse: bool | None = None,
+):
+    """Features for scoring df with model: the sparse encoding for a
+    sparse-trained model, the dense frame otherwise. ``sparse=True`` scores a
+    dense-trained model in the sparse encoding, allowed only when
+    sparse_incompatible_features is empty (checked once per model); a
+    sparse-trained model cannot be scored dense.
+
+    The sparse encoding is a CSR matrix, except for boosters that validate
+    feature names: they get the frame with unstored ranks as NaN, which
+    XGBoost reads as missing exactly like an absent CSR entry.
+    """
+    trained_sparse = is_sparse_model(model)
+    if sparse is None:
+        sparse = trained_sparse
+    if trained_sparse and not sparse:
+        raise ValueError("model was trained on sparse rank features and must be scored on CSR matrices")
+    if sparse and not trained_sparse:
+        if model not in _sparse_compatible:
+            _sparse_compatible[model] = not sparse_incompatible_features(model, feature_cols)
+        if not _sparse_compatible[model]:
+            raise ValueError("dense-trained model splits 0 and missing rank values apart; score it dense")
+    if sparse and _booster(model).feature_names is None:
+        return sparse_feature_matrix(df, feature_cols, fill_values)
+    from src.data import make_feature_matrix
+
+    X = make_feature_matrix(df, feature_cols, fill_values)
+    if sparse:
+        rank_cols, _ = split_feature_cols(feature_cols)
+        ranks = df[rank_cols]
+        X[rank_cols] = ranks.where(ranks.fillna(0) != 0)
+    return X
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+def _csr_bytes(X) -> int:
+    return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+
+
+def _timed(fn, repeat: int = 3):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+
+def benchmark(split: str = "test", data_dir=DATA_DIR, model=None) -> dict:
+    """Memory and timings of the dense and CSR paths on one v3 split."""
+    import xgboost as xgb
+
+    from src.config import FILL_VALUES_FINAL, PRUNED_ROW_FEATURE_COLS
+    from src.data import load_row_level_split, make_feature_matrix
+    from src.factorized import FactorizedSplit
+
+    feature_cols, fill = PRUNED_ROW_FEATURE_COLS, FILL_VALUES_FINAL
+    split_path = data_dir / f"{split}.parquet"
+    df = load_row_level_split(split_path)
+    factorized = FactorizedSplit.load(split_path)
+
+    X_dense, t_dense = _timed(lambda: make_feature_matrix(df, feature_cols, fill))
+    X_sparse, t_sparse = _timed(lambda: sparse_feature_matrix(df, feature_cols, fill))
+    X_factorized, t_factorized = _timed(lambda: factorized_sparse_matrix(factorized, feature_cols, fill))
+    dm_dense, t_dm_dense = _timed(lambda: xgb.DMatrix(X_dense))
+    dm_sparse, t_dm_sparse = _timed(lambda: xgb.DMatrix(X_sparse))
+
+    rank_cols, _ = split_feature_cols(feature_cols)
+    report = {
+        "rows": len(df),
+        "features": len(feature_cols),
+        "rank_features": len(rank_cols),
+        "rank_density": float((df[rank_cols].to_numpy() != 0).mean()),
+        "dense_mb": X_dense.memory_usage(index=False).sum() / 1e6,
+        "dense_float32_mb": len(df) * len(feature_cols) * 4 / 1e6,
+        "csr_mb": _csr_bytes(X_sparse) / 1e6,
+        # DMatrix pages hold (feature index, value) pairs for present entries only
+        "dmatrix_dense_mb": dm_dense.num_nonmissing() * 8 / 1e6,
+        "dmatrix_csr_mb": dm_sparse.num_nonmissing() * 8 / 1e6,
+        "build_dense_ms": t_dense * 1000,
+        "build_csr_ms": t_sparse * 1000,
+        "build_csr_factorized_ms": t_factorized * 1000,
+        "dmatrix_dense_ms": t_dm_dense * 1000,
+        "dmatrix_csr_ms": t_dm_sparse * 1000,
+    }
+    # Absent entries densify to 0, so the CSR matrix must equal the dense one
+    sample = slice(0, 50_000)
+    report["csr_matches_dense"] = bool(np.array_equal(
+        X_sparse[sample].toarray(), X_dense.iloc[sample].to_numpy(dtype=np.float32), equal_nan=True,
+    ))
+    order_match = factorized.frame()[["track_id", "target_country"]].equals(df[["track_id", "target_country"]])
+    report["factorized_matches"] = bool(order_match and (X_factorized != X_sparse).nnz == 0)
+
+    if model is not None:
+        scores_dense, t_pred_dense = _timed(lambda: model.predict(X_dense))
+        scores_sparse, t_pred_sparse = _timed(lambda: model.predict(X_sparse))
+        report.update({
+            "predict_dense_ms": t_pred_dense * 1000,
+            "predict_csr_ms": t_pred_sparse * 1000,
+            "incompatible_rank_features": len(sparse_incompatible_features(model, feature_cols)),
+            "max_score_diff": float(np.abs(scores_dense - scores_sparse).max()),
+        })
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sparse CSR feature path for the rank_* columns.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Compare memory and speed with the dense make_feature_matrix path")
+    bench.add_argument("--split", default="test")
+    bench.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    bench.add_argument("--no-model", action="store_true", help="Skip scoring with the stage-2 ranker")
+    args = parser.parse_args()
+
+    model = None
+    if not args.no_model:
+        from src.models import load_pretrained_models
+        model = load_pretrained_models()["ranker"]
+    for key, value in benchmark(args.split, args.data_dir, model).items():
+        print(f"  {key:28s} {value:>12,.3f}" if isinstance(value, float) else f"  {key:28s} {value!s:>12}")
+
+
+if __name__ == "__main__":
+    main()
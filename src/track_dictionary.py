@@ -0,0 +1,150 @@
+"""Track dictionary: track_id → int code, title, artist, first chart date/region.
+
+Built once from v2 into ``datasets/track_dictionary.parquet`` (sorted by
+track_id, so a track's code is its row position) plus a memory-mapped hash
+index (``track_dictionary.idx.npy``: 64-bit track_id hashes sorted, with the
+row each belongs to). Lookups are a vectorized binary search over the index
+and never touch v2. Run ``python -m src.track_dictionary`` after v2 changes;
+loaders rebuild a stale dictionary when v2 is present and use it as-is when
+it is not.
+"""
+
+from __future__ import annotations
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from src.artifacts import read_fresh_parquet, source_fingerprint, v2_files, write_fingerprinted_parquet
+from src.config import TRACK_DICTIONARY_PATH, TRACK_INDEX_PATH, V2_DATA_DIR
+
+INDEX_DTYPE = np.dtype([("hash", np.uint64), ("code", np.int32)])
+
+
+def hash_track_ids(track_ids) -> np.ndarray:
+    # hash_array uses a fixed key, so hashes agree across processes and runs.
+    return pd.util.hash_array(np.asarray(track_ids, dtype=object), categorize=False)
+
+
+def query_track_dictionary() -> pd.DataFrame:
+    """One row per v2 track; first chart date and region come from top200."""
+    import duckdb
+
+    con = duckdb.connect()
+    v2 = f"read_parquet('{V2_DATA_DIR.as_posix()}/*/*.parquet')"
+    df = con.execute(
+        f"""
+        SELECT
+            track_id,
+            FIRST(title ORDER BY date, region) AS title,
+            FIRST(artist ORDER BY date, region) AS artist,
+            MIN(date) FILTER (WHERE chart = 'top200') AS first_chart_date,
+            FIRST(region ORDER BY date, region) FILTER (WHERE chart = 'top200') AS first_region
+        FROM {v2}
+        GROUP BY track_id
+        ORDER BY track_id
+        """
+    ).fetchdf()
+    con.close()
+    df.insert(0, "track_code", np.arange(len(df), dtype=np.int32))
+    return df
+
+
+def build_index(track_ids) -> np.ndarray:
+    index = np.empty(len(track_ids), dtype=INDEX_DTYPE)
+    index["hash"] = hash_track_ids(track_ids)
+    index["code"] = np.arange(len(track_ids), dtype=np.int32)
+    index.sort(order="hash", kind="stable")
+    return index
+
+
+class TrackDictionary:
+    """Track metadata frame (row position == track_code) with a hash index."""
+
+    def __init__(self, frame: pd.DataFrame, index: np.ndarray):
+        self.frame = frame
+        self.index = index
+        self._track_ids = frame["track_id"].to_numpy(dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def codes(self, track_ids) -> np.ndarray:
+        """track_ids -> int32 track codes (-1 where unknown)."""
+        track_ids = np.asarray(track_ids, dtype=object)
+        hashes = hash_track_ids(track_ids)
+        pos = np.searchsorted(self.index["hash"], hashes)
+        pos_clipped = np.minimum(pos, max(len(self.index) - 1, 0))
+        codes = np.full(len(track_ids), -1, dtype=np.int32)
+        if not len(self.index):
+            return codes
+        found = self.index["hash"][pos_clipped] == hashes
+        codes[found] = self.index["code"][pos_clipped[found]]
+        # Resolve the (vanishingly rare) 64-bit collisions by scanning the run.
+        clash = found & (self._track_ids[np.maximum(codes, 0)] != track_ids)
+        for i in np.flatnonzero(clash):
+            codes[i] = -1
+            j = pos[i]
+            while j < len(self.index) and self.index["hash"][j] == hashes[i]:
+                code = self.index["code"][j]
+                if self._track_ids[code] == track_ids[i]:
+                    codes[i] = code
+                    break
+                j += 1
+        return codes
+
+    def lookup(self, track_ids, columns: list[str] | None = None) -> pd.DataFrame:
+        """Rows for the given track_ids in input order (all-NaN where unknown)."""
+        rows = self.frame.reindex(self.codes(track_ids)).reset_index(drop=True)
+        return rows if columns is None else rows[columns]
+
+    def names(self) -> pd.DataFrame:
+        return self.frame[["track_id", "title", "artist"]]
+
+
+def track_dictionary_fingerprint() -> str:
+    return source_fingerprint(v2_files())
+
+
+def build_track_dictionary() -> TrackDictionary:
+    frame = query_track_dictionary()
+    write_fingerprinted_parquet(frame, TRACK_DICTIONARY_PATH, track_dictionary_fingerprint())
+    index = build_index(frame["track_id"].to_numpy(dtype=object))
+    tmp_path = TRACK_INDEX_PATH.with_name(TRACK_INDEX_PATH.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, index)
+    tmp_path.replace(TRACK_INDEX_PATH)
+    return TrackDictionary(frame, index)
+
+
+def load_track_dictionary() -> TrackDictionary:
+    """Memory-map the dictionary and its index, rebuilding them if v2 changed.
+
+    Without a local v2 copy (e.g. a Demo-only deployment) an existing
+    dictionary is used as shipped.
+    """
+    if TRACK_DICTIONARY_PATH.exists() and not v2_files():
+        frame = read_fresh_parquet(TRACK_DICTIONARY_PATH, fingerprint=None)
+    else:
+        frame = read_fresh_parquet(TRACK_DICTIONARY_PATH, track_dictionary_fingerprint())
+    if frame is None or not TRACK_INDEX_PATH.exists():
+        return build_track_dictionary()
+    return TrackDictionary(frame, np.load(TRACK_INDEX_PATH, mmap_mode="r"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the track dictionary and hash index from v2.")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the dictionary is fresh")
+    args = parser.parse_args()
+
+    fresh = read_fresh_parquet(TRACK_DICTIONARY_PATH, track_dictionary_fingerprint())
+    if args.force or fresh is None or not TRACK_INDEX_PATH.exists():
+        dictionary = build_track_dictionary()
+        print(f"Wrote {TRACK_DICTIONARY_PATH} and {TRACK_INDEX_PATH.name} ({len(dictionary)} tracks)")
+    else:
+        print(f"{TRACK_DICTIONARY_PATH} is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,836 @@
+"""Headless training of the stage 1/2/3 models (notebook 05, headless).
+
+Runs the notebook's temporal-CV Optuna searches and final fits and writes
+the same artifacts to a model directory: ``stage2_country_ranker.json``,
+``stage3_days_to_entry_regressor.json``, the stage-1 will-spread classifier
+and calibrator, the linear baselines and ``training_summary.json`` (same
+layout, including ``pruned_row_feature_cols`` and both fill-value sets, so
+the app picks a retrained directory up unchanged).
+
+Every trial trains on the same folds with the same fold-median fills, so
+the fold matrices do not depend on the trial. They are built once per
+(stage, split file, feature list, time blocks): the filled float32 arrays,
+labels and ranker group sizes are cached under ``TRAINING_CACHE_DIR`` as
+``.npy`` files, and each process turns them into one train/val
+``QuantileDMatrix`` pair per fold (the val matrix sharing the train
+quantile cuts) that all trials reuse. XGBoost cannot serialize a
+QuantileDMatrix itself, so the arrays are what goes to disk; a warm cache
+skips the pandas filtering, sorting and filling entirely. Trial metrics are
+computed on the cached arrays (``grouped_ranking_metrics`` for ndcg@5)
+instead of rebuilding scored frames.
+
+With ``--sparse`` the ranker and regressor train (searches included) on
+CSR matrices from ``src.sparse_features``, where a rank of 0 is missing;
+the saved boosters are marked so scoring builds the same encoding.
+
+Searches can run in a process pool (``--workers``) sharing an Optuna
+SQLite or journal-file storage, each worker using cores / workers XGBoost
+threads. Every PRUNING_INTERVAL boosting rounds a trial reports its fold's
+validation ndcg@5 / MAE in days / aucpr, so the median or Hyperband pruner
+stops unpromising trials mid-fold rather than after whole folds.
+
+    python -m src.training fit [--out DIR] [--ranker-trials 50] [--workers 4] [--sparse] ...
+    python -m src.training folds      # build the fold caches only
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from src.artifacts import source_fingerprint
+from src.config import DATA_DIR, MODEL_DIR, RANDOM_STATE, TOP_K, TRAINING_CACHE_DIR
+from src.data import (
+    FEATURE_EXCLUDE,
+    load_row_level_split,
+    load_track_level_split,
+    make_feature_matrix,
+    prepare_ranker_inputs,
+)
+from src.metrics import choose_recall_threshold, grouped_ranking_metrics, regression_metrics
+from src.sparse_features import csr_from_filled, mark_sparse, sparse_feature_matrix
+
+# --- Notebook 05 configuration ---
+RANKER_N_TRIALS = 50
+CLASSIFIER_N_TRIALS = 30
+REGRESSOR_N_TRIALS = 30
+TIME_BLOCKS = 5
+OPTUNA_N_STARTUP_TRIALS = 10
+FINAL_N_ESTIMATOR_BUFFER = 1.10
+PRIMARY_PRECISION_FLOOR = 0.20
+BUSINESS_PRECISION_FLOORS = [0.20, 0.25]
+TRACK_FEATURE_EXCLUDE = ["track_id", "observation_time", "will_spread", "min_days_to_spread"]
+
+# Fixed XGBoost settings per stage; Optuna tunes the rest. pruning_metric is
+# the per-round validation metric reported to the pruner.
+STAGES = {
+    "ranker": {
+        "objective": "rank:ndcg", "eval_metric": f"ndcg@{TOP_K}", "direction": "maximize",
+        "n_estimators": 2000, "early_stopping_rounds": 50, "pruning_metric": f"ndcg@{TOP_K}",
+    },
+    "regressor": {
+        "objective": "reg:squarederror", "eval_metric": "mae", "direction": "minimize",
+        "n_estimators": 800, "early_stopping_rounds": 30, "pruning_metric": "mae_days",
+    },
+    "classifier": {
+        "objective": "binary:logistic", "eval_metric": "aucpr", "direction": "maximize",
+        "n_estimators": 500, "early_stopping_rounds": 30, "pruning_metric": "aucpr",
+    },
+}
+# Intermediate values are written to the study storage every PRUNING_INTERVAL rounds
+PRUNING_INTERVAL = 10
+PRUNERS = ("median", "hyperband", "none")
+
+
+# ---------------------------------------------------------------------------
+# Search spaces
+# ---------------------------------------------------------------------------
+
+def suggest_ranker_params(trial) -> dict:
+    return {
+        "learning_rate": trial.suggest_float("learning_rate", 0.01, 0.15, log=True),
+        "max_depth": trial.suggest_int("max_depth", 4, 12),
+        "min_child_weight": trial.suggest_float("min_child_weight", 1.0, 100.0, log=True),
+        "subsample": trial.suggest_float("subsample", 0.6, 1.0),
+        "colsample_bytree": trial.suggest_float("colsample_bytree", 0.5, 1.0),
+        "gamma": trial.suggest_float("gamma", 0.0, 5.0),
+        "reg_alpha": trial.suggest_float("reg_alpha", 1e-4, 10.0, log=True),
+        "reg_lambda": trial.suggest_float("reg_lambda", 0.1, 20.0, log=True),
+    }
+
+
+def suggest_regressor_params(trial) -> tuple[str, dict]:
+    target_transform = trial.suggest_categorical("target_transform", ["identity", "log1p", "sqrt"])
+    return target_transform, {
+        "learning_rate": trial.suggest_float("learning_rate", 0.01, 0.15, log=True),
+        "max_depth": trial.suggest_int("max_depth", 3, 10),
+        "min_child_weight": trial.suggest_float("min_child_weight", 1.0, 50.0, log=True),
+        "subsample": trial.suggest_float("subsample", 0.6, 1.0),
+        "colsample_bytree": trial.suggest_float("colsample_bytree", 0.5, 1.0),
+        "reg_alpha": trial.suggest_float("reg_alpha", 1e-4, 10.0, log=True),
+        "reg_lambda": trial.suggest_float("reg_lambda", 0.1, 20.0, log=True),
+    }
+
+
+def suggest_classifier_params(trial) -> dict:
+    return {
+        "learning_rate": trial.suggest_float("learning_rate", 0.01, 0.15, log=True),
+        "max_depth": trial.suggest_int("max_depth", 3, 8),
+        "min_child_weight": trial.suggest_float("min_child_weight", 1.0, 50.0, log=True),
+        "scale_pos_weight": trial.suggest_float("scale_pos_weight", 0.5, 10.0),
+        "max_delta_step": trial.suggest_int("max_delta_step", 0, 5),
+        "subsample": trial.suggest_float("subsample", 0.6, 1.0),
+        "colsample_bytree": trial.suggest_float("colsample_bytree", 0.5, 1.0),
+        "reg_alpha": trial.suggest_float("reg_alpha", 1e-4, 10.0, log=True),
+        "reg_lambda": trial.suggest_float("reg_lambda", 0.1, 20.0, log=True),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Temporal CV folds
+# ---------------------------------------------------------------------------
+
+def make_temporal_folds(df: pd.DataFrame, time_blocks: int = TIME_BLOCKS) -> list[dict]:
+    """Expanding-window folds: tracks ordered by observation time are cut into
+    ``time_blocks`` equal blocks; fold b validates on block b and trains on
+    every earlier block, for b >= 2.
+    """
+    track_times = df[["track_id", "observation_time"]].drop_duplicates().sort_values(
+        ["observation_time", "track_id"]
+    ).reset_index(drop=True)
+    track_times["time_block"] = pd.qcut(track_times.index, q=time_blocks, labels=False, duplicates="drop")
+    folds = []
+    unique_blocks = sorted(track_times["time_block"].dropna().astype(int).unique())
+    for fold_idx, block in enumerate(unique_blocks[2:], start=1):
+        train_times = track_times[track_times["time_block"] < block]
+        val_times = track_times[track_times["time_block"] == block]
+        if train_times.empty or val_times.empty:
+            continue
+        folds.append({
+            "fold": fold_idx,
+            "train_track_ids": train_times["track_id"].tolist(),
+            "val_track_ids": val_times["track_id"].tolist(),
+            "train_tracks": len(train_times),
+            "val_tracks": len(val_times),
+            "train_start": str(train_times["observation_time"].min().date()),
+            "train_end": str(train_times["observation_time"].max().date()),
+            "val_start": str(val_times["observation_time"].min().date()),
+            "val_end": str(val_times["observation_time"].max().date()),
+        })
+    return folds
+
+
+class FoldMatrices:
+    """One fold's filled train/val arrays and, built on first use, the
+    QuantileDMatrix pair every trial trains and evaluates on (from CSR
+    matrices over ``sparse_cols`` when set).
+    """
+
+    def __init__(self, info: dict, arrays: dict[str, np.ndarray], path: Path | None = None):
+        self.info = info
+        self.arrays = arrays
+        self.path = path
+        self.sparse_cols: list[str] | None = None
+        self._dmatrices = None
+
+    @classmethod
+    def build(cls, stage: str, train_part: pd.DataFrame, val_part: pd.DataFrame,
+              feature_cols: list[str], info: dict) -> FoldMatrices:
+        fill = train_part[feature_cols].median(numeric_only=True)
+        arrays = {}
+        if stage == "ranker":
+            _, X_train, arrays["train_y"], arrays["train_group"] = prepare_ranker_inputs(train_part, feature_cols, fill)
+            ordered_val, X_val, arrays["val_y"], arrays["val_group"] = prepare_ranker_inputs(val_part, feature_cols, fill)
+            arrays["val_tie_break"] = ordered_val["target_new_entry_rate_30d"].fillna(0.0).to_numpy(dtype=float)
+        else:
+            label = "days_to_entry" if stage == "regressor" else "will_spread"
+            X_train = make_feature_matrix(train_part, feature_cols, fill)
+            X_val = make_feature_matrix(val_part, feature_cols, fill)
+            arrays["train_y"] = train_part[label].to_numpy(dtype=float)
+            arrays["val_y"] = val_part[label].to_numpy(dtype=float)
+        arrays["train_X"] = X_train.to_numpy(dtype=np.float32, na_value=np.nan)
+        arrays["val_X"] = X_val.to_numpy(dtype=np.float32, na_value=np.nan)
+        return cls(info, arrays)
+
+    def save(self, path: Path) -> None:
+        tmp_dir = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        for name, values in self.arrays.items():
+            np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(values))
+        with open(tmp_dir / "fold.json", "w") as f:
+            json.dump(self.info, f, indent=2)
+        shutil.rmtree(path, ignore_errors=True)
+        tmp_dir.replace(path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path: Path) -> FoldMatrices:
+        with open(path / "fold.json") as f:
+            info = json.load(f)
+        arrays = {p.stem: np.load(p, mmap_mode="r") for p in sorted(path.glob("*.npy"))}
+        return cls(info, arrays, path)
+
+    def dmatrices(self, nthread: int | None = None):
+        if self._dmatrices is None:
+            a = self.arrays
+            train_X, val_X = a["train_X"], a["val_X"]
+            if self.sparse_cols is not None:
+                train_X, val_X = csr_from_filled(train_X, self.sparse_cols), csr_from_filled(val_X, self.sparse_cols)
+            dtrain = xgb.QuantileDMatrix(train_X, label=a["train_y"], group=a.get("train_group"), nthread=nthread)
+            dval = xgb.QuantileDMatrix(
+                val_X, label=a["val_y"], group=a.get("val_group"), ref=dtrain, nthread=nthread,
+            )
+            self._dmatrices = dtrain, dval
+        return self._dmatrices
+
+
+def fold_cache_dir(stage: str, split_path: Path, feature_cols: list[str], time_blocks: int,
+                   cache_dir: Path = TRAINING_CACHE_DIR) -> Path:
+    key = json.dumps([stage, source_fingerprint([split_path]), feature_cols, time_blocks])
+    return cache_dir / f"{stage}_{hashlib.sha256(key.encode()).hexdigest()[:16]}"
+
+
+def load_fold_matrices(stage: str, frame: pd.DataFrame, feature_cols: list[str], split_path: Path,
+                       time_blocks: int = TIME_BLOCKS, cache_dir: Path = TRAINING_CACHE_DIR) -> list[FoldMatrices]:
+    """The stage's CV folds over ``frame``, read from the cache or built and cached."""
+    stage_dir = fold_cache_dir(stage, split_path, feature_cols, time_blocks, cache_dir)
+    folds = []
+    for fold in make_temporal_folds(frame, time_blocks):
+        path = stage_dir / f"fold{fold['fold']}"
+        if (path / "fold.json").exists():
+            folds.append(FoldMatrices.load(path))
+            continue
+        info = {k: v for k, v in fold.items() if not k.endswith("_track_ids")}
+        matrices = FoldMatrices.build(
+            stage,
+            frame[frame["track_id"].isin(fold["train_track_ids"])],
+            frame[frame["track_id"].isin(fold["val_track_ids"])],
+            feature_cols, info,
+        )
+        matrices.save(path)
+        folds.append(matrices)
+    return folds
+
+
+# ---------------------------------------------------------------------------
+# Trials
+# ---------------------------------------------------------------------------
+
+def threads_per_worker(workers: int, threads: int | None = None) -> int:
+    """XGBoost threads per search worker: the cores split evenly across workers."""
+    return threads or max(1, (os.cpu_count() or 1) // workers)
+
+
+class PruningCallback(xgb.callback.TrainingCallback):
+    """Report a fold's per-round validation metric to an Optuna trial and stop
+    the trial when the pruner says so. Steps continue across folds (round r
+    of the i-th fold is step i * n_estimators + r), so all trials report the
+    same step for the same fold and round.
+    """
+
+    def __init__(self, trial, metric: str, step_offset: int, interval: int = PRUNING_INTERVAL):
+        self.trial = trial
+        self.metric = metric
+        self.step_offset = step_offset
+        self.interval = interval
+
+    def after_iteration(self, model, epoch: int, evals_log) -> bool:
+        import optuna
+
+        if epoch % self.interval == 0:
+            step = self.step_offset + epoch
+            self.trial.report(float(evals_log["validation_0"][self.metric][-1]), step)
+            if self.trial.should_prune():
+                raise optuna.TrialPruned(f"pruned at step {step}")
+        return False
+
+
+def _train_fold(stage: str, params: dict, fold: FoldMatrices, trial=None, fold_index: int = 0,
+                nthread: int | None = None, custom_metric=None):
+    """Train on a fold with early stopping on its val matrix; returns
+    (best rounds, val predictions at the best iteration).
+    """
+    settings = STAGES[stage]
+    dtrain, dval = fold.dmatrices(nthread)
+    callbacks = [xgb.callback.EarlyStopping(
+        rounds=settings["early_stopping_rounds"], metric_name=settings["eval_metric"], data_name="validation_0",
+    )]
+    if trial is not None:
+        callbacks.append(PruningCallback(trial, settings["pruning_metric"], fold_index * settings["n_estimators"]))
+    booster = xgb.train(
+        {
+            "objective": settings["objective"], "eval_metric": settings["eval_metric"],
+            "tree_method": "hist", "seed": RANDOM_STATE, **params,
+            **({"nthread": nthread} if nthread else {}),
+        },
+        dtrain,
+        num_boost_round=settings["n_estimators"],
+        evals=[(dval, "validation_0")],
+        custom_metric=custom_metric,
+        callbacks=callbacks,
+        verbose_eval=False,
+    )
+    rounds = booster.best_iteration + 1
+    return rounds, booster.predict(dval, iteration_range=(0, rounds))
+
+
+def ranker_objective(trial, folds: list[FoldMatrices], nthread: int | None = None) -> float:
+    from sklearn.metrics import roc_auc_score
+
+    params = suggest_ranker_params(trial)
+    fold_records = []
+    for fold_index, fold in enumerate(folds):
+        rounds, scores = _train_fold("ranker", params, fold, trial, fold_index, nthread)
+        a = fold.arrays
+        summary = grouped_ranking_metrics(scores, a["val_y"], a["val_group"], a["val_tie_break"], k=TOP_K)
+        fold_records.append({
+            "fold": fold.info["fold"],
+            "best_iteration": rounds,
+            **summary,
+            "roc_auc": float(roc_auc_score(a["val_y"], scores)) if len(np.unique(a["val_y"])) > 1 else None,
+        })
+    trial.set_user_attr("folds", fold_records)
+    trial.set_user_attr("mean_best_iteration", float(np.mean([r["best_iteration"] for r in fold_records])))
+    return float(np.mean([r[f"ndcg@{TOP_K}"] for r in fold_records]))
+
+
+def _mae_days_metric(days: np.ndarray, target_transform: str):
+    """Custom XGBoost metric: clipped MAE in days, so trials with different
+    target transforms report on one scale.
+    """
+    from src.models import inverse_transform_target
+
+    def mae_days(predt: np.ndarray, dmatrix) -> tuple[str, float]:
+        preds = np.clip(inverse_transform_target(predt, target_transform), 1.0, 60.0)
+        return "mae_days", float(np.abs(preds - days).mean())
+
+    return mae_days
+
+
+def regressor_objective(trial, folds: list[FoldMatrices], nthread: int | None = None) -> float:
+    from src.models import transform_target
+
+    target_transform, params = suggest_regressor_params(trial)
+    fold_maes = []
+    for fold_index, fold in enumerate(folds):
+        days = np.asarray(fold.arrays["val_y"])
+        metric = _mae_days_metric(days, target_transform)
+        dtrain, dval = fold.dmatrices(nthread)
+        dtrain.set_label(transform_target(fold.arrays["train_y"], target_transform))
+        dval.set_label(transform_target(days, target_transform))
+        _, raw_preds = _train_fold("regressor", params, fold, trial, fold_index, nthread, metric)
+        fold_maes.append(metric(raw_preds, dval)[1])
+    return float(np.mean(fold_maes))
+
+
+def classifier_objective(trial, folds: list[FoldMatrices], nthread: int | None = None) -> float:
+    from sklearn.metrics import average_precision_score
+
+    params = suggest_classifier_params(trial)
+    fold_aps = []
+    for fold_index, fold in enumerate(folds):
+        _, probs = _train_fold("classifier", params, fold, trial, fold_index, nthread)
+        fold_aps.append(float(average_precision_score(fold.arrays["val_y"], probs)))
+    return float(np.mean(fold_aps))
+
+
+OBJECTIVES = {"ranker": ranker_objective, "regressor": regressor_objective, "classifier": classifier_objective}
+
+
+def make_pruner(name: str, stage: str, n_folds: int):
+    import optuna
+
+    settings = STAGES[stage]
+    if name == "hyperband":
+        return optuna.pruners.HyperbandPruner(
+            min_resource=settings["early_stopping_rounds"], max_resource=n_folds * settings["n_estimators"],
+        )
+    if name == "none":
+        return optuna.pruners.NopPruner()
+    return optuna.pruners.MedianPruner(
+        n_startup_trials=OPTUNA_N_STARTUP_TRIALS, n_warmup_steps=settings["early_stopping_rounds"],
+    )
+
+
+def study_storage(url: str | None):
+    """Optuna storage for an RDB URL (``sqlite:///tuning.db``) or a journal
+    file path; None keeps the study in memory.
+    """
+    if url is None or "://" in url:
+        return url
+    from optuna.storages import JournalStorage
+    from optuna.storages.journal import JournalFileBackend
+
+    Path(url).parent.mkdir(parents=True, exist_ok=True)
+    return JournalStorage(JournalFileBackend(url))
+
+
+def _search_worker(stage: str, fold_dirs: list[str], study_name: str, storage: str, n_trials: int,
+                   seed: int, nthread: int, pruner: str, sparse_cols: list[str] | None = None) -> None:
+    import optuna
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    folds = [FoldMatrices.load(Path(p)) for p in fold_dirs]
+    for fold in folds:
+        fold.sparse_cols = sparse_cols
+    study = optuna.load_study(
+        study_name=study_name, storage=study_storage(storage),
+        sampler=optuna.samplers.TPESampler(seed=seed), pruner=make_pruner(pruner, stage, len(folds)),
+    )
+    objective = OBJECTIVES[stage]
+    study.optimize(lambda trial: objective(trial, folds, nthread), n_trials=n_trials)
+
+
+def run_study(stage: str, folds: list[FoldMatrices], n_trials: int, workers: int = 1,
+              threads: int | None = None, storage: str | None = None, pruner: str = "median",
+              sparse_cols: list[str] | None = None):
+    """Run a stage's search to ``n_trials`` finished trials, on CSR fold
+    matrices over ``sparse_cols`` if given.
+
+    With ``workers > 1`` the trials run in a process pool sharing ``storage``
+    (each worker memory-maps the cached fold arrays and builds its own
+    QuantileDMatrix pairs), with ``threads`` XGBoost threads per worker,
+    by default the cores split evenly. A stored study is named after the
+    fold cache, so a rerun on the same data resumes it.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    import optuna
+
+    if workers > 1 and storage is None:
+        raise ValueError("parallel search needs a shared storage")
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    nthread = threads_per_worker(workers, threads)
+    for fold in folds:
+        fold.sparse_cols = sparse_cols
+    study_name = None
+    if storage is not None:
+        study_name = folds[0].path.parent.name + ("_sparse" if sparse_cols is not None else "")
+    study = optuna.create_study(
+        study_name=study_name, storage=study_storage(storage), load_if_exists=storage is not None,
+        direction=STAGES[stage]["direction"],
+        sampler=optuna.samplers.TPESampler(seed=RANDOM_STATE),
+        pruner=make_pruner(pruner, stage, len(folds)),
+    )
+    finished = study.get_trials(deepcopy=False, states=[
+        optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED,
+    ])
+    remaining = max(0, n_trials - len(finished))
+    if workers == 1:
+        objective = OBJECTIVES[stage]
+        study.optimize(lambda trial: objective(trial, folds, nthread), n_trials=remaining)
+        return study
+
+    shares = [remaining // workers + (i < remaining % workers) for i in range(workers)]
+    fold_dirs = [str(fold.path) for fold in folds]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        futures = [
+            pool.submit(_search_worker, stage, fold_dirs, study_name, storage, share,
+                        RANDOM_STATE + i, nthread, pruner, sparse_cols)
+            for i, share in enumerate(shares) if share
+        ]
+        for future in futures:
+            future.result()
+    return study
+
+
+def completed_trials(study) -> list:
+    import optuna
+
+    return study.get_trials(deepcopy=False, states=[optuna.trial.TrialState.COMPLETE])
+
+
+# ---------------------------------------------------------------------------
+# Final fits
+# ---------------------------------------------------------------------------
+
+def make_model(stage: str, params: dict, n_estimators: int | None = None):
+    """sklearn wrapper for a stage; early stopping unless n_estimators is given."""
+    settings = STAGES[stage]
+    kwargs = {
+        "objective": settings["objective"], "eval_metric": settings["eval_metric"], "tree_method": "hist",
+        "n_estimators": n_estimators or settings["n_estimators"], "random_state": RANDOM_STATE, "n_jobs": -1,
+        **params,
+    }
+    if n_estimators is None:
+        kwargs["early_stopping_rounds"] = settings["early_stopping_rounds"]
+    model_class = {"ranker": xgb.XGBRanker, "regressor": xgb.XGBRegressor, "classifier": xgb.XGBClassifier}[stage]
+    return model_class(**kwargs)
+
+
+def _best_rounds(model) -> int:
+    return int(model.best_iteration + 1)
+
+
+def _final_rounds(rounds: float) -> int:
+    return int(math.ceil(rounds * FINAL_N_ESTIMATOR_BUFFER))
+
+
+def _positive_rows(df: pd.DataFrame) -> pd.DataFrame:
+    return df[(df["did_enter_within_60d"] == 1) & df["days_to_entry"].notna()]
+
+
+def _ranking_test_metrics(model_scores, ordered: pd.DataFrame, group: np.ndarray) -> dict:
+    tie_break = ordered["target_new_entry_rate_30d"].fillna(0.0).to_numpy(dtype=float)
+    return grouped_ranking_metrics(model_scores, ordered["did_enter_within_60d"].to_numpy(), group, tie_break, k=TOP_K)
+
+
+def _row_matrix(df: pd.DataFrame, feature_cols: list[str], fill_values, sparse: bool):
+    """Row-level features for the ranker / regressor: CSR with --sparse, else the dense frame."""
+    if sparse:
+        return sparse_feature_matrix(df, feature_cols, fill_values)
+    return make_feature_matrix(df, feature_cols, fill_values)
+
+
+def default_row_dropped() -> list[str]:
+    """The production model's pruned features (notebook 05 drops NB09's zero-gain features)."""
+    from src.config import load_training_summary
+
+    try:
+        return list(load_training_summary()["feature_pruning"]["row_dropped"])
+    except (FileNotFoundError, KeyError):
+        return []
+
+
+def train_pipeline(
+    data_dir: Path = DATA_DIR,
+    out_dir: Path = MODEL_DIR,
+    cache_dir: Path = TRAINING_CACHE_DIR,
+    ranker_trials: int = RANKER_N_TRIALS,
+    classifier_trials: int = CLASSIFIER_N_TRIALS,
+    regressor_trials: int = REGRESSOR_N_TRIALS,
+    time_blocks: int = TIME_BLOCKS,
+    row_dropped: list[str] | None = None,
+    workers: int = 1,
+    threads: int | None = None,
+    storage: str | None = None,
+    pruner: str = "median",
+    sparse: bool = False,
+) -> tuple[dict, dict[str, float]]:
+    """Tune, fit and export the three stages; returns (training summary, stage timings).
+    Parallel searches (``workers > 1``) default to a journal file in cache_dir.
+    ``sparse`` trains the ranker and regressor on CSR rank features.
+    """
+    from sklearn.isotonic import IsotonicRegression
+    from sklearn.linear_model import LinearRegression, LogisticRegression
+    from sklearn.metrics import brier_score_loss
+    from sklearn.preprocessing import StandardScaler
+
+    from src.models import inverse_transform_target, transform_target
+
+    timings: dict[str, float] = {}
+    t0 = time.perf_counter()
+    train_path, val_path, test_path = (data_dir / f"{s}.parquet" for s in ("train", "val", "test"))
+    row_train, row_val, row_test = (load_row_level_split(p) for p in (train_path, val_path, test_path))
+    track_train, track_val, track_test = (load_track_level_split(p) for p in (train_path, val_path, test_path))
+
+    row_feature_cols = [c for c in row_train.columns if c not in FEATURE_EXCLUDE]
+    row_dropped = default_row_dropped() if row_dropped is None else row_dropped
+    feature_cols = [c for c in row_feature_cols if c not in row_dropped]
+    fill_train = row_train[feature_cols].median(numeric_only=True)
+    combined = pd.concat([row_train, row_val], ignore_index=True)
+    fill_final = combined[feature_cols].median(numeric_only=True)
+    track_feature_cols = [c for c in track_train.columns if c not in TRACK_FEATURE_EXCLUDE]
+    track_fill = track_train[track_feature_cols].median(numeric_only=True)
+    positive_train, positive_val, positive_test = (_positive_rows(df) for df in (row_train, row_val, row_test))
+    timings["load"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ranker_folds = load_fold_matrices("ranker", row_train, feature_cols, train_path, time_blocks, cache_dir)
+    regressor_folds = load_fold_matrices("regressor", positive_train, feature_cols, train_path, time_blocks, cache_dir)
+    classifier_folds = load_fold_matrices("classifier", track_train, track_feature_cols, train_path, time_blocks, cache_dir)
+    timings["fold_matrices"] = time.perf_counter() - t0
+    if workers > 1 and storage is None:
+        storage = str(cache_dir / "optuna.journal")
+    search = {"workers": workers, "threads": threads, "storage": storage, "pruner": pruner}
+    row_search = {**search, "sparse_cols": feature_cols if sparse else None}
+
+    # --- Stage 2: ranker ---
+    t0 = time.perf_counter()
+    ranker_study = run_study("ranker", ranker_folds, ranker_trials, **row_search)
+    ranker_params = ranker_study.best_params
+    ordered_train, X_train, y_train, group_train = prepare_ranker_inputs(row_train, feature_cols, fill_train)
+    ordered_val, X_val, y_val, group_val = prepare_ranker_inputs(row_val, feature_cols, fill_train)
+    if sparse:
+        X_train = sparse_feature_matrix(ordered_train, feature_cols, fill_train)
+        X_val = sparse_feature_matrix(ordered_val, feature_cols, fill_train)
+    ranker_val_model = make_model("ranker", ranker_params)
+    ranker_val_model.fit(X_train, y_train, group=group_train, eval_set=[(X_val, y_val)], eval_group=[group_val], verbose=False)
+    ranker_rounds = _final_rounds(max(
+        ranker_study.best_trial.user_attrs["mean_best_iteration"], _best_rounds(ranker_val_model),
+    ))
+    ordered_final, X_final, y_final, group_final = prepare_ranker_inputs(combined, feature_cols, fill_final)
+    if sparse:
+        X_final = sparse_feature_matrix(ordered_final, feature_cols, fill_final)
+    ranker = make_model("ranker", ranker_params, n_estimators=ranker_rounds)
+    ranker.fit(X_final, y_final, group=group_final, verbose=False)
+    timings["stage2_ranker"] = time.perf_counter() - t0
+
+    # --- Stage 3: days-to-entry regressor ---
+    t0 = time.perf_counter()
+    regressor_study = run_study("regressor", regressor_folds, regressor_trials, **row_search)
+    target_transform = regressor_study.best_params["target_transform"]
+    regressor_params = {k: v for k, v in regressor_study.best_params.items() if k != "target_transform"}
+    regressor_val_model = make_model("regressor", regressor_params)
+    regressor_val_model.fit(
+        _row_matrix(positive_train, feature_cols, fill_train, sparse),
+        transform_target(positive_train["days_to_entry"], target_transform),
+        eval_set=[(
+            _row_matrix(positive_val, feature_cols, fill_train, sparse),
+            transform_target(positive_val["days_to_entry"], target_transform),
+        )],
+        verbose=False,
+    )
+    regressor_rounds = _final_rounds(_best_rounds(regressor_val_model))
+    positive_combined = pd.concat([positive_train, positive_val], ignore_index=True)
+    regressor = make_model("regressor", regressor_params, n_estimators=regressor_rounds)
+    regressor.fit(
+        _row_matrix(positive_combined, feature_cols, fill_final, sparse),
+        transform_target(positive_combined["days_to_entry"], target_transform),
+        verbose=False,
+    )
+    timings["stage3_regressor"] = time.perf_counter() - t0
+
+    # --- Stage 1: will-spread classifier + isotonic calibration (gate ablation) ---
+    t0 = time.perf_counter()
+    classifier_study = run_study("classifier", classifier_folds, classifier_trials, **search)
+    classifier_params = classifier_study.best_params
+    X_track_val = make_feature_matrix(track_val, track_feature_cols, track_fill)
+    y_track_val = track_val["will_spread"].astype(int)
+    classifier = make_model("classifier", classifier_params)
+    classifier.fit(
+        make_feature_matrix(track_train, track_feature_cols, track_fill), track_train["will_spread"].astype(int),
+        eval_set=[(X_track_val, y_track_val)], verbose=False,
+    )
+    raw_val = classifier.predict_proba(X_track_val)[:, 1]
+    raw_test = classifier.predict_proba(make_feature_matrix(track_test, track_feature_cols, track_fill))[:, 1]
+    calibrator = IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds="clip")
+    calibrator.fit(raw_val, y_track_val)
+    cal_val, cal_test = calibrator.predict(raw_val), calibrator.predict(raw_test)
+    y_track_test = track_test["will_spread"].astype(int)
+    threshold_map = {
+        str(float(floor)): choose_recall_threshold(y_track_val, cal_val, floor)[0] for floor in BUSINESS_PRECISION_FLOORS
+    }
+    timings["stage1_classifier"] = time.perf_counter() - t0
+
+    # --- Linear baselines ---
+    t0 = time.perf_counter()
+    lr_scaler = StandardScaler()
+    lr_model = LogisticRegression(class_weight="balanced", max_iter=1000, solver="lbfgs", random_state=RANDOM_STATE)
+    lr_model.fit(lr_scaler.fit_transform(make_feature_matrix(row_train, feature_cols, fill_train)),
+                 row_train["did_enter_within_60d"].to_numpy())
+    ordered_test, X_test, _, group_test = prepare_ranker_inputs(row_test, feature_cols, fill_final)
+    lr_test = _ranking_test_metrics(lr_model.predict_proba(lr_scaler.transform(X_test))[:, 1], ordered_test, group_test)
+
+    lr_time_scaler = StandardScaler()
+    lr_time_model = LinearRegression()
+    lr_time_model.fit(lr_time_scaler.fit_transform(make_feature_matrix(positive_train, feature_cols, fill_train)),
+                      positive_train["days_to_entry"].astype(float).to_numpy())
+    lr_time_pred = lr_time_model.predict(lr_time_scaler.transform(make_feature_matrix(positive_test, feature_cols, fill_final)))
+    lr_time_test = regression_metrics(positive_test["days_to_entry"].astype(float).to_numpy(), np.clip(lr_time_pred, 1.0, 60.0))
+    timings["baselines"] = time.perf_counter() - t0
+
+    # --- Export ---
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if sparse:
+        mark_sparse(ranker)
+        mark_sparse(regressor)
+    ranker.save_model(out_dir / "stage2_country_ranker.json")
+    regressor.save_model(out_dir / "stage3_days_to_entry_regressor.json")
+    classifier.save_model(out_dir / "stage1_will_spread_classifier.json")
+    pickles = {
+        "stage1_calibrator.pkl": calibrator,
+        "baseline_logistic_regression.pkl": lr_model,
+        "baseline_lr_scaler.pkl": lr_scaler,
+        "baseline_linear_regression_timing.pkl": lr_time_model,
+        "baseline_lr_time_scaler.pkl": lr_time_scaler,
+    }
+    for name, obj in pickles.items():
+        with open(out_dir / name, "wb") as f:
+            pickle.dump(obj, f)
+
+    summary = {
+        "config": {
+            "ranker_n_trials": ranker_trials,
+            "classifier_n_trials": classifier_trials,
+            "regressor_n_trials": regressor_trials,
+            "time_blocks": time_blocks,
+            "top_k": TOP_K,
+            "primary_precision_floor": PRIMARY_PRECISION_FLOOR,
+        },
+        "feature_pruning": {
+            "row_features_original": len(row_feature_cols),
+            "row_features_pruned": len(feature_cols),
+            "row_dropped": row_dropped,
+            "track_features": len(track_feature_cols),
+        },
+        "stage2_ranker": {
+            "best_params": ranker_params,
+            "best_cv_ndcg": float(ranker_study.best_value),
+            "final_n_estimators": ranker_rounds,
+            "n_trials_completed": len(completed_trials(ranker_study)),
+        },
+        "stage1_classifier": {
+            "best_params": classifier_params,
+            "best_cv_avg_precision": float(classifier_study.best_value),
+            "calibration_method": "isotonic",
+            "raw_brier_val": float(brier_score_loss(y_track_val, np.clip(raw_val, 1e-6, 1 - 1e-6))),
+            "calibrated_brier_val": float(brier_score_loss(y_track_val, np.clip(cal_val, 1e-6, 1 - 1e-6))),
+            "calibrated_brier_test": float(brier_score_loss(y_track_test, np.clip(cal_test, 1e-6, 1 - 1e-6))),
+            "threshold_map": threshold_map,
+        },
+        "stage3_regressor": {
+            "best_params": regressor_params,
+            "target_transform": target_transform,
+            "best_cv_mae": float(regressor_study.best_value),
+            "final_n_estimators": regressor_rounds,
+        },
+        "baseline_logistic_regression": {
+            "n_features": int(lr_model.n_features_in_),
+            "n_iterations": int(lr_model.n_iter_[0]),
+            "test_recall": lr_test[f"recall@{TOP_K}"],
+            "test_ndcg": lr_test[f"ndcg@{TOP_K}"],
+            "test_hit_rate": lr_test[f"hit_rate@{TOP_K}"],
+        },
+        "baseline_linear_regression_timing": {
+            "n_features": int(lr_time_model.n_features_in_),
+            "test_mae": lr_time_test["mae"],
+            "test_pct_within_3_days": lr_time_test["pct_within_3_days"],
+            "test_pct_within_7_days": lr_time_test["pct_within_7_days"],
+        },
+        "data": {
+            "row_train_rows": int(len(row_train)),
+            "row_val_rows": int(len(row_val)),
+            "row_test_rows": int(len(row_test)),
+            "track_train_tracks": int(len(track_train)),
+            "track_val_tracks": int(len(track_val)),
+            "track_test_tracks": int(len(track_test)),
+            "positive_train_rows": int(len(positive_train)),
+            "positive_val_rows": int(len(positive_val)),
+            "positive_test_rows": int(len(positive_test)),
+        },
+        "feature_encoding": "sparse" if sparse else "dense",
+        "pruned_row_feature_cols": feature_cols,
+        "track_feature_cols": track_feature_cols,
+        "fill_values_train": {col: float(fill_train[col]) for col in feature_cols},
+        "fill_values_final": {col: float(fill_final[col]) for col in feature_cols},
+    }
+    with open(out_dir / "training_summary.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary, timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the stage 1/2/3 models (notebook 05, headless).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fit = sub.add_parser("fit", help="Tune, fit and export all stages with training_summary.json")
+    fit.add_argument("--out", type=Path, default=MODEL_DIR)
+    fit.add_argument("--ranker-trials", type=int, default=RANKER_N_TRIALS)
+    fit.add_argument("--classifier-trials", type=int, default=CLASSIFIER_N_TRIALS)
+    fit.add_argument("--regressor-trials", type=int, default=REGRESSOR_N_TRIALS)
+    fit.add_argument("--drop", nargs="*", help="Row features to prune (default: the current model's)")
+    fit.add_argument("--workers", type=int, default=1, help="Search processes sharing one Optuna storage")
+    fit.add_argument("--threads", type=int, help="XGBoost threads per worker (default: cores / workers)")
+    fit.add_argument("--storage", help="sqlite:///file.db or a journal file path "
+                                       "(default: in memory, or <cache-dir>/optuna.journal with --workers)")
+    fit.add_argument("--pruner", choices=PRUNERS, default="median")
+    fit.add_argument("--sparse", action="store_true",
+                     help="Train the ranker and regressor on CSR rank features (a rank of 0 is missing)")
+    folds = sub.add_parser("folds", help="Build the fold matrix caches and list the folds")
+    for command in (fit, folds):
+        command.add_argument("--data-dir", type=Path, default=DATA_DIR)
+        command.add_argument("--cache-dir", type=Path, default=TRAINING_CACHE_DIR)
+        command.add_argument("--time-blocks", type=int, default=TIME_BLOCKS)
+    args = parser.parse_args()
+
+    if args.command == "fit":
+        summary, timings = train_pipeline(
+            args.data_dir, args.out, args.cache_dir, args.ranker_trials, args.classifier_trials,
+            args.regressor_trials, args.time_blocks, args.drop,
+            args.workers, args.threads, args.storage, args.pruner, args.sparse,
+        )
+        for stage, seconds in timings.items():
+            print(f"  {stage:28s} {seconds:8.2f} s")
+        print(f"  best cv ndcg@{TOP_K}  {summary['stage2_ranker']['best_cv_ndcg']:.4f}  "
+              f"best cv MAE {summary['stage3_regressor']['best_cv_mae']:.3f}  "
+              f"best cv AP {summary['stage1_classifier']['best_cv_avg_precision']:.4f}")
+        print(f"Wrote {args.out}")
+        return
+
+    train_path = args.data_dir / "train.parquet"
+    row_train = load_row_level_split(train_path)
+    row_dropped = set(default_row_dropped())
+    feature_cols = [c for c in row_train.columns if c not in FEATURE_EXCLUDE and c not in row_dropped]
+    track_train = load_track_level_split(train_path)
+    track_feature_cols = [c for c in track_train.columns if c not in TRACK_FEATURE_EXCLUDE]
+    frames = {
+        "ranker": (row_train, feature_cols),
+        "regressor": (_positive_rows(row_train), feature_cols),
+        "classifier": (track_train, track_feature_cols),
+    }
+    for stage, (frame, cols) in frames.items():
+        t0 = time.perf_counter()
+        matrices = load_fold_matrices(stage, frame, cols, train_path, args.time_blocks, args.cache_dir)
+        print(f"{stage} ({time.perf_counter() - t0:.2f} s, {fold_cache_dir(stage, train_path, cols, args.time_blocks, args.cache_dir)})")
+        for m in matrices:
+            info = m.info
+            print(f"  fold {info['fold']}: train {info['train_tracks']:,} tracks {info['train_start']}..{info['train_end']}, "
+                  f"val {info['val_tracks']:,} tracks {info['val_start']}..{info['val_end']}, "
+                  f"{len(m.arrays['train_y']):,} / {len(m.arrays['val_y']):,} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,116 +2,81 @@
 
 from __future__ import annotations
 
-import duckdb
 import pandas as pd
 import streamlit as st
 
-from src.config import COUNTRY_LIST, EVAL_DIR, TEST_PATH, TOP_K, V2_DATA_DIR, country_to_rank_col
+from src.config import EVAL_DIR, TEST_PATH, TEST_PREDICTIONS_PATH, TOP_K
+from src.data import TrackSlicer, intern_country_column
+from src.demo_artifacts import load_demo_track_summary
+from src.disk_cache import disk_cache
+from src.explain import ContributionStore, contribution_table, describe_contributions, load_test_contributions
+from src.footprints import footprint_entries, footprint_path, load_track_footprints
 
 
 @st.cache_data
+@disk_cache([TEST_PREDICTIONS_PATH])
 def load_test_predictions() -> pd.DataFrame:
-    return pd.read_parquet(EVAL_DIR / "test_predictions.parquet")
+    """Test predictions sorted by track_id, so TrackSlicer skips its sort."""
+    df = intern_country_column(pd.read_parquet(TEST_PREDICTIONS_PATH))
+    return df.sort_values("track_id", kind="stable").reset_index(drop=True)
 
 
 @st.cache_data
+@disk_cache([EVAL_DIR / "feature_importance.parquet"])
 def load_feature_importance() -> pd.DataFrame:
     return pd.read_parquet(EVAL_DIR / "feature_importance.parquet")
 
 
 @st.cache_data
+@disk_cache([EVAL_DIR / "model_comparison.parquet"])
 def load_model_comparison() -> pd.DataFrame:
     return pd.read_parquet(EVAL_DIR / "model_comparison.parquet")
 
 
 @st.cache_data
+@disk_cache([EVAL_DIR / "pipeline_evaluation.parquet"])
 def load_pipeline_evaluation() -> pd.DataFrame:
     return pd.read_parquet(EVAL_DIR / "pipeline_evaluation.parquet")
 
 
 @st.cache_data
+@disk_cache([TEST_PATH, footprint_path(TEST_PATH)])
 def load_origin_footprints() -> pd.DataFrame:
-    """Load rank columns from v3_features test split (one row per track)."""
-    con = duckdb.connect()
-    rank_cols = [country_to_rank_col(c) for c in COUNTRY_LIST]
-    cols = ", ".join(["track_id"] + rank_cols)
-    df = con.execute(
-        f"SELECT {cols} FROM read_parquet('{TEST_PATH.as_posix()}') "
-        f"GROUP BY track_id, {', '.join(rank_cols)}"
-    ).fetchdf()
-    con.close()
-    return df
+    """Track-level footprints of the test split (one row per track, sparse ranks)."""
+    return load_track_footprints(TEST_PATH)
+
+
+@st.cache_resource
+def load_footprint_index() -> TrackSlicer:
+    return TrackSlicer(load_origin_footprints())
 
 
 def _get_origin_footprint(track_id: str, track_df: pd.DataFrame) -> pd.DataFrame:
     """Get the countries where a track was charting at observation time."""
-    footprints = load_origin_footprints()
-    row = footprints[footprints["track_id"] == track_id]
+    row = load_footprint_index().get(track_id)
     if row.empty:
         return pd.DataFrame(columns=["Country", "Rank"])
     row = row.iloc[0]
-    entries = []
-    for country in COUNTRY_LIST:
-        rank_col = country_to_rank_col(country)
-        rank = row.get(rank_col, 0)
-        if rank and rank > 0:
-            entries.append({"Country": country, "Rank": int(rank)})
-    return pd.DataFrame(entries).sort_values("Rank")
+    return footprint_entries(row["origin_codes"], row["origin_ranks"])
 
 
-@st.cache_data
-def load_track_names() -> pd.DataFrame:
-    """Load track_id → title + artist mapping from the v2 dataset."""
-    con = duckdb.connect()
-    v2 = f"read_parquet('{V2_DATA_DIR.as_posix()}/*/*.parquet')"
-    names = con.execute(
-        f"SELECT DISTINCT track_id, FIRST(title) AS title, FIRST(artist) AS artist "
-        f"FROM {v2} GROUP BY track_id"
-    ).fetchdf()
-    con.close()
-    return names
+@st.cache_resource
+def get_test_contributions() -> ContributionStore | None:
+    """Precomputed float16 TreeSHAP contributions (memory-mapped), if available."""
+    return load_test_contributions()
 
 
-@st.cache_data
-def get_demo_data():
-    """Pre-compute track list and metrics from test predictions."""
-    df = load_test_predictions()
-    names = load_track_names()
-
-    # Identify tracks with 2+ actual target countries (interesting cases)
-    actual_counts = (
-        df[df["did_enter_within_60d"] == 1]
-        .groupby("track_id")["target_country"]
-        .nunique()
-        .reset_index(name="actual_countries")
-    )
-    interesting_tracks = actual_counts[actual_counts["actual_countries"] >= 2]
-
-    # Compute per-track metrics
-    track_metrics = []
-    for track_id in interesting_tracks["track_id"]:
-        track_df = df[df["track_id"] == track_id].copy()
-        actuals = set(track_df[track_df["did_enter_within_60d"] == 1]["target_country"])
-        top5 = track_df.nsmallest(TOP_K, "predicted_rank")
-        top5_countries = set(top5["target_country"])
-        hits = len(actuals & top5_countries)
-        n_actual = len(actuals)
-        track_metrics.append({
-            "track_id": track_id,
-            "actual_countries": n_actual,
-            "top5_hits": hits,
-            "recall": hits / n_actual if n_actual else 0,
-        })
-
-    track_summary = pd.DataFrame(track_metrics)
-    # Join track names
-    track_summary = track_summary.merge(names, on="track_id", how="left")
-    track_summary["title"] = track_summary["title"].fillna("Unknown")
-    track_summary["artist"] = track_summary["artist"].fillna("Unknown")
-    track_summary["display_name"] = track_summary["title"] + " — " + track_summary["artist"]
-    track_summary = track_summary.sort_values("actual_countries", ascending=False).reset_index(drop=True)
-
-    return df, track_summary
+@st.cache_resource
+def get_demo_data() -> tuple[TrackSlicer, pd.DataFrame, dict[str, int]]:
+    """Load test predictions indexed by track_id, the precomputed per-track
+    summary (demo_track_summary.parquet, rebuilt if test_predictions.parquet
+    changed) and each track's row position in that summary.
+    Cached as a resource: callers must treat the frames as read-only.
+    """
+    predictions = TrackSlicer(load_test_predictions())
+    track_summary = load_demo_track_summary()
+    summary_positions = {track_id: i for i, track_id in enumerate(track_summary["track_id"])}
+    return predictions, track_summary, summary_positions
 
 
 def render():
@@ -119,7 +84,7 @@ def render():
     st.markdown("Browse pre-computed predictions from the **2021 test set**. "
                 "Showing tracks that spread to 2+ countries.")
 
-    df, track_summary = get_demo_data()
+    predictions, track_summary, summary_positions = get_demo_data()
 
     # ── Metrics header ────────────────────────────────────────────────────
     pe = load_pipeline_evaluation()
@@ -173,8 +138,8 @@ def render():
         return
 
     # ── Prediction results for selected track ─────────────────────────────
-    track_row = track_summary[track_summary["track_id"] == selected].iloc[0]
-    track_df = df[df["track_id"] == selected].copy()
+    track_row = track_summary.iloc[summary_positions[selected]]
+    track_df = predictions.get(selected)
     actuals = set(track_df[track_df["did_enter_within_60d"] == 1]["target_country"])
 
     # Origin chart footprint — the model input at observation time
@@ -220,6 +185,21 @@ def render():
         missed_df["Actual Days"] = missed_df["Actual Days"].round(1)
         st.dataframe(missed_df, use_container_width=True, hide_index=True)
 
+    # ── Per-prediction explanations (expandable) ──────────────────────────
+    with st.expander("Why these countries?"):
+        contributions = get_test_contributions()
+        track_contribs = contributions.get(selected) if contributions is not None else pd.DataFrame()
+        countries = [c for c in top5["target_country"].astype(str) if c in track_contribs.index]
+        if not countries:
+            st.info("Precomputed explanations are not available (run `python -m src.explain`).")
+        else:
+            table = track_contribs.loc[countries]
+            st.markdown("\n\n".join(
+                f"**{country}**: {describe_contributions(row)}" for country, row in table.iterrows()
+            ))
+            st.dataframe(contribution_table(table), use_container_width=True)
+            st.caption("Exact TreeSHAP contributions of each feature group to the ranker score.")
+
     # ── Feature importance (expandable) ───────────────────────────────────
     with st.expander("Feature Importance"):
         fi = load_feature_importance()
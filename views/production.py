@@ -9,14 +9,25 @@ import streamlit as st
 
 from src.config import (
     COUNTRY_LIST,
-    COUNTRY_PRIMARY_LANG,
     FILL_VALUES_FINAL,
     PRUNED_ROW_FEATURE_COLS,
     SONG_LANGUAGES,
     TOP_K,
 )
-from src.data import build_prediction_rows, load_reference_data, lookup_artist
-from src.models import load_pretrained_models, predict_custom_song
+from src.artist_index import ArtistIndex, load_artist_index
+from src.corridors import load_corridors
+from src.country_priors import load_country_priors
+from src.explain import contribution_table, describe_contributions
+from src.data import build_prediction_rows, empty_artist_history, load_reference_data, lookup_artist
+from src.models import (
+    DEFAULT_SWEEP_RANK,
+    footprint_extensions,
+    load_pretrained_models,
+    predict_custom_song,
+    sweep_footprint_extensions,
+)
+
+SWEEP_RANK_OPTIONS = [1, 10, 25, 50, 100, 150, 200]
 
 
 def render():
@@ -28,14 +39,20 @@ def render():
 
     # Load models and reference data upfront
     models = load_pretrained_models()
-    reference_data = load_reference_data()
+    reference_data = {
+        **load_reference_data(),
+        "country_priors": load_country_priors(),
+        "corridors": load_corridors(),
+    }
+    artist_index = load_artist_index()
 
     # ── Input form ────────────────────────────────────────────────────────
     col_left, col_right = st.columns(2)
 
     with col_left:
         st.subheader("Song Info")
-        artist_name = st.text_input("Artist name", placeholder="e.g. Bad Bunny")
+        artist_query = st.text_input("Artist name", placeholder="e.g. Bad Bunny")
+        artist_key, artist_name = _artist_picker(artist_index, artist_query)
         song_title = st.text_input("Song title", placeholder="e.g. Dakiti")
 
         lang_options = [code for code, _ in SONG_LANGUAGES]
@@ -46,6 +63,11 @@ def render():
         )
 
         release_date = st.date_input("Release date", value=date.today())
+        observation_date = st.date_input(
+            "First chart date", value=date.today(),
+            help="The day the song starts charting. Artist history counts only charts "
+                 "before this day, as in training.",
+        )
         explicit = st.checkbox("Explicit")
         on_viral50 = st.checkbox("On Viral 50?")
 
@@ -135,16 +157,37 @@ def render():
                 "Time Signature", [3, 4, 5], index=1,
             )
 
+    # ── What-if sweep options ─────────────────────────────────────────────
+    with st.expander("What-if sweep: how do scores change if the song breaks into one more country?"):
+        st.caption(
+            "Each selected country is added to the footprint at each selected rank, "
+            "and all variants are scored together."
+        )
+        sweep_countries = st.multiselect(
+            "Countries to add", options=COUNTRY_LIST,
+            help="Leave empty to sweep every country not already in the footprint.",
+        )
+        sweep_ranks = st.multiselect("Ranks", options=SWEEP_RANK_OPTIONS, default=[DEFAULT_SWEEP_RANK])
+
     # ── Predict button ────────────────────────────────────────────────────
     st.divider()
 
-    if st.button("Predict", type="primary", use_container_width=True):
+    predict_col, sweep_col = st.columns(2)
+    with predict_col:
+        predict_clicked = st.button("Predict", type="primary", use_container_width=True)
+    with sweep_col:
+        sweep_clicked = st.button("Run what-if sweep", use_container_width=True)
+
+    if predict_clicked or sweep_clicked:
         if not artist_name.strip():
             st.warning("Please enter an artist name.")
             return
 
         with st.spinner("Looking up artist history..."):
-            artist_info = lookup_artist(artist_name)
+            artist_info = (
+                lookup_artist(artist_key, exact=True, as_of=observation_date) if artist_key
+                else empty_artist_history()
+            )
 
         # Show artist lookup results
         if artist_info["artist_prior_chart_count"] > 0:
@@ -154,7 +197,7 @@ def render():
                 f"regions (best rank: #{artist_info['artist_prior_best_rank']})"
             )
         else:
-            st.info(f"**{artist_name}** not found in dataset — using zero-history defaults.")
+            st.info(f"No charts for **{artist_name}** before {observation_date} — using zero-history defaults.")
 
         song_input = {
             "artist_name": artist_name,
@@ -163,10 +206,24 @@ def render():
             "chart_footprint": st.session_state.chart_footprint,
             "on_viral50": on_viral50,
             "release_date": release_date,
+            "observation_date": observation_date,
             "explicit": explicit,
             "audio_features": audio_features,
         }
 
+        if sweep_clicked:
+            extensions = footprint_extensions(
+                st.session_state.chart_footprint, sweep_countries or None, sweep_ranks or None,
+            )
+            with st.spinner(f"Scoring {len(extensions)} footprint variants..."):
+                sweep = sweep_footprint_extensions(
+                    models, song_input, reference_data, artist_info, extensions,
+                    PRUNED_ROW_FEATURE_COLS, FILL_VALUES_FINAL,
+                )
+            st.divider()
+            _display_sweep(sweep)
+            return
+
         with st.spinner("Building prediction rows..."):
             prediction_df = build_prediction_rows(song_input, reference_data, artist_info)
 
@@ -178,10 +235,36 @@ def render():
             )
 
         st.divider()
-        _display_results(results, song_input, artist_info)
+        _display_results(results)
+
+
+def _artist_picker(artist_index: ArtistIndex, query: str) -> tuple[str | None, str]:
+    """Suggest known artists for the typed name. Returns (canonical artist_key
+    or None for an artist not in v2, display name).
+    """
+    suggestions = artist_index.suggest(query) if query.strip() else []
+    if not suggestions:
+        return artist_index.resolve(query), query.strip()
+
+    labels = {s.artist_key: f"{s.display_name} ({s.chart_count:,} chart entries)" for s in suggestions}
+    typed_key = artist_index.resolve(query)
+    options = [s.artist_key for s in suggestions]
+    if typed_key is None:
+        options.insert(0, None)  # default to the typed name as a new, unknown artist
+    else:
+        # An exact match goes first even if a more-charted artist shares the prefix
+        options = [typed_key] + [key for key in options if key != typed_key]
+        labels.setdefault(typed_key, artist_index.display_name(typed_key))
+    selected = st.selectbox(
+        "Matching artists", options=options,
+        format_func=lambda key: labels[key] if key is not None else f"“{query.strip()}” (new artist, no chart history)",
+    )
+    if selected is None:
+        return None, query.strip()
+    return selected, artist_index.display_name(selected)
 
 
-def _display_results(results: dict, song_input: dict, artist_info: dict):
+def _display_results(results: dict):
     """Display prediction results."""
     top_k = results["top_k"]
     all_scores = results["all_scores"]
@@ -204,24 +287,68 @@ def _display_results(results: dict, song_input: dict, artist_info: dict):
 
     # Explanation section
     with st.expander("Why these countries?"):
-        song_lang = song_input.get("song_language", "en")
-        origin_countries = {e["country"] for e in song_input.get("chart_footprint", [])}
-
-        explanations = []
-        for _, row in top_k.iterrows():
-            country = row["target_country"]
-            reasons = []
-            target_lang = COUNTRY_PRIMARY_LANG.get(country, "")
-            if song_lang == target_lang:
-                reasons.append("song language matches")
-            if country in artist_info.get("charted_countries", set()):
-                reasons.append("artist has charted here before")
-            for oc in origin_countries:
-                if COUNTRY_PRIMARY_LANG.get(oc, "") == target_lang:
-                    reasons.append(f"shares language with {oc}")
-                    break
-            if not reasons:
-                reasons.append("model-inferred cultural/market proximity")
-            explanations.append(f"**{country}**: {', '.join(reasons)}")
-
-        st.markdown("\n\n".join(explanations))
+        _display_contributions(results["contributions"], top_k["target_country"].astype(str))
+        st.caption(
+            f"Exact TreeSHAP contributions of each feature group to the ranker score "
+            f"(computed in {results['explain_ms']:.0f} ms)."
+        )
+
+
+def _display_sweep(sweep: dict):
+    """Heatmap of ranker score deltas: added country (and rank) × target country."""
+    import altair as alt
+
+    deltas = sweep["deltas"].dropna(subset=["score_delta"]).copy()
+    st.subheader("What-if Sweep")
+    st.caption(
+        f"{sweep['n_variants']} footprint variants scored in {sweep['timing_ms']:.0f} ms. "
+        "Cells show the change in raw ranker score for each target country "
+        "versus the current footprint (blank where the target would already chart)."
+    )
+    if deltas.empty:
+        st.info("No footprint variants to compare.")
+        return
+
+    multi_rank = deltas["added_rank"].nunique() > 1
+    deltas["variant"] = (
+        deltas["added_country"] + " @ #" + deltas["added_rank"].astype(str)
+        if multi_rank else deltas["added_country"]
+    )
+    variant_order = (
+        deltas.groupby("variant")["score_delta"].mean().sort_values(ascending=False).index.tolist()
+    )
+    limit = float(deltas["score_delta"].abs().max()) or 1.0
+    heatmap = (
+        alt.Chart(deltas)
+        .mark_rect()
+        .encode(
+            x=alt.X("target_country:N", title="Target country", sort=COUNTRY_LIST),
+            y=alt.Y("variant:N", title="Added to footprint", sort=variant_order),
+            color=alt.Color(
+                "score_delta:Q", title="Score Δ",
+                scale=alt.Scale(scheme="redblue", domain=[-limit, limit], reverse=True),
+            ),
+            tooltip=[
+                alt.Tooltip("variant:N", title="Added"),
+                alt.Tooltip("target_country:N", title="Target"),
+                alt.Tooltip("score_delta:Q", title="Score Δ", format="+.3f"),
+                alt.Tooltip("days_delta:Q", title="Days-to-entry Δ", format="+.1f"),
+            ],
+        )
+        .properties(height=max(300, 14 * len(variant_order)))
+    )
+    st.altair_chart(heatmap, use_container_width=True)
+
+    # Biggest single lifts, for reading off without the chart
+    top = deltas.nlargest(10, "score_delta")[["variant", "target_country", "score_delta", "days_delta"]]
+    top.columns = ["Added", "Target", "Score Δ", "Days-to-entry Δ"]
+    st.dataframe(top.round(3), use_container_width=True, hide_index=True)
+
+
+def _display_contributions(contributions: pd.DataFrame, countries):
+    """Per-country sentence plus a table of grouped contributions."""
+    table = contributions.loc[list(countries)]
+    st.markdown("\n\n".join(
+        f"**{country}**: {describe_contributions(row)}" for country, row in table.iterrows()
+    ))
+    st.dataframe(contribution_table(table), use_container_width=True)